@@ -1,31 +1,225 @@
+import asyncio
 import json
+import logging
 from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from core.services.ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+class SpendingDataAccess:
+    """
+    Async read path for spending predictions.
+
+    Reads only the projected `date`, `amount` and `category` fields of a user's
+    expenses, page by page. Uses the async Firestore client when one is
+    available and otherwise runs the synchronous admin client in a worker
+    thread so the event loop is never blocked.
+
+    Read failures (including a missing client) raise rather than returning
+    no rows, so they are never mistaken for a user without enough data.
+    """
+
+    PROJECTED_FIELDS = ['date', 'amount', 'category']
+    PAGE_SIZE = 1000
+    MAX_IN_FILTER = 30  # Firestore limit for 'in' filters
+
+    def __init__(self, firestore_client=None, async_client=None, page_size: int = PAGE_SIZE):
+        self.firestore_client = firestore_client
+        self.async_client = async_client if async_client is not None else self._resolve_async_client(firestore_client)
+        self.page_size = page_size
+
+    @staticmethod
+    def _resolve_async_client(firestore_client):
+        """Create an async Firestore client alongside the sync admin client, if possible."""
+        if firestore_client is None:
+            return None
+        try:
+            from firebase_admin import firestore_async
+            return firestore_async.client()
+        except Exception as e:
+            logger.debug(f"Async Firestore client unavailable, using threaded sync reads: {e}")
+            return None
+
+    async def fetch_user_expenses(self, user_id: str) -> List[Dict[str, Any]]:
+        """Fetch the projected expense rows for a single user."""
+        client = self._client()
+
+        query = client.collection('transactions') \
+            .where('userId', '==', user_id) \
+            .where('type', '==', 'expense') \
+            .select(self.PROJECTED_FIELDS) \
+            .order_by('__name__')
+
+        return await self._read_all_pages(query)
+
+    async def fetch_expenses_for_users(self, user_ids: List[str]) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Fetch projected expense rows for many users at once.
+
+        User IDs are grouped into 'in' queries of up to 30 users each and the
+        groups are read concurrently. If any group fails, the error is raised.
+        """
+        rows_by_user: Dict[str, List[Dict[str, Any]]] = {user_id: [] for user_id in user_ids}
+        if not user_ids:
+            return rows_by_user
+        client = self._client()
+
+        unique_ids = list(dict.fromkeys(user_ids))
+        chunks = [
+            unique_ids[i:i + self.MAX_IN_FILTER]
+            for i in range(0, len(unique_ids), self.MAX_IN_FILTER)
+        ]
+
+        queries = [
+            client.collection('transactions')
+            .where('userId', 'in', chunk)
+            .where('type', '==', 'expense')
+            .select(self.PROJECTED_FIELDS + ['userId'])
+            .order_by('__name__')
+            for chunk in chunks
+        ]
+
+        results = await asyncio.gather(*(self._read_all_pages(query) for query in queries))
+
+        for result in results:
+            for row in result:
+                owner = row.get('userId')
+                if owner in rows_by_user:
+                    rows_by_user[owner].append(row)
+
+        return rows_by_user
+
+    def _client(self):
+        client = self.async_client or self.firestore_client
+        if client is None:
+            raise RuntimeError("Firestore client is not configured")
+        return client
+
+    async def _read_all_pages(self, query) -> List[Dict[str, Any]]:
+        rows: List[Dict[str, Any]] = []
+        last_doc = None
+
+        while True:
+            page_query = query.limit(self.page_size)
+            if last_doc is not None:
+                page_query = page_query.start_after(last_doc)
+
+            docs = await self._read_page(page_query)
+            rows.extend(doc.to_dict() for doc in docs)
+
+            if len(docs) < self.page_size:
+                return rows
+            last_doc = docs[-1]
+
+    async def _read_page(self, page_query) -> list:
+        if self.async_client is not None:
+            return [doc async for doc in page_query.stream()]
+        return await asyncio.to_thread(lambda: list(page_query.stream()))
+
 
 class PredictionAgent:
-    def __init__(self, firestore_client):
+    # Nightly precomputed forecasts must survive until the next run
+    FORECAST_TTL_SECONDS = 26 * 3600
+    # Users who asked for a forecast recently are precomputed nightly
+    ACTIVE_USER_TTL_SECONDS = 7 * 24 * 3600
+    MAX_CACHED_FORECASTS = 50000
+
+    def __init__(self, firestore_client, async_client=None):
         self.firestore_client = firestore_client
+        self.data_access = SpendingDataAccess(firestore_client, async_client=async_client)
+        self.forecast_cache = TTLCache(
+            max_size=self.MAX_CACHED_FORECASTS, ttl_seconds=self.FORECAST_TTL_SECONDS
+        )
+        self.active_users = TTLCache(
+            max_size=self.MAX_CACHED_FORECASTS, ttl_seconds=self.ACTIVE_USER_TTL_SECONDS
+        )
 
     async def generate_spending_prediction(self, user_id: str) -> dict:
-        transactions_ref = self.firestore_client.collection('transactions')
-        query = transactions_ref.where('userId', '==', user_id).where('type', '==', 'expense')
-        
-        docs = query.stream()
-        
+        transactions = await self.data_access.fetch_user_expenses(user_id)
+        return self._build_prediction(transactions)
+
+    async def generate_spending_predictions(self, user_ids: List[str]) -> Dict[str, dict]:
+        """Generate predictions for many users from one batched read."""
+        rows_by_user = await self.data_access.fetch_expenses_for_users(user_ids)
+        return {
+            user_id: self._build_prediction(rows_by_user.get(user_id, []))
+            for user_id in user_ids
+        }
+
+    async def get_spending_prediction(self, user_id: str) -> dict:
+        """Serve a precomputed forecast, computing and caching it on a miss."""
+        self.active_users.set(user_id, True)
+        cached = self.forecast_cache.get(user_id)
+        if cached is not None:
+            return cached
+
+        prediction = await self.generate_spending_prediction(user_id)
+        self._cache_forecast(user_id, prediction)
+        return prediction
+
+    async def get_spending_predictions(self, user_ids: List[str]) -> Dict[str, dict]:
+        """Serve forecasts for many users, computing all misses in one batch."""
+        for user_id in user_ids:
+            self.active_users.set(user_id, True)
+
+        predictions = self.forecast_cache.get_many(user_ids)
+        misses = [user_id for user_id in dict.fromkeys(user_ids) if user_id not in predictions]
+
+        if misses:
+            computed = await self.generate_spending_predictions(misses)
+            for user_id, prediction in computed.items():
+                self._cache_forecast(user_id, prediction)
+            predictions.update(computed)
+
+        return {user_id: predictions[user_id] for user_id in user_ids}
+
+    async def precompute_forecasts(self, user_ids: Optional[List[str]] = None, chunk_size: int = 300) -> int:
+        """
+        Recompute and cache forecasts, by default for every recently active user.
+
+        Returns:
+            Number of forecasts written to the cache
+        """
+        user_ids = user_ids if user_ids is not None else self.active_users.keys()
+        written = 0
+
+        for i in range(0, len(user_ids), chunk_size):
+            chunk = user_ids[i:i + chunk_size]
+            try:
+                computed = await self.generate_spending_predictions(chunk)
+            except Exception as e:
+                # Keep the cached forecasts; these users are retried on a miss or next run
+                logger.error(f"Error precomputing forecasts for {len(chunk)} users: {e}")
+                continue
+            for user_id, prediction in computed.items():
+                written += self._cache_forecast(user_id, prediction)
+
+        logger.info(f"Precomputed {written} spending forecasts")
+        return written
+
+    def _cache_forecast(self, user_id: str, prediction: dict) -> bool:
+        """Cache a forecast; error results are recomputed on the next request instead."""
+        if "error" in prediction:
+            return False
+        self.forecast_cache.set(user_id, prediction)
+        return True
+
+    def _build_prediction(self, transactions: List[Dict[str, Any]]) -> dict:
         monthly_spending = {}
-        
-        # Using a non-async for loop with an async generator is not ideal,
-        # but it's what the original code had. This should be fixed later.
-        for doc in await docs.to_list():
-            transaction = doc.to_dict()
+
+        for transaction in transactions:
             try:
                 # Assuming 'date' is a string in ISO 8601 format
                 date = datetime.fromisoformat(transaction['date'])
                 month_key = date.strftime('%Y-%m')
-                
+
                 if month_key not in monthly_spending:
                     monthly_spending[month_key] = 0
                 monthly_spending[month_key] += transaction.get('amount', 0)
-            except (ValueError, TypeError):
+            except (KeyError, ValueError, TypeError):
                 # Skip transactions with invalid date format or missing amount
                 continue
 
@@ -34,7 +228,7 @@ class PredictionAgent:
 
         total_spending = sum(monthly_spending.values())
         average_monthly_spending = total_spending / len(monthly_spending)
-        
+
         # Predict next month's spending
         today = datetime.now()
         next_month = today + timedelta(days=30)
@@ -45,4 +239,4 @@ class PredictionAgent:
             "predicted_spending": round(average_monthly_spending, 2),
             "based_on_months": len(monthly_spending),
             "historical_data": monthly_spending,
-        } 
\ No newline at end of file
+        }
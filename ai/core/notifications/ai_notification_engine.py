@@ -13,7 +13,7 @@ Key Features:
 """
 
 import logging
-from typing import Dict, List, Optional, Any, Tuple
+from typing import Dict, List, Optional, Any, Tuple, Callable, Awaitable
 from datetime import datetime, timedelta
 from collections import defaultdict
 import asyncio
@@ -32,35 +32,110 @@ from .notification_scorer import NotificationScorer
 from .anomaly_detector import AnomalyDetector
 from .context_generator import ContextGenerator
 from .personalization_engine import PersonalizationEngine
-from core.services.google_cloud_cost_service import RequestType
-from core.simple_ai_service import call_gemini_api
+from .feature_store import UserFeatureStore
+from .content_generator import ContentGenerator
+from .delivery_scheduler import DeliveryScheduler
+from .rate_limiter import create_rate_limiter
+from .notification_history import NotificationHistory
+from .notification_writer import NotificationWriter
+from .notification_counters import NotificationCounters
+from core.services.queue_backends import QueueBackend, create_queue_backend
 
 logger = logging.getLogger(__name__)
 
 
+class _NotificationDraft:
+    """A trigger that passed every check and is waiting for its content"""
+    
+    __slots__ = (
+        'trigger', 'category', 'context', 'preferences',
+        'importance_score', 'relevance_score', 'priority', 'deliver_at',
+    )
+    
+    def __init__(
+        self,
+        trigger: NotificationTrigger,
+        category: NotificationCategory,
+        context: NotificationContext,
+        preferences: UserNotificationPreferences,
+        importance_score: float,
+        relevance_score: float,
+        priority: NotificationPriority,
+        deliver_at: Optional[datetime] = None
+    ):
+        self.trigger = trigger
+        self.category = category
+        self.context = context
+        self.preferences = preferences
+        self.importance_score = importance_score
+        self.relevance_score = relevance_score
+        self.priority = priority
+        self.deliver_at = deliver_at
+
+
 class AINotificationEngine:
     """
     Main AI-powered notification engine that orchestrates the entire notification lifecycle.
     """
     
-    def __init__(self, db_client=None):
+    # A user's batch with at least this many transactions is digested
+    DIGEST_MIN_TRANSACTIONS = 3
+    DIGEST_MAX_ITEMS = 5
+    # Anomalies at or above this risk are sent individually, never digested
+    DIGEST_URGENT_RISK_SCORE = 0.5
+    
+    # Compressed context snapshots referenced by stored notifications
+    CONTEXT_COLLECTION = "notification_contexts"
+    
+    # A notification is dropped when both scores fall below these
+    MIN_IMPORTANCE_SCORE = 30.0
+    MIN_RELEVANCE_SCORE = 40.0
+    
+    # Pipeline counters reported by get_pipeline_stats(), in stage order
+    PIPELINE_STAGES = (
+        "received",
+        "disabled",
+        "rate_limited",
+        "category_disabled",
+        "prefilter_score",
+        "context_generated",
+        "score_threshold",
+        "created",
+        "deferred",
+        "errors",
+    )
+    
+    def __init__(self, db_client=None, queue_backend: Optional[QueueBackend] = None):
         self.db = db_client
         
         # Initialize sub-components
+        self.feature_store = UserFeatureStore()
         self.scorer = NotificationScorer()
-        self.anomaly_detector = AnomalyDetector()
-        self.context_generator = ContextGenerator(db_client)
-        self.personalization = PersonalizationEngine(db_client)
-        
-        # Notification queue and history
-        self.pending_notifications: Dict[str, List[Notification]] = defaultdict(list)
-        self.notification_history: Dict[str, List[Notification]] = defaultdict(list)
+        self.anomaly_detector = AnomalyDetector(feature_store=self.feature_store)
+        self.context_generator = ContextGenerator(db_client, feature_store=self.feature_store)
+        self.content_generator = ContentGenerator()
+        self.writer = NotificationWriter(db_client)
+        self.personalization = PersonalizationEngine(db_client, self.writer)
+        # Per-user stats document, updated alongside every notification write
+        self.counters = NotificationCounters(db_client, self.writer)
         
-        # Rate limiting
-        self.notification_counts: Dict[str, Dict[str, int]] = defaultdict(
-            lambda: {'hour': 0, 'day': 0}
+        # Deferred delivery (quiet hours, optimal delivery time); the API
+        # layer passes the backend its trigger queue and push outbox use
+        self.delivery_scheduler = DeliveryScheduler(
+            self._deliver_scheduled,
+            backend=queue_backend if queue_backend is not None else create_queue_backend()
         )
-        self.last_reset: Dict[str, datetime] = {}
+        # Set by the API layer to push notifications once they are delivered
+        self.push_sender: Optional[Callable[[List[Notification]], Awaitable[Any]]] = None
+        
+        # Recent notification summaries (bounded)
+        self.notification_history = NotificationHistory()
+        
+        # Rate limiting (shared across instances when REDIS_URL is set)
+        self.rate_limiter = create_rate_limiter()
+        
+        # Per-stage counts of triggers seen and dropped
+        self.pipeline_metrics: Dict[str, int] = defaultdict(int)
         
         logger.info("🧠 AI Notification Engine initialized")
     
@@ -79,122 +154,343 @@ class AINotificationEngine:
         Returns:
             Notification object if one should be sent, None otherwise
         """
+        self.pipeline_metrics["received"] += 1
         try:
-            logger.debug(f"🔔 Processing trigger: {trigger.trigger_type} for user {trigger.user_id}")
-            
-            # 1. Load user preferences if not provided
-            if user_preferences is None:
-                user_preferences = await self.personalization.get_user_preferences(trigger.user_id)
-            
-            # 2. Check if notifications are enabled globally
-            if not user_preferences.notifications_enabled:
-                logger.debug(f"Notifications disabled for user {trigger.user_id}")
+            # Scored up front, like queued batches, so the prefilter knows
+            # whether a new transaction could become a fraud alert
+            await self._score_transactions(trigger.user_id, [trigger])
+            draft = await self._prepare_notification(trigger, user_preferences)
+            if draft is None:
                 return None
             
-            # 3. Check rate limiting
-            if not self._check_rate_limit(trigger.user_id, user_preferences):
-                logger.debug(f"Rate limit exceeded for user {trigger.user_id}")
-                return None
-            
-            # 4. Determine notification category
-            category = self._determine_category(trigger)
+            title, body, rich_content = await self._generate_notification_content(
+                trigger, draft.category, draft.context, draft.preferences
+            )
+            return await self._finalize_notification(draft, title, body, rich_content)
+        except Exception as e:
+            self.pipeline_metrics["errors"] += 1
+            logger.error(f"❌ Error processing trigger: {e}", exc_info=True)
+            return None
+        finally:
+            self._record_transaction(trigger)
+    
+    async def process_user_triggers(
+        self,
+        user_id: str,
+        triggers: List[NotificationTrigger]
+    ) -> List[Notification]:
+        """
+        Process a batch of triggers for one user, oldest first.
+        
+        New transactions in the batch are scored for anomalies in one
+        vectorized pass (including velocity within the batch) before the
+        triggers go through the pipeline.
+        
+        Returns:
+            Notifications that were created
+        """
+        return await self.process_user_batches({user_id: triggers})
+    
+    async def process_user_batches(
+        self,
+        batches: Dict[str, List[NotificationTrigger]]
+    ) -> List[Notification]:
+        """
+        Process queued triggers for several users together.
+        
+        Each user's triggers are scored and coalesced, then taken through the
+        pipeline in order; the content for every notification that survives
+        is generated in as few batched LLM requests as possible.
+        
+        Args:
+            batches: user_id -> that user's triggers
             
-            # 5. Check if this category is enabled
-            if not user_preferences.category_preferences.get(category, True):
-                logger.debug(f"Category {category} disabled for user {trigger.user_id}")
+        Returns:
+            Notifications that were created
+        """
+        
+        drafts: List[_NotificationDraft] = []
+        for user_id, triggers in batches.items():
+            triggers = await self._score_transactions(user_id, triggers)
+            for trigger in self._coalesce_transactions(user_id, triggers):
+                self.pipeline_metrics["received"] += 1
+                try:
+                    draft = await self._prepare_notification(trigger, None)
+                    if draft is not None:
+                        drafts.append(draft)
+                except Exception as e:
+                    self.pipeline_metrics["errors"] += 1
+                    logger.error(f"❌ Error processing trigger: {e}", exc_info=True)
+                finally:
+                    self._record_transaction(trigger)
+        
+        if not drafts:
+            return []
+        
+        contents = await self._generate_notification_contents(drafts)
+        
+        # Finalized together so their writes share WriteBatches
+        results = await asyncio.gather(*(
+            self._finalize_notification(draft, title, body, rich_content)
+            for draft, (title, body, rich_content) in zip(drafts, contents)
+        ), return_exceptions=True)
+        
+        notifications = []
+        for result in results:
+            if isinstance(result, Exception):
+                self.pipeline_metrics["errors"] += 1
+                logger.error(f"❌ Error creating notification: {result}", exc_info=result)
+            else:
+                notifications.append(result)
+        
+        return notifications
+    
+    async def _score_transactions(
+        self,
+        user_id: str,
+        triggers: List[NotificationTrigger]
+    ) -> List[NotificationTrigger]:
+        """Sort a user's triggers oldest first and batch-score new transactions for anomalies"""
+        
+        triggers = sorted(triggers, key=lambda t: t.timestamp)
+        unscored = [
+            t for t in triggers
+            if t.trigger_type == "transaction_created" and "anomaly" not in t.data
+        ]
+        
+        if unscored:
+            try:
+                await self.context_generator.ensure_features(user_id)
+                anomalies = self.anomaly_detector.detect_anomalies_batch(
+                    [t.data.get("transaction") or {} for t in unscored], user_id
+                )
+                for trigger, anomaly in zip(unscored, anomalies):
+                    trigger.data["anomaly"] = anomaly
+            except Exception as e:
+                logger.error(f"❌ Error scoring transaction batch for user {user_id}: {e}")
+        
+        return triggers
+    
+    def _record_transaction(self, trigger: NotificationTrigger):
+        # Fold every new transaction into the user's rolling features,
+        # after it has been scored against the previous baseline
+        if trigger.trigger_type == "transaction_created":
+            self.feature_store.record_transaction(
+                trigger.user_id, trigger.data.get("transaction") or {}
+            )
+    
+    def _coalesce_transactions(
+        self,
+        user_id: str,
+        triggers: List[NotificationTrigger]
+    ) -> List[NotificationTrigger]:
+        """
+        Fold a burst of routine transaction triggers into one digest.
+        
+        Fraud and critical items stay individual and go first; the rest are
+        ranked by a cheap pre-score and summarized, before any context is
+        generated or content requested for them.
+        """
+        
+        transactions = [t for t in triggers if t.trigger_type == "transaction_created"]
+        if len(transactions) < self.DIGEST_MIN_TRANSACTIONS:
+            return triggers
+        
+        urgent, routine = [], []
+        for trigger in transactions:
+            anomaly = trigger.data.get("anomaly") or {}
+            if anomaly.get('risk_score', 0) >= self.DIGEST_URGENT_RISK_SCORE or \
+                    trigger.priority_override == NotificationPriority.CRITICAL:
+                urgent.append(trigger)
+            else:
+                routine.append(trigger)
+        
+        others = [t for t in triggers if t.trigger_type != "transaction_created"]
+        if len(routine) < 2:
+            return urgent + routine + others
+        
+        routine.sort(key=self.scorer.pre_score, reverse=True)
+        digest = NotificationTrigger.transaction_digest(
+            user_id,
+            [t.data.get("transaction") or {} for t in routine],
+            max_items=self.DIGEST_MAX_ITEMS
+        )
+        digest.data["flagged_count"] = sum(1 for t in routine if t.data.get("anomaly"))
+        
+        # Digested transactions skip process_trigger, so fold them in here
+        self.pipeline_metrics["digested_transactions"] += len(routine)
+        for trigger in routine:
+            self.feature_store.record_transaction(user_id, trigger.data.get("transaction") or {})
+        
+        logger.info(f"🧾 Coalesced {len(routine)} transactions into a digest for user {user_id} ({len(urgent)} sent individually)")
+        return urgent + [digest] + others
+    
+    async def _prepare_notification(
+        self,
+        trigger: NotificationTrigger,
+        user_preferences: Optional[UserNotificationPreferences]
+    ) -> Optional["_NotificationDraft"]:
+        """
+        Run a trigger through every check up to content generation.
+        
+        Returns:
+            A draft to generate content for, or None if the trigger was dropped
+        """
+        logger.debug(f"🔔 Processing trigger: {trigger.trigger_type} for user {trigger.user_id}")
+        
+        # 1. Load user preferences if not provided
+        if user_preferences is None:
+            user_preferences = await self.personalization.get_user_preferences(trigger.user_id)
+        
+        # 2. Check if notifications are enabled globally
+        if not user_preferences.notifications_enabled:
+            logger.debug(f"Notifications disabled for user {trigger.user_id}")
+            self.pipeline_metrics["disabled"] += 1
+            return None
+        
+        # 3. Check rate limiting
+        if not await self._check_rate_limit(trigger.user_id, user_preferences):
+            logger.debug(f"Rate limit exceeded for user {trigger.user_id}")
+            self.pipeline_metrics["rate_limited"] += 1
+            return None
+        
+        # 4. Determine notification category
+        category = self._determine_category(trigger)
+        
+        # 5. Check if this category is enabled
+        if not user_preferences.category_preferences.get(category, True):
+            logger.debug(f"Category {category} disabled for user {trigger.user_id}")
+            self.pipeline_metrics["category_disabled"] += 1
+            return None
+        
+        # 6. Cheap first pass: drop triggers that cannot pass the score
+        #    threshold before any context is generated. Anything that may
+        #    turn into a fraud alert always goes through the full pipeline.
+        if not self._may_be_fraud(trigger):
+            importance_bound = self.scorer.importance_upper_bound(trigger)
+            relevance_bound = await self.personalization.relevance_upper_bound(
+                trigger, trigger.user_id
+            )
+            if importance_bound < self.MIN_IMPORTANCE_SCORE and relevance_bound < self.MIN_RELEVANCE_SCORE:
+                logger.debug(f"Scores cannot pass threshold: importance<={importance_bound}, relevance<={relevance_bound}")
+                self.pipeline_metrics["prefilter_score"] += 1
                 return None
-            
-            # 6. Generate rich context
-            context = await self.context_generator.generate_context(trigger, user_preferences)
-            
-            # 7. Detect anomalies (fraud, unusual patterns)
-            if trigger.trigger_type == "transaction_created":
+        
+        # 7. Generate rich context
+        context = await self.context_generator.generate_context(trigger, user_preferences)
+        self.pipeline_metrics["context_generated"] += 1
+        
+        # 8. Detect anomalies (fraud, unusual patterns), unless already scored in a batch
+        anomalies = None
+        if trigger.trigger_type == "transaction_created":
+            if "anomaly" in trigger.data:
+                anomalies = trigger.data["anomaly"]
+            else:
                 anomalies = await self.anomaly_detector.detect_anomalies(
                     trigger.data.get("transaction"),
                     trigger.user_id,
                     context
                 )
-                if anomalies:
-                    # Upgrade to fraud alert
-                    category = NotificationCategory.FRAUD_DETECTION
-                    context.risk_score = anomalies.get('risk_score', 0.8)
-                    context.gemini_analysis = anomalies.get('explanation', '')
-            
-            # 8. Calculate importance and relevance scores
-            importance_score = self.scorer.calculate_importance(trigger, context, anomalies if 'anomalies' in locals() else None)
-            relevance_score = await self.personalization.calculate_relevance(
-                trigger, context, trigger.user_id
-            )
-            
-            # 9. Check if scores meet threshold
-            if importance_score < 30 and relevance_score < 40:
-                logger.debug(f"Scores too low: importance={importance_score}, relevance={relevance_score}")
-                return None
-            
-            # 10. Determine priority based on scores and category
-            priority = self._determine_priority(importance_score, relevance_score, category)
-            
-            # 11. Check quiet hours for non-critical notifications
-            if priority != NotificationPriority.CRITICAL:
-                if self._is_quiet_hours(user_preferences):
-                    logger.debug(f"Quiet hours active for user {trigger.user_id}")
-                    # Queue for later delivery
-                    return None
-            
-            # 12. Generate notification content with Gemini
-            title, body, rich_content = await self._generate_notification_content(
-                trigger, category, context, user_preferences
-            )
-            
-            # 13. Determine delivery channels
-            channels = self._determine_channels(priority, category, user_preferences)
-            
-            # 14. Determine available actions
-            actions = self._determine_actions(category, trigger)
-            
-            # 15. Calculate optimal delivery time (if not immediate)
-            optimal_time = await self.personalization.calculate_optimal_delivery_time(
-                trigger.user_id, category
-            ) if priority in [NotificationPriority.LOW, NotificationPriority.MEDIUM] else None
-            
-            # 16. Create notification object
-            notification = Notification(
-                id=f"notif_{trigger.user_id}_{datetime.now().timestamp()}",
-                user_id=trigger.user_id,
-                category=category,
-                priority=priority,
-                title=title,
-                body=body,
-                rich_content=rich_content,
-                importance_score=importance_score,
-                relevance_score=relevance_score,
-                context=context,
-                related_transaction_id=trigger.data.get("transaction", {}).get("id"),
-                related_budget_id=trigger.data.get("budget_id"),
-                related_goal_id=trigger.data.get("goal_id"),
-                channels=channels,
-                available_actions=actions,
-                optimal_delivery_time=optimal_time,
-                user_preference_score=relevance_score / 100.0,
-            )
-            
-            # 17. Store notification
-            await self._store_notification(notification)
-            
-            # 18. Update rate limiting counters
-            self._increment_rate_limit(trigger.user_id)
-            
-            # 19. Learn from this notification for future personalization
-            await self.personalization.record_notification_created(notification)
-            
-            logger.info(f"✅ Created notification: {category.value} for user {trigger.user_id}")
-            logger.info(f"   Priority: {priority.value} | Importance: {importance_score:.1f} | Relevance: {relevance_score:.1f}")
-            
-            return notification
-            
-        except Exception as e:
-            logger.error(f"❌ Error processing trigger: {e}", exc_info=True)
+            if anomalies:
+                # Upgrade to fraud alert
+                category = NotificationCategory.FRAUD_DETECTION
+                context.risk_score = anomalies.get('risk_score', 0.8)
+                context.gemini_analysis = anomalies.get('explanation', '')
+        
+        # 9. Calculate importance and relevance scores
+        importance_score = self.scorer.calculate_importance(trigger, context, anomalies)
+        relevance_score = await self.personalization.calculate_relevance(
+            trigger, context, trigger.user_id
+        )
+        
+        # 10. Check if scores meet threshold
+        if importance_score < self.MIN_IMPORTANCE_SCORE and relevance_score < self.MIN_RELEVANCE_SCORE:
+            logger.debug(f"Scores too low: importance={importance_score}, relevance={relevance_score}")
+            self.pipeline_metrics["score_threshold"] += 1
             return None
+        
+        # 11. Determine priority based on scores and category
+        priority = self._determine_priority(importance_score, relevance_score, category)
+        
+        # 12. Hold non-critical notifications until quiet hours end
+        deliver_at = None
+        if priority != NotificationPriority.CRITICAL and self._is_quiet_hours(user_preferences):
+            logger.debug(f"Quiet hours active for user {trigger.user_id}")
+            deliver_at = self._quiet_hours_end(user_preferences)
+        
+        # 13. Update rate limiting counters now, so that a batch of drafts
+        #     for one user cannot overshoot the limit
+        await self._increment_rate_limit(trigger.user_id)
+        
+        return _NotificationDraft(
+            trigger, category, context, user_preferences,
+            importance_score, relevance_score, priority, deliver_at
+        )
+    
+    async def _finalize_notification(
+        self,
+        draft: "_NotificationDraft",
+        title: str,
+        body: str,
+        rich_content: Dict[str, Any]
+    ) -> Notification:
+        """Build, store and learn from a notification once its content is ready"""
+        
+        trigger, category, priority = draft.trigger, draft.category, draft.priority
+        
+        # 14. Determine delivery channels
+        channels = self._determine_channels(priority, category, draft.preferences)
+        
+        # 15. Determine available actions
+        actions = self._determine_actions(category, trigger)
+        
+        # 16. Calculate optimal delivery time (if not immediate)
+        optimal_time = await self.personalization.calculate_optimal_delivery_time(
+            trigger.user_id, category
+        ) if priority in [NotificationPriority.LOW, NotificationPriority.MEDIUM] \
+            and draft.preferences.learn_optimal_times else None
+        
+        deliver_at = max(
+            (t for t in (draft.deliver_at, optimal_time) if t is not None), default=None
+        )
+        
+        # 17. Create notification object
+        notification = Notification(
+            id=f"notif_{trigger.user_id}_{datetime.now().timestamp()}",
+            user_id=trigger.user_id,
+            category=category,
+            priority=priority,
+            title=title,
+            body=body,
+            rich_content=rich_content,
+            importance_score=draft.importance_score,
+            relevance_score=draft.relevance_score,
+            context=draft.context,
+            related_transaction_id=trigger.data.get("transaction", {}).get("id"),
+            related_budget_id=trigger.data.get("budget_id"),
+            related_goal_id=trigger.data.get("goal_id"),
+            channels=channels,
+            available_actions=actions,
+            optimal_delivery_time=deliver_at,
+            user_preference_score=draft.relevance_score / 100.0,
+        )
+        
+        # 18. Store notification now, or hand it to the scheduler for later
+        if deliver_at is not None and deliver_at > datetime.now():
+            self.delivery_scheduler.schedule(notification, deliver_at)
+            self.pipeline_metrics["deferred"] += 1
+        else:
+            notification.optimal_delivery_time = None
+            await self._store_notification(notification)
+        
+        # 19. Learn from this notification for future personalization
+        await self.personalization.record_notification_created(notification)
+        
+        self.pipeline_metrics["created"] += 1
+        logger.info(f"✅ Created notification: {category.value} for user {trigger.user_id}")
+        logger.info(f"   Priority: {priority.value} | Importance: {draft.importance_score:.1f} | Relevance: {draft.relevance_score:.1f}")
+        
+        return notification
     
     async def _generate_notification_content(
         self,
@@ -209,44 +505,51 @@ class AINotificationEngine:
         Returns:
             (title, body, rich_content)
         """
-        try:
-            # Build context for Gemini
-            gemini_prompt = self._build_gemini_prompt(trigger, category, context, user_preferences)
-            
-            # Call Gemini
-            messages = [
-                {
-                    "role": "user",
-                    "parts": [{"text": gemini_prompt}]
-                }
-            ]
-            
-            response = call_gemini_api(
-                messages=messages,
-                model="gemini-2.0-flash-exp",
-                max_tokens=300,
-                temperature=0.7,
-                user_id=trigger.user_id,
-                request_type=RequestType.NOTIFICATION_GENERATION
-            )
-            
-            # Parse Gemini response
-            content = response.get('content', '')
-            
-            # Extract title and body from response
-            lines = content.strip().split('\n')
-            title = lines[0].replace('**', '').strip()
-            body = '\n'.join(lines[1:]).strip()
-            
-            # Generate rich content
-            rich_content = self._build_rich_content(trigger, category, context)
-            
-            return title, body, rich_content
-            
-        except Exception as e:
-            logger.error(f"❌ Error generating content with Gemini: {e}")
+        gemini_prompt = self._build_gemini_prompt(trigger, category, context, user_preferences)
+        generated = await self.content_generator.generate(trigger, category, context, gemini_prompt)
+        
+        if generated is None:
             # Fallback to template-based generation
             return self._generate_fallback_content(trigger, category, context)
+        
+        title, body = generated
+        
+        # Generate rich content
+        rich_content = self._build_rich_content(trigger, category, context)
+        
+        return title, body, rich_content
+    
+    async def _generate_notification_contents(
+        self,
+        drafts: List["_NotificationDraft"]
+    ) -> List[Tuple[str, str, Dict[str, Any]]]:
+        """
+        Generate content for many notifications with batched Gemini requests.
+        
+        Returns:
+            (title, body, rich_content) per draft; items Gemini could not
+            write fall back to templates individually
+        """
+        
+        generated = await self.content_generator.generate_batch([
+            (
+                draft.trigger,
+                draft.category,
+                draft.context,
+                self._build_gemini_prompt(draft.trigger, draft.category, draft.context, draft.preferences)
+            )
+            for draft in drafts
+        ])
+        
+        contents = []
+        for draft, content in zip(drafts, generated):
+            if content is None:
+                contents.append(self._generate_fallback_content(draft.trigger, draft.category, draft.context))
+            else:
+                title, body = content
+                contents.append((title, body, self._build_rich_content(draft.trigger, draft.category, draft.context)))
+        
+        return contents
     
     def _build_gemini_prompt(
         self,
@@ -279,6 +582,18 @@ class AINotificationEngine:
                 budget_pct = context.budget_status.get('percentage_used', 0)
                 prompt_parts.append(f"- Budget usage: {budget_pct:.0f}%")
         
+        elif trigger.trigger_type == "transaction_digest":
+            prompt_parts.extend([
+                f"- {trigger.data.get('count', 0)} new transactions (summarize them in one notification)",
+                f"- Total spent: ₹{trigger.data.get('total_spent', 0):.2f}",
+                f"- Total received: ₹{trigger.data.get('total_received', 0):.2f}",
+                f"- Top categories: {', '.join(trigger.data.get('top_categories', [])) or 'N/A'}",
+            ])
+            for txn in trigger.data.get("transactions", [])[:3]:
+                prompt_parts.append(f"- Notable: ₹{txn.get('amount', 0):.2f} at {txn.get('vendor', 'Unknown')}")
+            if trigger.data.get("flagged_count"):
+                prompt_parts.append(f"- {trigger.data['flagged_count']} of them look unusual (e.g. many in a short time)")
+        
         elif trigger.trigger_type == "budget_threshold":
             prompt_parts.extend([
                 f"- Budget threshold reached: {trigger.data.get('percentage', 0)*100:.0f}%",
@@ -345,6 +660,16 @@ class AINotificationEngine:
                     pct = context.budget_status.get('percentage_used', 0)
                     body += f"\n📊 Budget: {pct:.0f}% used"
         
+        elif trigger.trigger_type == "transaction_digest":
+            count = trigger.data.get("count", 0)
+            title = f"🧾 {count} New Transactions"
+            body = f"₹{trigger.data.get('total_spent', 0):,.2f} spent across {count} transactions"
+            top_categories = trigger.data.get("top_categories", [])
+            if top_categories:
+                body += f"\n📊 Mostly {', '.join(top_categories)}"
+            if trigger.data.get("flagged_count"):
+                body += f"\n⚠️ {trigger.data['flagged_count']} look unusual, please review"
+        
         elif trigger.trigger_type == "budget_threshold":
             pct = trigger.data.get("percentage", 0) * 100
             title = "📊 Budget Alert"
@@ -409,6 +734,13 @@ class AINotificationEngine:
                     "is_positive": comparison < 0  # Lower spending is positive
                 })
         
+        elif trigger.trigger_type == "transaction_digest":
+            rich_content["chips"] = list(trigger.data.get("top_categories", []))
+            rich_content["stats"].append({
+                "label": "Total Spent",
+                "value": f"₹{trigger.data.get('total_spent', 0):,.2f}",
+            })
+        
         return rich_content
     
     def _get_category_icon(self, category: NotificationCategory) -> str:
@@ -434,6 +766,7 @@ class AINotificationEngine:
         
         mapping = {
             "transaction_created": NotificationCategory.SMART_TRANSACTION,
+            "transaction_digest": NotificationCategory.SMART_TRANSACTION,
             "budget_threshold": NotificationCategory.BUDGET_ALERT,
             "bill_due": NotificationCategory.BILL_REMINDER,
             "goal_milestone": NotificationCategory.GOAL_PROGRESS,
@@ -444,6 +777,36 @@ class AINotificationEngine:
         
         return mapping.get(trigger.trigger_type, NotificationCategory.SMART_TRANSACTION)
     
+    def _may_be_fraud(self, trigger: NotificationTrigger) -> bool:
+        """Fraud heuristics: could this trigger end up as a critical alert?"""
+        
+        if trigger.trigger_type == "anomaly_detected":
+            return True
+        if trigger.priority_override == NotificationPriority.CRITICAL:
+            return True
+        if trigger.trigger_type == "transaction_created":
+            # Unscored transactions are only known to be safe after detection
+            if "anomaly" not in trigger.data:
+                return True
+            return bool(trigger.data["anomaly"])
+        return False
+    
+    def get_pipeline_stats(self) -> Dict[str, Any]:
+        """Counts of triggers received, dropped at each stage, and created"""
+        
+        stats: Dict[str, Any] = {
+            stage: self.pipeline_metrics.get(stage, 0) for stage in self.PIPELINE_STAGES
+        }
+        stats["digested_transactions"] = self.pipeline_metrics.get("digested_transactions", 0)
+        stats["content_generation"] = self.content_generator.stats()
+        stats["scheduled_delivery"] = self.delivery_scheduler.stats()
+        stats["rate_limiter"] = self.rate_limiter.stats()
+        stats["history"] = self.notification_history.stats()
+        stats["writes"] = self.writer.stats()
+        stats["counters"] = self.counters.stats()
+        stats["personalization"] = self.personalization.stats()
+        return stats
+    
     def _determine_priority(
         self,
         importance_score: float,
@@ -509,6 +872,8 @@ class AINotificationEngine:
                 NotificationAction.MARK_SAFE,
                 NotificationAction.REPORT_FRAUD
             ])
+        elif trigger.trigger_type == "transaction_digest":
+            base_actions.append(NotificationAction.VIEW_BREAKDOWN)
         elif category == NotificationCategory.SMART_TRANSACTION:
             base_actions.append(NotificationAction.EDIT_CATEGORY)
         elif category == NotificationCategory.BILL_REMINDER:
@@ -528,45 +893,30 @@ class AINotificationEngine:
         
         return base_actions
     
-    def _check_rate_limit(
+    async def _check_rate_limit(
         self,
         user_id: str,
         preferences: UserNotificationPreferences
     ) -> bool:
         """Check if user hasn't exceeded rate limits"""
         
-        now = datetime.now()
-        
-        # Reset counters if needed
-        if user_id not in self.last_reset:
-            self.last_reset[user_id] = now
-            self.notification_counts[user_id] = {'hour': 0, 'day': 0}
-        
-        last_reset = self.last_reset[user_id]
-        
-        # Reset hourly counter
-        if (now - last_reset).total_seconds() >= 3600:
-            self.notification_counts[user_id]['hour'] = 0
-            self.last_reset[user_id] = now
-        
-        # Reset daily counter
-        if (now - last_reset).days >= 1:
-            self.notification_counts[user_id]['day'] = 0
-            self.last_reset[user_id] = now
-        
-        # Check limits
-        counts = self.notification_counts[user_id]
-        if counts['hour'] >= preferences.max_notifications_per_hour:
-            return False
-        if counts['day'] >= preferences.max_notifications_per_day:
-            return False
-        
-        return True
+        try:
+            return await self.rate_limiter.check(
+                user_id,
+                preferences.max_notifications_per_hour,
+                preferences.max_notifications_per_day
+            )
+        except Exception as e:
+            # Fail open: a limiter outage should not silence notifications
+            logger.error(f"❌ Rate limit check failed for user {user_id}: {e}")
+            return True
     
-    def _increment_rate_limit(self, user_id: str):
+    async def _increment_rate_limit(self, user_id: str):
         """Increment rate limiting counters"""
-        self.notification_counts[user_id]['hour'] += 1
-        self.notification_counts[user_id]['day'] += 1
+        try:
+            await self.rate_limiter.record(user_id)
+        except Exception as e:
+            logger.error(f"❌ Could not record rate limit for user {user_id}: {e}")
     
     def _is_quiet_hours(self, preferences: UserNotificationPreferences) -> bool:
         """Check if it's currently quiet hours"""
@@ -583,36 +933,98 @@ class AINotificationEngine:
         else:  # Quiet hours span midnight
             return current_hour >= start or current_hour < end
     
-    async def _store_notification(self, notification: Notification):
-        """Store notification in database"""
+    def _quiet_hours_end(self, preferences: UserNotificationPreferences) -> datetime:
+        """Next time quiet hours end"""
+        
+        now = datetime.now()
+        end = now.replace(hour=preferences.quiet_hours_end, minute=0, second=0, microsecond=0)
+        return end if end > now else end + timedelta(days=1)
+    
+    async def _deliver_scheduled(self, notifications: List[Notification]) -> List[str]:
+        """
+        Deliver notifications whose scheduled time has come
+        
+        Returns:
+            Ids of notifications that could not be stored, for the scheduler to retry
+        """
+        
+        for notification in notifications:
+            notification.timestamp = datetime.now()
+        
+        # Stored together so their writes share WriteBatches
+        stored = await asyncio.gather(*(self._store_notification(n) for n in notifications))
+        delivered = [n for n, ok in zip(notifications, stored) if ok]
+        
+        # One batched push for every user in this delivery
+        if delivered and self.push_sender is not None:
+            await self.push_sender(delivered)
+        
+        return [n.id for n, ok in zip(notifications, stored) if not ok]
+    
+    async def _store_notification(self, notification: Notification) -> bool:
+        """Store notification in database; False if the write failed"""
         
         if self.db:
             try:
-                notification_dict = notification.to_dict()
-                await self.db.collection('notifications').document(notification.id).set(notification_dict)
+                # Lean notification document; the context goes to its own
+                # collection, compressed, and is only referenced by id
+                snapshot = notification.context_snapshot()
+                context_ref = notification.id if snapshot is not None else None
+                
+                ops = [('set', 'notifications', notification.id, notification.to_storage_dict(context_ref))]
+                if snapshot is not None:
+                    ops.append(('set', self.CONTEXT_COLLECTION, context_ref, {
+                        'user_id': notification.user_id,
+                        'notification_id': notification.id,
+                        'encoding': 'zlib+json',
+                        'data': snapshot,
+                        'created_at': notification.timestamp.isoformat(),
+                    }))
+                ops.append(self.counters.created_op(notification))
+                
+                # Buffered with other writes and committed in a WriteBatch
+                await self.writer.write(ops)
                 logger.debug(f"💾 Stored notification {notification.id}")
             except Exception as e:
                 logger.error(f"❌ Error storing notification: {e}")
+                return False
         
-        # Keep in memory as well
-        self.notification_history[notification.user_id].append(notification)
+        # Keep a compact summary in memory as well
+        self.notification_history.add(notification)
+        return True
     
     async def record_notification_interaction(
         self,
         notification_id: str,
         action: NotificationAction,
-        user_id: str
+        user_id: str,
+        notification_data: Optional[Dict[str, Any]] = None
     ):
-        """Record user interaction with notification for learning"""
+        """
+        Record user interaction with notification for learning
+        
+        Args:
+            notification_data: The stored notification, if the caller already
+                read it; used to tell whether marking it read changes counters
+        """
         
         try:
             # Update notification
             if self.db:
-                await self.db.collection('notifications').document(notification_id).update({
+                if notification_data is None:
+                    doc = await asyncio.to_thread(
+                        self.db.collection('notifications').document(notification_id).get
+                    )
+                    notification_data = doc.to_dict() or {}
+                
+                ops = [('update', 'notifications', notification_id, {
                     'action_taken': action.value,
                     'action_taken_at': datetime.now().isoformat(),
                     'is_read': True,
-                })
+                })]
+                if await self.counters.is_unread(user_id, notification_data):
+                    ops.append(self.counters.unread_op(user_id, -1))
+                await self.writer.write(ops)
             
             # Learn from interaction
             await self.personalization.record_interaction(notification_id, action, user_id)
@@ -3,19 +3,19 @@ Anomaly Detector for Fraud and Unusual Activity
 ================================================
 
 Detects unusual financial patterns:
-- Unusual amounts
-- Unusual merchants
+- Unusual amounts (robust z-score against per-category baselines)
+- Unusual merchants (novelty score)
 - Unusual times/locations
-- Multiple transactions in short time
+- Multiple transactions in short time (sliding-window velocity)
 - Out-of-pattern spending
 """
 
 import logging
 from typing import Dict, List, Optional, Any
-from datetime import datetime, timedelta
-from collections import defaultdict
 
 from .notification_types import NotificationContext
+from .feature_store import UserFeatureStore, UserFeatures
+from .streaming_anomaly import StreamingAnomalyEngine, TransactionSignals
 
 logger = logging.getLogger(__name__)
 
@@ -23,8 +23,19 @@ logger = logging.getLogger(__name__)
 class AnomalyDetector:
     """Detect anomalies in financial transactions"""
     
-    def __init__(self):
-        self.user_patterns: Dict[str, Dict[str, Any]] = {}
+    # Robust z-score above which an amount is unusual for the category
+    AMOUNT_ZSCORE_THRESHOLD = 3.5
+    # Velocity thresholds (windows are defined on UserFeatures)
+    BURST_THRESHOLD = 5
+    HIGH_VALUE_BURST_THRESHOLD = 3
+    # Cold-start limits used until a category baseline is ready
+    VERY_HIGH_AMOUNT = 50000
+    HIGH_AMOUNT = 25000
+    HIGH_AMOUNT_EXEMPT_CATEGORIES = ['rent', 'loan emi', 'investment']
+    
+    def __init__(self, feature_store: Optional[UserFeatureStore] = None):
+        self.feature_store = feature_store
+        self.engine = StreamingAnomalyEngine()
         logger.info("🔍 Anomaly Detector initialized")
     
     async def detect_anomalies(
@@ -36,226 +47,205 @@ class AnomalyDetector:
         """
         Detect if a transaction is anomalous.
         
+        Scores the transaction against the user's streaming baselines in
+        constant time; the transaction itself is folded into the baselines
+        by the caller once the trigger has been processed.
+        
         Returns:
             Dictionary with anomaly details or None if no anomaly
         """
         
-        anomaly_reasons = []
-        risk_score = 0.0
-        
         try:
-            amount = abs(float(transaction.get("amount", 0)))
-            vendor = transaction.get("vendor", "")
-            category = transaction.get("category", "")
-            timestamp = transaction.get("date", datetime.now().isoformat())
-            
-            # 1. Check amount anomalies
-            amount_anomaly = self._check_amount_anomaly(
-                amount, category, context
-            )
-            if amount_anomaly:
-                anomaly_reasons.append(amount_anomaly)
-                risk_score += 0.3
-            
-            # 2. Check time anomalies
-            time_anomaly = self._check_time_anomaly(timestamp, context)
-            if time_anomaly:
-                anomaly_reasons.append(time_anomaly)
-                risk_score += 0.2
-            
-            # 3. Check merchant anomalies
-            merchant_anomaly = await self._check_merchant_anomaly(
-                vendor, amount, user_id, context
-            )
-            if merchant_anomaly:
-                anomaly_reasons.append(merchant_anomaly)
-                risk_score += 0.3
-            
-            # 4. Check frequency anomalies
-            frequency_anomaly = await self._check_frequency_anomaly(
-                user_id, amount, context
-            )
-            if frequency_anomaly:
-                anomaly_reasons.append(frequency_anomaly)
-                risk_score += 0.4
-            
-            # 5. Check pattern anomalies
-            pattern_anomaly = self._check_pattern_anomaly(
-                transaction, context
-            )
-            if pattern_anomaly:
-                anomaly_reasons.append(pattern_anomaly)
-                risk_score += 0.3
-            
-            if anomaly_reasons:
-                logger.warning(f"🚨 Anomaly detected for user {user_id}: {anomaly_reasons}")
-                
-                return {
-                    'is_anomaly': True,
-                    'reasons': anomaly_reasons,
-                    'risk_score': min(1.0, risk_score),
-                    'explanation': self._generate_explanation(anomaly_reasons, risk_score),
-                    'recommended_action': self._recommend_action(risk_score)
-                }
-            
-            return None
+            signals = self.engine.score(self._get_features(user_id), transaction)
+            return self._evaluate(user_id, signals, context)
             
         except Exception as e:
             logger.error(f"❌ Error detecting anomalies: {e}")
             return None
     
-    def _check_amount_anomaly(
+    def detect_anomalies_batch(
         self,
-        amount: float,
-        category: str,
-        context: NotificationContext
-    ) -> Optional[str]:
-        """Check if amount is unusual"""
+        transactions: List[Dict[str, Any]],
+        user_id: str
+    ) -> List[Optional[Dict[str, Any]]]:
+        """
+        Detect anomalies for a batch of one user's transactions (e.g. an SMS import).
+        
+        All signals are computed in one vectorized pass, including velocity
+        within the batch itself, so no per-transaction context is needed.
+        
+        Returns:
+            One anomaly dictionary (or None) per transaction, in input order
+        """
         
-        # Check against user average
-        if context.user_average and context.user_average > 0:
-            ratio = amount / context.user_average
+        if not transactions:
+            return []
+        
+        try:
+            signals = self.engine.score_batch(self._get_features(user_id), transactions)
+            return [self._evaluate(user_id, txn_signals, None) for txn_signals in signals]
             
-            if ratio >= 5.0:
-                return f"5x your usual {category} spending"
-            elif ratio >= 3.0:
-                return f"3x your usual {category} spending"
-            elif ratio >= 2.0 and amount >= 5000:
-                return f"2x your usual {category} spending"
-        
-        # Absolute high amounts
-        if amount >= 50000:
+        except Exception as e:
+            logger.error(f"❌ Error detecting anomalies in batch: {e}")
+            return [None] * len(transactions)
+    
+    def _get_features(self, user_id: str) -> UserFeatures:
+        features = self.feature_store.get(user_id) if self.feature_store is not None else None
+        return features if features is not None else UserFeatures()
+    
+    def _evaluate(
+        self,
+        user_id: str,
+        signals: TransactionSignals,
+        context: Optional[NotificationContext]
+    ) -> Optional[Dict[str, Any]]:
+        """Turn signals into an anomaly result"""
+        
+        anomaly_reasons = []
+        risk_score = 0.0
+        
+        # 1. Check amount anomalies
+        amount_anomaly = self._check_amount_anomaly(signals)
+        if amount_anomaly:
+            anomaly_reasons.append(amount_anomaly)
+            risk_score += 0.3
+        
+        # 2. Check time anomalies
+        time_anomaly = self._check_time_anomaly(signals)
+        if time_anomaly:
+            anomaly_reasons.append(time_anomaly)
+            risk_score += 0.2
+        
+        # 3. Check merchant anomalies
+        merchant_anomaly = self._check_merchant_anomaly(signals)
+        if merchant_anomaly:
+            anomaly_reasons.append(merchant_anomaly)
+            risk_score += 0.3
+        
+        # 4. Check frequency anomalies
+        frequency_anomaly = self._check_frequency_anomaly(signals)
+        if frequency_anomaly:
+            anomaly_reasons.append(frequency_anomaly)
+            risk_score += 0.4
+        
+        # 5. Check pattern anomalies
+        pattern_anomaly = self._check_pattern_anomaly(signals, context)
+        if pattern_anomaly:
+            anomaly_reasons.append(pattern_anomaly)
+            risk_score += 0.3
+        
+        if not anomaly_reasons:
+            return None
+        
+        logger.warning(f"🚨 Anomaly detected for user {user_id}: {anomaly_reasons}")
+        
+        return {
+            'is_anomaly': True,
+            'reasons': anomaly_reasons,
+            'risk_score': min(1.0, risk_score),
+            'explanation': self._generate_explanation(anomaly_reasons, risk_score),
+            'recommended_action': self._recommend_action(risk_score),
+            'signals': {
+                'amount_zscore': signals.amount_zscore,
+                'merchant_novelty': signals.merchant_novelty,
+                'burst_count': signals.burst_count,
+                'high_value_count': signals.high_value_count,
+            }
+        }
+    
+    def _check_amount_anomaly(self, signals: TransactionSignals) -> Optional[str]:
+        """Check if amount is unusual"""
+        
+        amount = signals.amount
+        category = signals.category
+        
+        # Check against the category baseline
+        if signals.amount_zscore is not None:
+            if signals.amount_zscore < self.AMOUNT_ZSCORE_THRESHOLD:
+                return None
+            ratio = amount / signals.usual_amount if signals.usual_amount > 0 else 0
+            if ratio >= 2.0:
+                return f"{ratio:.0f}x your usual {category} spending"
+            return f"Unusually high amount for {category}"
+        
+        # No baseline yet: absolute high amounts
+        if amount >= self.VERY_HIGH_AMOUNT:
             return f"Very high amount: ₹{amount:,.2f}"
-        elif amount >= 25000 and category.lower() not in ['rent', 'loan emi', 'investment']:
+        elif amount >= self.HIGH_AMOUNT and category.lower() not in self.HIGH_AMOUNT_EXEMPT_CATEGORIES:
             return f"Unusually high amount for {category}"
         
         return None
     
-    def _check_time_anomaly(
-        self,
-        timestamp: str,
-        context: NotificationContext
-    ) -> Optional[str]:
+    def _check_time_anomaly(self, signals: TransactionSignals) -> Optional[str]:
         """Check if transaction time is unusual"""
         
-        try:
-            if isinstance(timestamp, str):
-                dt = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
-            else:
-                dt = timestamp
-            
-            hour = dt.hour
-            
-            # Very late night or very early morning
-            if hour >= 2 and hour <= 5:
-                return f"Transaction at {hour:02d}:00 (unusual time)"
-            
-            # Check against user's usual transaction times
-            if context.is_unusual_time:
-                return "Transaction at unusual time for you"
-            
-        except Exception as e:
-            logger.debug(f"Error checking time anomaly: {e}")
+        hour = signals.hour
+        
+        # Very late night or very early morning
+        if 2 <= hour <= 5:
+            return f"Transaction at {hour:02d}:00 (unusual time)"
+        
+        # Check against user's usual transaction times
+        if signals.unusual_hour:
+            return "Transaction at unusual time for you"
         
         return None
     
-    async def _check_merchant_anomaly(
-        self,
-        vendor: str,
-        amount: float,
-        user_id: str,
-        context: NotificationContext
-    ) -> Optional[str]:
+    def _check_merchant_anomaly(self, signals: TransactionSignals) -> Optional[str]:
         """Check if merchant is unusual"""
         
+        vendor = signals.vendor
         if not vendor or vendor == "Unknown":
             return None
         
-        # Check merchant history from context
-        if context.merchant_history:
-            merchant_data = context.merchant_history.get(vendor, {})
-            
-            # First time with this merchant
-            if not merchant_data:
-                if amount >= 5000:
-                    return f"First transaction at {vendor}"
-            else:
-                # Check if amount is unusual for this merchant
-                avg_amount = merchant_data.get('average_amount', 0)
-                if avg_amount > 0 and amount >= avg_amount * 3:
-                    return f"3x your usual spending at {vendor}"
-                
-                # Check if it's been a long time since last transaction
-                last_txn = merchant_data.get('last_transaction_date')
-                if last_txn:
-                    days_since = (datetime.now() - datetime.fromisoformat(last_txn)).days
-                    if days_since > 180:  # 6 months
-                        return f"First transaction at {vendor} in {days_since} days"
+        amount = signals.amount
+        is_significant = amount >= UserFeatures.HIGH_VALUE_AMOUNT or (
+            signals.amount_zscore is not None and signals.amount_zscore >= 2.0
+        )
+        
+        # New or long-dormant merchant
+        if signals.merchant_novelty >= 1.0:
+            if signals.merchant_count == 0:
+                return f"First transaction at {vendor}" if is_significant else None
+            return f"First transaction at {vendor} in {signals.days_since_merchant:.0f} days"
+        
+        # Check if amount is unusual for this merchant
+        if signals.merchant_average > 0 and amount >= signals.merchant_average * 3:
+            return f"3x your usual spending at {vendor}"
         
         return None
     
-    async def _check_frequency_anomaly(
-        self,
-        user_id: str,
-        amount: float,
-        context: NotificationContext
-    ) -> Optional[str]:
+    def _check_frequency_anomaly(self, signals: TransactionSignals) -> Optional[str]:
         """Check if transaction frequency is unusual"""
         
-        # Check recent transaction history from context
-        recent_transactions = context.transaction_history[-10:]  # Last 10 transactions
-        
-        if len(recent_transactions) < 2:
-            return None
-        
-        # Check for multiple high-value transactions in short time
-        high_value_recent = [
-            t for t in recent_transactions[-5:]
-            if t.get('amount', 0) >= 5000
-        ]
-        
-        if len(high_value_recent) >= 3:
-            return f"{len(high_value_recent)} high-value transactions in short time"
+        if signals.high_value_count >= self.HIGH_VALUE_BURST_THRESHOLD:
+            return f"{signals.high_value_count} high-value transactions in short time"
         
-        # Check for rapid succession
-        if len(recent_transactions) >= 5:
-            latest = recent_transactions[-1]
-            previous = recent_transactions[-5]
-            
-            try:
-                latest_time = datetime.fromisoformat(latest.get('date', ''))
-                prev_time = datetime.fromisoformat(previous.get('date', ''))
-                
-                time_diff = (latest_time - prev_time).total_seconds() / 60  # minutes
-                
-                if time_diff <= 10:  # 5 transactions in 10 minutes
-                    return "Multiple transactions in very short time"
-                
-            except Exception:
-                pass
+        if signals.burst_count >= self.BURST_THRESHOLD:
+            return "Multiple transactions in very short time"
         
         return None
     
     def _check_pattern_anomaly(
         self,
-        transaction: Dict[str, Any],
-        context: NotificationContext
+        signals: TransactionSignals,
+        context: Optional[NotificationContext]
     ) -> Optional[str]:
         """Check if transaction breaks usual patterns"""
         
-        category = transaction.get("category", "")
-        amount = abs(float(transaction.get("amount", 0)))
+        category = signals.category
+        amount = signals.amount
         
-        # Check spending pattern deviations
+        # New category with high amount
+        if signals.is_expense and signals.category_count == 0 and amount >= UserFeatures.HIGH_VALUE_AMOUNT:
+            return f"First high-value {category} purchase"
+        
+        if context is None:
+            return None
+        
+        # Spending in unusual category
         if context.user_spending_pattern:
-            usual_categories = context.user_spending_pattern.get('usual_categories', [])
             unusual_categories = context.user_spending_pattern.get('unusual_categories', [])
-            
-            # New category with high amount
-            if category not in usual_categories and amount >= 5000:
-                return f"First high-value {category} purchase"
-            
-            # Spending in unusual category
             if category in unusual_categories and amount >= 2000:
                 return f"Unusual category for you: {category}"
         
@@ -0,0 +1,509 @@
+"""
+Notification Content Generator
+================================
+
+Generates notification titles and bodies with Gemini without blocking the
+event loop:
+- The synchronous Gemini client runs in a worker thread
+- A semaphore bounds concurrent LLM calls, and each call has a timeout
+- Near-identical notifications share a cached title/body template keyed by
+  (category, amount bucket, vendor class, budget bucket, ...); the amount,
+  vendor and other slots are filled in locally. Every other value the
+  prompt carries is part of the key, and a template that mentions any slot
+  value is never shared
+- Concurrent requests for the same template share a single LLM call
+- generate_batch() packs many notification prompts into one request that
+  returns a JSON array, for scheduled jobs that produce many at once. A
+  request only carries one user's prompts, so its cost is recorded against
+  that user, and a response is used only if it answers every numbered
+  prompt exactly once; otherwise the prompts are sent one at a time
+
+Callers fall back to their own templates when generate() returns None.
+"""
+
+import asyncio
+import json
+import logging
+import re
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+from .notification_types import NotificationCategory, NotificationContext, NotificationTrigger
+from core.services.ttl_cache import TTLCache
+from core.services.google_cloud_cost_service import RequestType
+from core.simple_ai_service import call_gemini_api
+
+logger = logging.getLogger(__name__)
+
+_PLACEHOLDER = re.compile(r"\{(\w+)\}")
+_DIGIT = re.compile(r"\d")
+
+# Placeholder that must appear in a template for each templated trigger type
+_REQUIRED_SLOT = {
+    "transaction_created": "amount",
+    "budget_threshold": "percentage",
+    "bill_due": "bill_name",
+}
+
+# Slot fallbacks that carry nothing about the user
+_GENERIC_SLOT_VALUES = {"unknown", "uncategorized", "general", "upcoming bill", "today"}
+
+
+class ContentGenerator:
+    """Async, rate-limited Gemini content generation with a template cache"""
+
+    MODEL = "gemini-2.0-flash-exp"
+    MAX_TOKENS = 300
+    TEMPERATURE = 0.7
+
+    MAX_CONCURRENT_CALLS = 8
+    CALL_TIMEOUT_SECONDS = 8.0
+
+    # Notifications packed into one batched request
+    BATCH_SIZE = 10
+    BATCH_MAX_TOKENS_PER_ITEM = 200
+
+    TEMPLATE_CACHE_SIZE = 5000
+    TEMPLATE_TTL_SECONDS = 6 * 3600
+
+    def __init__(
+        self,
+        max_concurrent_calls: int = MAX_CONCURRENT_CALLS,
+        call_timeout_seconds: float = CALL_TIMEOUT_SECONDS
+    ):
+        self.call_timeout_seconds = call_timeout_seconds
+        self._semaphore = asyncio.Semaphore(max_concurrent_calls)
+        self.templates = TTLCache(
+            max_size=self.TEMPLATE_CACHE_SIZE, ttl_seconds=self.TEMPLATE_TTL_SECONDS
+        )
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+
+        self.llm_calls = 0
+        self.batched_items = 0
+        self.timeouts = 0
+        self.failures = 0
+
+        logger.info("✍️ Notification Content Generator initialized")
+
+    async def generate(
+        self,
+        trigger: NotificationTrigger,
+        category: NotificationCategory,
+        context: NotificationContext,
+        prompt: str
+    ) -> Optional[Tuple[str, str]]:
+        """
+        Generate (title, body) for a notification.
+
+        Args:
+            trigger: The event that triggered the notification
+            category: Notification category
+            context: Generated notification context
+            prompt: Gemini prompt built from the trigger and context
+
+        Returns:
+            (title, body), or None if Gemini failed or timed out
+        """
+
+        template = self.template_for(trigger, category, context)
+        if template is None:
+            content = await self.call(trigger.user_id, prompt)
+            return self._parse(content) if content else None
+
+        key, slots = template
+        cached = self.templates.get(key)
+        if cached is None:
+            cached = await self._get_template(key, trigger, prompt, slots)
+        if cached is None:
+            # No shareable template; write this notification on its own
+            content = await self.call(trigger.user_id, prompt)
+            return self._parse(content) if content else None
+
+        title, body = cached
+        return self._fill(title, slots), self._fill(body, slots)
+
+    async def call(self, user_id: str, prompt: str, max_tokens: int = MAX_TOKENS) -> Optional[str]:
+        """Run one Gemini request in a worker thread, bounded by the semaphore and timeout"""
+
+        messages = [
+            {
+                "role": "user",
+                "parts": [{"text": prompt}]
+            }
+        ]
+
+        async with self._semaphore:
+            self.llm_calls += 1
+            try:
+                response = await asyncio.wait_for(
+                    asyncio.to_thread(
+                        call_gemini_api,
+                        messages=messages,
+                        model=self.MODEL,
+                        max_tokens=max_tokens,
+                        temperature=self.TEMPERATURE,
+                        user_id=user_id,
+                        request_type=RequestType.NOTIFICATION_GENERATION
+                    ),
+                    timeout=self.call_timeout_seconds
+                )
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                logger.warning(f"⏱️ Gemini content generation timed out after {self.call_timeout_seconds}s")
+                return None
+            except Exception as e:
+                self.failures += 1
+                logger.error(f"❌ Error generating content with Gemini: {e}")
+                return None
+
+        content = (response or {}).get('content')
+        return content if isinstance(content, str) and content.strip() else None
+
+    async def generate_batch(
+        self,
+        items: List[Tuple[NotificationTrigger, NotificationCategory, NotificationContext, str]]
+    ) -> List[Optional[Tuple[str, str]]]:
+        """
+        Generate (title, body) for many notifications with as few LLM calls as possible.
+
+        Cached templates are filled locally, notifications sharing a template
+        key share one entry, and the rest are packed BATCH_SIZE at a time
+        into requests that return a JSON array.
+
+        Args:
+            items: (trigger, category, context, prompt) per notification
+
+        Returns:
+            (title, body) per item, in order; None where generation failed
+        """
+
+        results: List[Optional[Tuple[str, str]]] = [None] * len(items)
+        # Entries to request: (prompt, template key or None, slots, trigger type, item indexes);
+        # an entry is charged to the user of its first item
+        entries: List[Tuple[str, Optional[Hashable], Dict[str, str], str, List[int]]] = []
+        by_key: Dict[Hashable, int] = {}
+
+        for index, (trigger, category, context, prompt) in enumerate(items):
+            template = self.template_for(trigger, category, context)
+            if template is None:
+                entries.append((prompt, None, {}, trigger.trigger_type, [index]))
+                continue
+
+            key, slots = template
+            cached = self.templates.get(key)
+            if cached is not None:
+                results[index] = (self._fill(cached[0], slots), self._fill(cached[1], slots))
+            elif key in by_key:
+                entries[by_key[key]][4].append(index)
+            else:
+                by_key[key] = len(entries)
+                entries.append((
+                    prompt + self._placeholder_instructions(slots), key, slots, trigger.trigger_type, [index]
+                ))
+
+        generated = await self._request_many([
+            (items[entry[4][0]][0].user_id, entry[0]) for entry in entries
+        ])
+
+        retry: List[int] = []
+        for (prompt, key, slots, trigger_type, indexes), content in zip(entries, generated):
+            if content is None:
+                continue
+            if key is None:
+                results[indexes[0]] = content
+            elif self._is_shareable(content, trigger_type, slots):
+                self.templates.set(key, content)
+                for index in indexes:
+                    item_slots = self.template_for(*items[index][:3])[1]
+                    results[index] = (self._fill(content[0], item_slots), self._fill(content[1], item_slots))
+            else:
+                # Not reusable: it stands for the first item only
+                results[indexes[0]] = (self._fill(content[0], slots), self._fill(content[1], slots))
+                retry.extend(indexes[1:])
+
+        if retry:
+            generated = await self._request_many([(items[index][0].user_id, items[index][3]) for index in retry])
+            for index, content in zip(retry, generated):
+                results[index] = content
+
+        return results
+
+    async def _request_many(self, requests: List[Tuple[str, str]]) -> List[Optional[Tuple[str, str]]]:
+        """
+        Send (user_id, prompt) requests concurrently, results in order.
+
+        Each user's prompts are packed BATCH_SIZE at a time, so every call's
+        cost is recorded against the user it was made for.
+        """
+
+        by_user: Dict[str, List[int]] = {}
+        for position, (user_id, _) in enumerate(requests):
+            by_user.setdefault(user_id, []).append(position)
+
+        chunks = [
+            (user_id, positions[i:i + self.BATCH_SIZE])
+            for user_id, positions in by_user.items()
+            for i in range(0, len(positions), self.BATCH_SIZE)
+        ]
+        responses = await asyncio.gather(*(
+            self._request_chunk(user_id, [requests[position][1] for position in positions])
+            for user_id, positions in chunks
+        ))
+
+        results: List[Optional[Tuple[str, str]]] = [None] * len(requests)
+        for (_, positions), response in zip(chunks, responses):
+            for position, content in zip(positions, response):
+                results[position] = content
+        return results
+
+    async def _request_chunk(self, user_id: str, prompts: List[str]) -> List[Optional[Tuple[str, str]]]:
+        if len(prompts) == 1:
+            content = await self.call(user_id, prompts[0])
+            return [self._parse(content) if content else None]
+
+        self.batched_items += len(prompts)
+        content = await self.call(
+            user_id,
+            self._build_batch_prompt(prompts),
+            max_tokens=self.BATCH_MAX_TOKENS_PER_ITEM * len(prompts)
+        )
+        if not content:
+            return [None] * len(prompts)
+
+        parsed = self._parse_batch(content, len(prompts))
+        if parsed is None:
+            # Can't tell which answer belongs to which prompt; ask one at a time
+            logger.warning(f"⚠️ Batched Gemini response did not match its {len(prompts)} requests, retrying individually")
+            responses = await asyncio.gather(*(self._request_chunk(user_id, [prompt]) for prompt in prompts))
+            return [response[0] for response in responses]
+        return parsed
+
+    @staticmethod
+    def _build_batch_prompt(prompts: List[str]) -> str:
+        parts = [
+            f"Write {len(prompts)} independent notifications, one for each numbered request below.",
+            "Follow each request's instructions, but put its title and body into JSON fields "
+            "instead of the plain-text output format.",
+            "Return only a JSON array with one object per request, in order:",
+            '[{"id": 1, "title": "...", "body": "..."}, ...]',
+        ]
+        for number, prompt in enumerate(prompts, 1):
+            parts.extend(["", f"=== Request {number} ===", prompt])
+        return "\n".join(parts)
+
+    @staticmethod
+    def _parse_batch(content: str, expected: int) -> Optional[List[Optional[Tuple[str, str]]]]:
+        """
+        Parse a JSON array of {id, title, body}.
+
+        Returns None unless the response has exactly one entry for each id
+        1..expected; entries with a malformed title or body become None.
+        """
+
+        start, end = content.find('['), content.rfind(']')
+        try:
+            entries = json.loads(content[start:end + 1]) if start != -1 and end > start else None
+        except ValueError:
+            return None
+        if not isinstance(entries, list) or not all(isinstance(entry, dict) for entry in entries):
+            return None
+
+        ids = [entry.get('id') for entry in entries]
+        if not all(type(i) is int for i in ids) or sorted(ids) != list(range(1, expected + 1)):
+            return None
+
+        results: List[Optional[Tuple[str, str]]] = [None] * expected
+        for entry in entries:
+            title, body = entry.get('title'), entry.get('body')
+            if isinstance(title, str) and isinstance(body, str) and title.strip():
+                results[entry['id'] - 1] = (title.replace('**', '').strip(), body.strip())
+
+        return results
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "llm_calls": self.llm_calls,
+            "batched_items": self.batched_items,
+            "timeouts": self.timeouts,
+            "failures": self.failures,
+            "cached_templates": len(self.templates),
+            "template_hits": self.templates.hits,
+            "template_misses": self.templates.misses,
+        }
+
+    # ========================================================================
+    # TEMPLATES
+    # ========================================================================
+
+    def template_for(
+        self,
+        trigger: NotificationTrigger,
+        category: NotificationCategory,
+        context: NotificationContext
+    ) -> Optional[Tuple[Hashable, Dict[str, str]]]:
+        """
+        Template cache key and slot values for a notification, or None if it
+        has to be written individually (fraud alerts, digests, insights, ...).
+        """
+
+        if context.gemini_analysis or category == NotificationCategory.FRAUD_DETECTION:
+            return None
+
+        # Shown to the model for every trigger type, so part of every key
+        recommendations = tuple(context.recommendations[:2]) if context.recommendations else ()
+
+        if trigger.trigger_type == "transaction_created":
+            txn = trigger.data.get("transaction") or {}
+            amount = abs(float(txn.get("amount", 0) or 0))
+            vendor = txn.get("vendor") or ""
+            # Same condition the prompt uses to show budget usage
+            budget_pct = (context.budget_status or {}).get('percentage_used', 0) \
+                if context.budget_status else None
+            key = (
+                category.value,
+                txn.get("type", "expense"),
+                self._amount_bucket(amount),
+                self._vendor_class(vendor, context),
+                self._budget_bucket(budget_pct),
+                bool(context.user_average),
+                recommendations,
+            )
+            slots = {
+                "amount": f"{amount:,.2f}",
+                "vendor": vendor or "Unknown",
+                "category": txn.get("category") or "Uncategorized",
+                "date": str(txn.get("date") or "Today"),
+            }
+            if budget_pct is not None:
+                slots["budget_pct"] = f"{budget_pct:.0f}"
+            if context.user_average:
+                slots["average"] = f"{context.user_average:,.2f}"
+            return key, slots
+
+        if trigger.trigger_type == "budget_threshold":
+            percentage = float(trigger.data.get("percentage", 0) or 0) * 100
+            key = (category.value, "budget", self._budget_bucket(percentage), recommendations)
+            slots = {
+                "percentage": f"{percentage:.0f}",
+                "category": trigger.data.get("category") or "General",
+            }
+            return key, slots
+
+        if trigger.trigger_type == "bill_due":
+            bill = trigger.data.get("bill") or {}
+            days = int(trigger.data.get("days_until_due", 0) or 0)
+            amount = abs(float(bill.get("amount", 0) or 0))
+            key = (category.value, "bill", min(days, 7), self._amount_bucket(amount), recommendations)
+            slots = {
+                "bill_name": bill.get("name") or "Upcoming bill",
+                "amount": f"{amount:,.2f}",
+                "days": str(days),
+            }
+            return key, slots
+
+        return None
+
+    async def _get_template(
+        self,
+        key: Hashable,
+        trigger: NotificationTrigger,
+        prompt: str,
+        slots: Dict[str, str]
+    ) -> Optional[Tuple[str, str]]:
+        """
+        Ask Gemini for a template, sharing one call between concurrent misses.
+
+        Waiting callers get None when the result could not be cached.
+        """
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            return await asyncio.shield(inflight)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        parsed = template = None
+        try:
+            content = await self.call(trigger.user_id, prompt + self._placeholder_instructions(slots))
+            if content:
+                parsed = self._parse(content)
+                if self._is_shareable(parsed, trigger.trigger_type, slots):
+                    template = parsed
+                    self.templates.set(key, template)
+        finally:
+            del self._inflight[key]
+            future.set_result(template)
+
+        # The caller can still use what it asked for, even if it is not shareable
+        return parsed
+
+    @staticmethod
+    def _placeholder_instructions(slots: Dict[str, str]) -> str:
+        placeholders = ", ".join(f"{{{name}}}" for name in slots)
+        return (
+            "\n\nThis text is reused as a template for similar notifications. "
+            f"Write the placeholders {placeholders} exactly as shown wherever those values belong, "
+            "and do not write any actual amounts, percentages, numbers or merchant names."
+        )
+
+    @staticmethod
+    def _is_shareable(template: Tuple[str, str], trigger_type: str, slots: Dict[str, str]) -> bool:
+        """A template may be reused only if it carries no values of the user it was written for"""
+        text = "\n".join(template)
+        literal = _PLACEHOLDER.sub("", text)
+        if _DIGIT.search(literal):
+            return False
+        for value in slots.values():
+            value = value.strip()
+            if not value or value.lower() in _GENERIC_SLOT_VALUES:
+                continue
+            if re.search(rf"(?<!\w){re.escape(value)}(?!\w)", literal, re.IGNORECASE):
+                return False
+        names = set(_PLACEHOLDER.findall(text))
+        return _REQUIRED_SLOT[trigger_type] in names and names <= slots.keys()
+
+    @staticmethod
+    def _fill(text: str, slots: Dict[str, str]) -> str:
+        return _PLACEHOLDER.sub(lambda m: slots.get(m.group(1), m.group(0)), text)
+
+    @staticmethod
+    def _parse(content: str) -> Tuple[str, str]:
+        """First line is the title, the rest is the body"""
+        lines = content.strip().split('\n')
+        title = lines[0].replace('**', '').strip()
+        body = '\n'.join(lines[1:]).strip()
+        return title, body
+
+    @staticmethod
+    def _amount_bucket(amount: float) -> str:
+        if amount >= 50000:
+            return "huge"
+        elif amount >= 10000:
+            return "large"
+        elif amount >= 5000:
+            return "high"
+        elif amount >= 1000:
+            return "medium"
+        return "small"
+
+    @staticmethod
+    def _vendor_class(vendor: str, context: NotificationContext) -> str:
+        if not vendor or vendor == "Unknown":
+            return "unknown"
+        count = (context.merchant_history or {}).get('transaction_count', 0)
+        if count >= 5:
+            return "regular"
+        elif count > 0:
+            return "occasional"
+        return "new"
+
+    @staticmethod
+    def _budget_bucket(percentage: Optional[float]) -> str:
+        if percentage is None:
+            return "none"
+        if percentage >= 100:
+            return "over"
+        elif percentage >= 90:
+            return "critical"
+        elif percentage >= 75:
+            return "warning"
+        return "ok"
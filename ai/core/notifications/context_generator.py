@@ -10,16 +10,17 @@ Generates rich context for notifications by analyzing:
 - Financial health metrics
 """
 
+import asyncio
 import logging
-from typing import Dict, List, Optional, Any
+from typing import Awaitable, Dict, List, Optional, Any
 from datetime import datetime, timedelta
-from collections import defaultdict
 
 from .notification_types import (
     NotificationTrigger,
     NotificationContext,
     UserNotificationPreferences
 )
+from .feature_store import UserFeatureStore, UserFeatures
 
 logger = logging.getLogger(__name__)
 
@@ -27,9 +28,23 @@ logger = logging.getLogger(__name__)
 class ContextGenerator:
     """Generate rich context for notifications"""
     
-    def __init__(self, db_client=None):
+    # Per-lookup timeout; a slow query falls back to its default value
+    LOOKUP_TIMEOUT_SECONDS = 2.0
+    
+    # One bounded, projected read of recent transactions feeds every signal
+    WINDOW_DAYS = 90
+    WINDOW_MAX_TRANSACTIONS = 1000
+    WINDOW_FIELDS = ['id', 'date', 'amount', 'category', 'vendor', 'type']
+    
+    def __init__(
+        self,
+        db_client=None,
+        lookup_timeout: float = LOOKUP_TIMEOUT_SECONDS,
+        feature_store: Optional[UserFeatureStore] = None
+    ):
         self.db = db_client
-        self._user_cache: Dict[str, Dict[str, Any]] = {}
+        self.lookup_timeout = lookup_timeout
+        self.feature_store = feature_store if feature_store is not None else UserFeatureStore()
         logger.info("📝 Context Generator initialized")
     
     async def generate_context(
@@ -40,6 +55,15 @@ class ContextGenerator:
         """
         Generate comprehensive context for a notification.
         
+        Spending signals and recent transactions come from the user's rolling
+        features. When the user is not in the feature store yet, their recent
+        transaction window is read once (concurrently with the budget lookup)
+        and used to seed it:
+        
+            features (or window -> seed) ─┬─> patterns / merchant / averages
+                                          ├─> month comparison / unusual time
+            budget ───────────────────────┴─> budget status ─> financial health
+        
         Returns:
             NotificationContext with all relevant contextual information
         """
@@ -48,70 +72,90 @@ class ContextGenerator:
         
         try:
             user_id = trigger.user_id
+            is_transaction = trigger.trigger_type == "transaction_created"
+            txn = trigger.data.get("transaction", {}) if is_transaction else {}
+            category = trigger.data.get("transaction", {}).get("category", "")
+            needs_budget = trigger.trigger_type in ["transaction_created", "budget_threshold"]
+            
+            # Stage 1: Firestore reads, run concurrently (window only on a cold miss)
+            features = self.feature_store.get(user_id)
+            window_lookup = self._none() if features is not None else self._run_lookup(
+                'transaction_window', self._get_transaction_window(user_id), None
+            )
+            budget_lookup = self._run_lookup(
+                'budget', self._get_budget(user_id, category), None
+            ) if needs_budget else self._none()
             
-            # 1. Get spending patterns
-            context.user_spending_pattern = await self._get_spending_patterns(user_id)
+            window, budget = await asyncio.gather(window_lookup, budget_lookup)
             
-            # 2. Get budget status
-            if trigger.trigger_type in ["transaction_created", "budget_threshold"]:
-                context.budget_status = await self._get_budget_status(
-                    user_id,
-                    trigger.data.get("transaction", {}).get("category", "")
-                )
+            if features is None:
+                features = self.feature_store.seed(user_id, window) if window is not None else UserFeatures()
             
-            # 3. Get transaction history
-            context.transaction_history = await self._get_transaction_history(
-                user_id, limit=50
-            )
+            # Stage 2: signals derived in memory from the features
+            context.user_spending_pattern = self._get_spending_patterns(features)
             
-            # 4. Get similar transactions
-            if trigger.trigger_type == "transaction_created":
-                txn = trigger.data.get("transaction", {})
-                context.similar_transactions = await self._find_similar_transactions(
-                    user_id, txn
-                )
-                context.merchant_history = await self._get_merchant_history(
-                    user_id, txn.get("vendor", "")
-                )
+            recent = features.recent_transactions()
+            context.transaction_history = recent
             
-            # 5. Calculate averages
-            if trigger.trigger_type == "transaction_created":
-                txn = trigger.data.get("transaction", {})
-                category = txn.get("category", "")
-                context.user_average = self._calculate_category_average(
-                    context.transaction_history, category
-                )
+            if needs_budget:
+                context.budget_status = self._get_budget_status(budget, features, category)
+            
+            if is_transaction:
+                context.similar_transactions = self._find_similar_transactions(recent, txn)
+                context.merchant_history = self._get_merchant_history(features, txn.get("vendor", ""))
+                context.user_average = self._calculate_category_average(features, category)
                 context.category_average = context.user_average  # Same for now
+                context.previous_month_comparison = self._get_month_comparison(features, category)
             
-            # 6. Time context
+            now = datetime.now()
             context.time_of_day = self._get_time_of_day()
-            context.day_of_week = datetime.now().strftime("%A")
-            context.is_unusual_time = self._is_unusual_time(
-                datetime.now(), context.transaction_history
-            )
+            context.day_of_week = now.strftime("%A")
+            context.is_unusual_time = features.is_unusual_hour(now.hour)
             
-            # 7. Comparative context
-            if trigger.trigger_type == "transaction_created":
-                context.previous_month_comparison = await self._get_month_comparison(
-                    user_id, trigger.data.get("transaction", {}).get("category", "")
-                )
-            
-            # 8. Financial health score
+            # Stage 3: depends on budget status and month comparison
             context.financial_health_score = await self._calculate_financial_health(
                 user_id, context
             )
             
-            logger.debug(f"📝 Generated context for {trigger.trigger_type}")
+            logger.debug(f"📝 Generated context for {trigger.trigger_type} ({'cold' if window is not None else 'warm'} features)")
             
         except Exception as e:
             logger.error(f"❌ Error generating context: {e}", exc_info=True)
         
         return context
     
-    async def _get_spending_patterns(self, user_id: str) -> Dict[str, Any]:
-        """Analyze user's spending patterns"""
+    async def ensure_features(self, user_id: str) -> UserFeatures:
+        """Return the user's rolling features, seeding them from Firestore on a miss"""
+        
+        features = self.feature_store.get(user_id)
+        if features is not None:
+            return features
+        
+        window = await self._run_lookup('transaction_window', self._get_transaction_window(user_id), None)
+        return self.feature_store.seed(user_id, window) if window is not None else UserFeatures()
+    
+    async def _run_lookup(self, name: str, coro: Awaitable[Any], default: Any) -> Any:
+        """Await a single context lookup, falling back to default on timeout or error"""
         
-        patterns = {
+        try:
+            return await asyncio.wait_for(coro, timeout=self.lookup_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"⏱️ Context lookup '{name}' timed out after {self.lookup_timeout}s")
+        except Exception as e:
+            logger.error(f"Context lookup '{name}' failed: {e}")
+        return default
+    
+    @staticmethod
+    async def _none() -> None:
+        return None
+    
+    async def _fetch(self, query) -> List[Dict[str, Any]]:
+        """Run a blocking Firestore query in a worker thread"""
+        return await asyncio.to_thread(lambda: [doc.to_dict() for doc in query.stream()])
+    
+    @staticmethod
+    def _default_spending_patterns() -> Dict[str, Any]:
+        return {
             'usual_categories': [],
             'unusual_categories': [],
             'peak_spending_hours': [],
@@ -119,117 +163,112 @@ class ContextGenerator:
             'average_transaction_amount': 0.0,
             'usually_exceeds_budget': False,
         }
+    
+    @staticmethod
+    def _default_budget_status() -> Dict[str, Any]:
+        return {
+            'has_budget': False,
+            'budget_amount': 0.0,
+            'spent_amount': 0.0,
+            'percentage_used': 0.0,
+            'remaining': 0.0,
+        }
+    
+    @staticmethod
+    def _default_merchant_history() -> Dict[str, Any]:
+        return {
+            'transaction_count': 0,
+            'total_spent': 0.0,
+            'average_amount': 0.0,
+            'last_transaction_date': None,
+        }
+    
+    # ========================================================================
+    # FIRESTORE READS
+    # ========================================================================
+    
+    async def _get_transaction_window(self, user_id: str) -> List[Dict[str, Any]]:
+        """Fetch the user's recent transactions (newest first, projected fields only)"""
         
         if not self.db:
+            return []
+        
+        since = (datetime.now() - timedelta(days=self.WINDOW_DAYS)).isoformat()
+        
+        query = self.db.collection('transactions') \
+            .where('userId', '==', user_id) \
+            .where('date', '>=', since) \
+            .order_by('date', direction='DESCENDING') \
+            .select(self.WINDOW_FIELDS) \
+            .limit(self.WINDOW_MAX_TRANSACTIONS)
+        
+        return await self._fetch(query)
+    
+    async def _get_budget(self, user_id: str, category: str) -> Optional[Dict[str, Any]]:
+        """Fetch the budget document for a category, if any"""
+        
+        if not self.db or not category:
+            return None
+        
+        query = self.db.collection('budgets') \
+            .where('userId', '==', user_id) \
+            .where('category', '==', category) \
+            .limit(1)
+        
+        budgets = await self._fetch(query)
+        return budgets[0] if budgets else None
+    
+    # ========================================================================
+    # SIGNALS DERIVED FROM ROLLING FEATURES
+    # ========================================================================
+    
+    def _get_spending_patterns(self, features: UserFeatures) -> Dict[str, Any]:
+        """Analyze user's spending patterns"""
+        
+        patterns = self._default_spending_patterns()
+        
+        if not features.transaction_count:
             return patterns
         
-        try:
-            # Get last 90 days of transactions
-            ninety_days_ago = (datetime.now() - timedelta(days=90)).isoformat()
-            
-            transactions_ref = self.db.collection('transactions') \
-                .where('userId', '==', user_id) \
-                .where('date', '>=', ninety_days_ago) \
-                .stream()
-            
-            transactions = [doc.to_dict() for doc in transactions_ref]
-            
-            if not transactions:
-                return patterns
-            
-            # Category analysis
-            category_counts = defaultdict(int)
-            for txn in transactions:
-                if txn.get('type') == 'expense':
-                    category_counts[txn.get('category', 'Uncategorized')] += 1
-            
-            # Sort by frequency
-            sorted_categories = sorted(
-                category_counts.items(), key=lambda x: x[1], reverse=True
-            )
-            
-            patterns['usual_categories'] = [cat for cat, count in sorted_categories[:5]]
-            patterns['unusual_categories'] = [
-                cat for cat, count in sorted_categories[-3:] if count == 1
-            ]
-            
-            # Calculate averages
-            total_spending = sum(
-                txn.get('amount', 0) for txn in transactions 
-                if txn.get('type') == 'expense'
-            )
-            patterns['average_daily_spending'] = total_spending / 90
-            patterns['average_transaction_amount'] = total_spending / max(len(transactions), 1)
-            
-            # Hour analysis
-            hour_counts = defaultdict(int)
-            for txn in transactions:
-                try:
-                    txn_time = datetime.fromisoformat(txn.get('date', ''))
-                    hour_counts[txn_time.hour] += 1
-                except:
-                    pass
-            
-            patterns['peak_spending_hours'] = [
-                hour for hour, count in sorted(
-                    hour_counts.items(), key=lambda x: x[1], reverse=True
-                )[:3]
-            ]
-            
-        except Exception as e:
-            logger.error(f"Error analyzing spending patterns: {e}")
+        # Category analysis, sorted by frequency
+        sorted_categories = sorted(
+            features.categories.items(), key=lambda x: x[1].count, reverse=True
+        )
+        
+        patterns['usual_categories'] = [cat for cat, stats in sorted_categories[:5]]
+        patterns['unusual_categories'] = [
+            cat for cat, stats in sorted_categories[-3:] if stats.count == 1
+        ]
+        
+        # Calculate averages
+        patterns['average_daily_spending'] = features.expense_total / self.WINDOW_DAYS
+        patterns['average_transaction_amount'] = features.expense_total / max(features.expense_count, 1)
+        
+        # Hour analysis
+        patterns['peak_spending_hours'] = features.peak_hours(3)
         
         return patterns
     
-    async def _get_budget_status(
+    def _get_budget_status(
         self,
-        user_id: str,
+        budget: Optional[Dict[str, Any]],
+        features: UserFeatures,
         category: str
     ) -> Dict[str, Any]:
         """Get current budget status for a category"""
         
-        status = {
-            'has_budget': False,
-            'budget_amount': 0.0,
-            'spent_amount': 0.0,
-            'percentage_used': 0.0,
-            'remaining': 0.0,
-        }
+        status = self._default_budget_status()
         
-        if not self.db or not category:
+        if not budget:
             return status
         
         try:
-            # Find budget for this category
-            budgets_ref = self.db.collection('budgets') \
-                .where('userId', '==', user_id) \
-                .where('category', '==', category) \
-                .limit(1) \
-                .stream()
-            
-            budgets = [doc.to_dict() for doc in budgets_ref]
-            
-            if not budgets:
-                return status
-            
-            budget = budgets[0]
             budget_amount = float(budget.get('amount', 0))
             
-            # Calculate spending for current month
+            # Spending for current month
+            stats = features.category(category)
             current_month = datetime.now().strftime('%Y-%m')
-            
-            transactions_ref = self.db.collection('transactions') \
-                .where('userId', '==', user_id) \
-                .where('category', '==', category) \
-                .where('type', '==', 'expense') \
-                .stream()
-            
-            spent_amount = 0.0
-            for doc in transactions_ref:
-                txn = doc.to_dict()
-                txn_date = txn.get('date', '')
-                if txn_date.startswith(current_month):
-                    spent_amount += float(txn.get('amount', 0))
+            spent_amount = stats.total_for_month(current_month) if stats else 0.0
             
             status = {
                 'has_budget': True,
@@ -244,123 +283,55 @@ class ContextGenerator:
         
         return status
     
-    async def _get_transaction_history(
+    def _find_similar_transactions(
         self,
-        user_id: str,
-        limit: int = 50
-    ) -> List[Dict[str, Any]]:
-        """Get recent transaction history"""
-        
-        if not self.db:
-            return []
-        
-        try:
-            transactions_ref = self.db.collection('transactions') \
-                .where('userId', '==', user_id) \
-                .order_by('date', direction='DESCENDING') \
-                .limit(limit) \
-                .stream()
-            
-            return [doc.to_dict() for doc in transactions_ref]
-            
-        except Exception as e:
-            logger.error(f"Error getting transaction history: {e}")
-            return []
-    
-    async def _find_similar_transactions(
-        self,
-        user_id: str,
+        transactions: List[Dict[str, Any]],
         transaction: Dict[str, Any]
     ) -> List[Dict[str, Any]]:
         """Find similar transactions (same category/vendor)"""
         
-        if not self.db:
-            return []
+        category = transaction.get('category', '')
+        vendor = transaction.get('vendor', '')
         
-        try:
-            category = transaction.get('category', '')
-            vendor = transaction.get('vendor', '')
-            
-            if not category:
-                return []
-            
-            # Get transactions in same category
-            transactions_ref = self.db.collection('transactions') \
-                .where('userId', '==', user_id) \
-                .where('category', '==', category) \
-                .order_by('date', direction='DESCENDING') \
-                .limit(10) \
-                .stream()
-            
-            similar = [doc.to_dict() for doc in transactions_ref]
-            
-            # Filter by vendor if available
-            if vendor:
-                similar = [t for t in similar if t.get('vendor') == vendor]
-            
-            return similar[:5]  # Return top 5
-            
-        except Exception as e:
-            logger.error(f"Error finding similar transactions: {e}")
+        if not category:
             return []
+        
+        # Most recent transactions in same category
+        similar = [t for t in transactions if t.get('category') == category][:10]
+        
+        # Filter by vendor if available
+        if vendor:
+            similar = [t for t in similar if t.get('vendor') == vendor]
+        
+        return similar[:5]  # Return top 5
     
-    async def _get_merchant_history(
+    def _get_merchant_history(
         self,
-        user_id: str,
+        features: UserFeatures,
         vendor: str
     ) -> Dict[str, Any]:
         """Get history with a specific merchant"""
         
-        history = {
-            'transaction_count': 0,
-            'total_spent': 0.0,
-            'average_amount': 0.0,
-            'last_transaction_date': None,
-        }
-        
-        if not self.db or not vendor:
-            return history
+        history = self._default_merchant_history()
         
-        try:
-            transactions_ref = self.db.collection('transactions') \
-                .where('userId', '==', user_id) \
-                .where('vendor', '==', vendor) \
-                .stream()
-            
-            transactions = [doc.to_dict() for doc in transactions_ref]
-            
-            if transactions:
-                history['transaction_count'] = len(transactions)
-                history['total_spent'] = sum(t.get('amount', 0) for t in transactions)
-                history['average_amount'] = history['total_spent'] / len(transactions)
-                
-                # Get most recent transaction date
-                dates = [t.get('date') for t in transactions if t.get('date')]
-                if dates:
-                    history['last_transaction_date'] = max(dates)
-            
-        except Exception as e:
-            logger.error(f"Error getting merchant history: {e}")
+        merchant = features.merchant(vendor) if vendor else None
+        if merchant:
+            history['transaction_count'] = merchant.count
+            history['total_spent'] = merchant.total
+            history['average_amount'] = merchant.average
+            history['last_transaction_date'] = merchant.last_seen or None
         
         return history
     
     def _calculate_category_average(
         self,
-        transactions: List[Dict[str, Any]],
+        features: UserFeatures,
         category: str
     ) -> float:
         """Calculate average spending for a category"""
         
-        category_transactions = [
-            t for t in transactions
-            if t.get('category') == category and t.get('type') == 'expense'
-        ]
-        
-        if not category_transactions:
-            return 0.0
-        
-        total = sum(t.get('amount', 0) for t in category_transactions)
-        return total / len(category_transactions)
+        stats = features.category(category)
+        return stats.mean if stats else 0.0
     
     def _get_time_of_day(self) -> str:
         """Get current time of day description"""
@@ -376,78 +347,28 @@ class ContextGenerator:
         else:
             return "night"
     
-    def _is_unusual_time(
-        self,
-        current_time: datetime,
-        transaction_history: List[Dict[str, Any]]
-    ) -> bool:
-        """Check if current time is unusual for transactions"""
-        
-        if not transaction_history:
-            return False
-        
-        # Get hours of previous transactions
-        transaction_hours = []
-        for txn in transaction_history:
-            try:
-                txn_time = datetime.fromisoformat(txn.get('date', ''))
-                transaction_hours.append(txn_time.hour)
-            except:
-                pass
-        
-        if not transaction_hours:
-            return False
-        
-        # Calculate average hour
-        avg_hour = sum(transaction_hours) / len(transaction_hours)
-        current_hour = current_time.hour
-        
-        # If more than 4 hours different from average, it's unusual
-        return abs(current_hour - avg_hour) > 4
-    
-    async def _get_month_comparison(
+    def _get_month_comparison(
         self,
-        user_id: str,
+        features: UserFeatures,
         category: str
     ) -> Optional[float]:
         """Compare current month vs previous month spending"""
         
-        if not self.db or not category:
+        stats = features.category(category) if category else None
+        if not stats:
             return None
         
-        try:
-            current_month = datetime.now().strftime('%Y-%m')
-            previous_month = (datetime.now() - timedelta(days=30)).strftime('%Y-%m')
-            
-            # Get transactions for both months
-            transactions_ref = self.db.collection('transactions') \
-                .where('userId', '==', user_id) \
-                .where('category', '==', category) \
-                .where('type', '==', 'expense') \
-                .stream()
-            
-            current_total = 0.0
-            previous_total = 0.0
-            
-            for doc in transactions_ref:
-                txn = doc.to_dict()
-                txn_date = txn.get('date', '')
-                amount = float(txn.get('amount', 0))
-                
-                if txn_date.startswith(current_month):
-                    current_total += amount
-                elif txn_date.startswith(previous_month):
-                    previous_total += amount
-            
-            if previous_total == 0:
-                return None
-            
-            # Return percentage change
-            return ((current_total - previous_total) / previous_total) * 100
-            
-        except Exception as e:
-            logger.error(f"Error comparing months: {e}")
+        current_month = datetime.now().strftime('%Y-%m')
+        previous_month = (datetime.now() - timedelta(days=30)).strftime('%Y-%m')
+        
+        current_total = stats.total_for_month(current_month)
+        previous_total = stats.total_for_month(previous_month)
+        
+        if previous_total == 0:
             return None
+        
+        # Return percentage change
+        return ((current_total - previous_total) / previous_total) * 100
     
     async def _calculate_financial_health(
         self,
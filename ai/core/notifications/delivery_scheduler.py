@@ -0,0 +1,254 @@
+"""
+Notification Delivery Scheduler
+===============================
+
+Holds notifications that should not go out yet (quiet hours, optimal
+delivery time) and delivers them when they are due:
+- Pending notifications sit in a min-heap keyed by due time, so scheduling
+  and popping are O(log n)
+- Each one is also persisted to a queue backend, so a restart does not
+  lose them
+- A single background task sleeps until the earliest due time (or until
+  something earlier is scheduled) and delivers everything due in batches,
+  so an idle scheduler costs no CPU
+- Notifications whose delivery fails (the deliver callback raised, or
+  returned their ids) are put back with exponential backoff and jitter;
+  after max_attempts they go to a dead-letter queue in the same backend
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Awaitable, Callable, Collection, Dict, List, Optional, Set, Tuple
+
+from .notification_types import Notification
+from core.services.queue_backends import QueueBackend, InMemoryQueueBackend
+
+logger = logging.getLogger(__name__)
+
+
+class DeliveryScheduler:
+    """Min-heap of deferred notifications drained by one background task"""
+
+    QUEUE_NAME = "scheduled_notifications"
+    DEAD_LETTER_QUEUE = "scheduled_dead_letter"
+    # Upper bound on notifications handed to the deliver callback at once
+    MAX_BATCH_SIZE = 500
+    MAX_ATTEMPTS = 5
+    BASE_DELAY_SECONDS = 5.0
+    MAX_DELAY_SECONDS = 600.0
+
+    def __init__(
+        self,
+        deliver: Callable[[List[Notification]], Awaitable[Optional[Collection[str]]]],
+        backend: Optional[QueueBackend] = None,
+        max_batch_size: int = MAX_BATCH_SIZE,
+        max_attempts: int = MAX_ATTEMPTS,
+        base_delay_seconds: float = BASE_DELAY_SECONDS,
+        max_delay_seconds: float = MAX_DELAY_SECONDS
+    ):
+        self.deliver = deliver
+        self.backend = backend if backend is not None else InMemoryQueueBackend()
+        self.max_batch_size = max_batch_size
+        self.max_attempts = max_attempts
+        self.base_delay_seconds = base_delay_seconds
+        self.max_delay_seconds = max_delay_seconds
+
+        # (due timestamp, sequence, notification id); cancelled entries are skipped lazily
+        self._heap: List[Tuple[float, int, str]] = []
+        self._sequence = itertools.count()
+        # notification id -> (notification, queue item id)
+        self._pending: Dict[str, Tuple[Notification, str]] = {}
+        self._by_user: Dict[str, Set[str]] = defaultdict(set)
+        # notification id -> failed delivery attempts so far
+        self._attempts: Dict[str, int] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+        self.scheduled = 0
+        self.delivered = 0
+        self.failed = 0
+        self.retried = 0
+        self.dead_lettered = 0
+
+        logger.info("⏰ Notification Delivery Scheduler initialized")
+
+    @property
+    def is_running(self) -> bool:
+        return self._task is not None
+
+    def start(self):
+        """Start the drain task on the running loop and recover persisted notifications"""
+
+        if self.is_running:
+            return
+
+        self._wakeup = asyncio.Event()
+
+        recovered = 0
+        for item in self.backend.load_pending(self.QUEUE_NAME):
+            try:
+                notification = Notification.from_dict(item.payload)
+                self._push(notification, item.available_at, item.id)
+                if item.payload.get('attempt'):
+                    self._attempts[notification.id] = item.payload['attempt']
+                recovered += 1
+            except Exception as e:
+                logger.error(f"❌ Dropping malformed scheduled notification {item.id}: {e}")
+                self.backend.ack(self.QUEUE_NAME, item.id)
+        if recovered:
+            logger.info(f"⏰ Recovered {recovered} scheduled notifications")
+
+        self._task = asyncio.create_task(self._drain())
+
+    async def stop(self):
+        """Stop the drain task; undelivered notifications stay in the backend"""
+
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        self._heap.clear()
+        self._pending.clear()
+        self._by_user.clear()
+        self._attempts.clear()
+        await asyncio.to_thread(self.backend.flush)
+
+    def schedule(self, notification: Notification, deliver_at: datetime):
+        """
+        Hold a notification until deliver_at.
+
+        Args:
+            notification: Notification to deliver later
+            deliver_at: When it becomes due (local time, like datetime.now())
+        """
+
+        self.start()
+        due = deliver_at.timestamp()
+        item = self.backend.put(self.QUEUE_NAME, notification.to_dict(), available_at=due)
+        earliest = self._heap[0][0] if self._heap else None
+        self._push(notification, due, item.id)
+        self.scheduled += 1
+
+        if earliest is None or due < earliest:
+            self._wakeup.set()
+
+    def cancel(self, notification_id: str) -> bool:
+        """Drop a scheduled notification before it is delivered"""
+
+        entry = self._pending.pop(notification_id, None)
+        if entry is None:
+            return False
+        notification, item_id = entry
+        self._attempts.pop(notification_id, None)
+        self._by_user[notification.user_id].discard(notification_id)
+        if not self._by_user[notification.user_id]:
+            del self._by_user[notification.user_id]
+        self.backend.ack(self.QUEUE_NAME, item_id)
+        return True
+
+    def pending_for_user(self, user_id: str) -> List[Notification]:
+        """Scheduled notifications for a user, soonest first"""
+
+        notifications = [self._pending[nid][0] for nid in self._by_user.get(user_id, ())]
+        return sorted(notifications, key=lambda n: n.optimal_delivery_time or n.timestamp)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "pending": len(self._pending),
+            "users": len(self._by_user),
+            "scheduled": self.scheduled,
+            "delivered": self.delivered,
+            "failed": self.failed,
+            "retried": self.retried,
+            "dead_lettered": self.dead_lettered,
+            "dead_letter": self.backend.count(self.DEAD_LETTER_QUEUE),
+        }
+
+    def _push(self, notification: Notification, due: float, item_id: str):
+        heapq.heappush(self._heap, (due, next(self._sequence), notification.id))
+        self._pending[notification.id] = (notification, item_id)
+        self._by_user[notification.user_id].add(notification.id)
+
+    def _pop_due(self, now: float) -> List[Tuple[Notification, str]]:
+        batch = []
+        while self._heap and self._heap[0][0] <= now and len(batch) < self.max_batch_size:
+            _, _, notification_id = heapq.heappop(self._heap)
+            entry = self._pending.pop(notification_id, None)
+            if entry is None:
+                continue  # Cancelled
+            user_ids = self._by_user[entry[0].user_id]
+            user_ids.discard(notification_id)
+            if not user_ids:
+                del self._by_user[entry[0].user_id]
+            batch.append(entry)
+        return batch
+
+    async def _drain(self):
+        while True:
+            self._wakeup.clear()
+            # Drop cancelled entries so the sleep below targets a live one
+            while self._heap and self._heap[0][2] not in self._pending:
+                heapq.heappop(self._heap)
+
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+
+            delay = self._heap[0][0] - time.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            batch = self._pop_due(time.time())
+            if not batch:
+                continue
+
+            try:
+                failed_ids = await self.deliver([notification for notification, _ in batch]) or ()
+                error = "delivery failed"
+            except Exception as e:
+                failed_ids = {notification.id for notification, _ in batch}
+                error = str(e)
+                logger.error(f"❌ Error delivering {len(batch)} scheduled notifications: {e}", exc_info=True)
+
+            delivered = 0
+            for notification, item_id in batch:
+                if notification.id in failed_ids:
+                    self.failed += 1
+                    self._retry(notification, item_id, error)
+                else:
+                    self._attempts.pop(notification.id, None)
+                    self.backend.ack(self.QUEUE_NAME, item_id)
+                    delivered += 1
+            self.delivered += delivered
+            logger.info(f"⏰ Delivered {delivered} of {len(batch)} scheduled notifications")
+
+    def _retry(self, notification: Notification, item_id: str, error: str):
+        attempt = self._attempts.pop(notification.id, 0) + 1
+        payload = {**notification.to_dict(), 'attempt': attempt, 'last_error': error}
+
+        if attempt >= self.max_attempts:
+            self.backend.put(self.DEAD_LETTER_QUEUE, payload)
+            self.backend.ack(self.QUEUE_NAME, item_id)
+            self.dead_lettered += 1
+            logger.warning(f"☠️ Scheduled notification {notification.id} dead-lettered after {attempt} attempts: {error}")
+            return
+
+        delay = min(self.max_delay_seconds, self.base_delay_seconds * (2 ** (attempt - 1)))
+        delay *= random.uniform(0.5, 1.0)
+        due = time.time() + delay
+        # Persist the retry before dropping the current attempt
+        retry_item = self.backend.put(self.QUEUE_NAME, payload, available_at=due)
+        self.backend.ack(self.QUEUE_NAME, item_id)
+        self._push(notification, due, retry_item.id)
+        self._attempts[notification.id] = attempt
+        self.retried += 1
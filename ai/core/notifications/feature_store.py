@@ -0,0 +1,368 @@
+"""
+Rolling User Feature Store
+==========================
+
+Keeps compact, incrementally updated spending features per user so that
+context generation and anomaly detection can read them in O(1) instead of
+re-scanning Firestore on every trigger:
+- Running mean/variance per category (Welford)
+- EWMA baseline per category for robust z-scores
+- Month-to-date and previous-month totals per category
+- Per-merchant count, sum and last-seen date
+- Hour-of-day histogram
+- Sliding-window velocity counters
+- The most recent transactions (projected fields only), for history and
+  similar-transaction lookups
+
+Users are kept in an LRU bounded by max_users. Features older than
+max_age_seconds are treated as stale so they get re-seeded from Firestore.
+"""
+
+import bisect
+import logging
+import math
+import threading
+import time
+from array import array
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Any, Deque, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def parse_transaction_date(value: Any) -> Optional[datetime]:
+    """Parse an ISO date into a naive local datetime"""
+    try:
+        dt = value if isinstance(value, datetime) else datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except (TypeError, ValueError):
+        return None
+    if dt.tzinfo is not None:
+        dt = dt.astimezone().replace(tzinfo=None)
+    return dt
+
+
+class EWMABaseline:
+    """
+    Exponentially weighted mean and absolute deviation of amounts.
+
+    The deviation is a robust stand-in for the standard deviation: updates
+    are clipped so a single outlier cannot blow up the baseline it is later
+    compared against.
+    """
+
+    __slots__ = ('count', 'mean', 'mad')
+
+    ALPHA = 0.1
+    MIN_OBSERVATIONS = 5
+    MAD_TO_SIGMA = 1.4826
+    CLIP_Z = 6.0
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.mad = 0.0
+
+    @property
+    def is_ready(self) -> bool:
+        return self.count >= self.MIN_OBSERVATIONS
+
+    @property
+    def scale(self) -> float:
+        # Floor the scale so users with very regular amounts don't flag every cent
+        return max(self.MAD_TO_SIGMA * self.mad, 0.05 * abs(self.mean), 1.0)
+
+    def zscore(self, amount: float) -> float:
+        return (amount - self.mean) / self.scale
+
+    def update(self, amount: float):
+        self.count += 1
+        if self.count == 1:
+            self.mean = amount
+            return
+
+        if self.is_ready:
+            limit = self.CLIP_Z * self.scale
+            amount = min(max(amount, self.mean - limit), self.mean + limit)
+
+        # Plain running average while warming up, EWMA afterwards
+        alpha = max(self.ALPHA, 1.0 / self.count)
+        deviation = abs(amount - self.mean)
+        self.mean += alpha * (amount - self.mean)
+        self.mad += alpha * (deviation - self.mad)
+
+
+class SlidingWindowCounter:
+    """Sorted timestamps inside a time window, bounded by max_events"""
+
+    __slots__ = ('window_seconds', 'events')
+
+    def __init__(self, window_seconds: float, max_events: int = 64):
+        self.window_seconds = window_seconds
+        self.events: Deque[float] = deque(maxlen=max_events)
+
+    def add(self, timestamp: float):
+        events = self.events
+        if not events or timestamp >= events[-1]:
+            events.append(timestamp)
+        else:
+            if len(events) == events.maxlen:
+                events.popleft()
+            bisect.insort(events, timestamp)
+        cutoff = events[-1] - self.window_seconds
+        while events[0] < cutoff:
+            events.popleft()
+
+    def count(self, timestamp: float) -> int:
+        """Number of events in [timestamp - window, timestamp]"""
+        events = self.events
+        return bisect.bisect_right(events, timestamp) - bisect.bisect_left(events, timestamp - self.window_seconds)
+
+
+class CategoryFeatures:
+    """Running statistics for one spending category"""
+
+    __slots__ = ('count', 'mean', 'm2', 'baseline', 'month_key', 'month_total', 'prev_month_key', 'prev_month_total')
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.baseline = EWMABaseline()
+        self.month_key = ''
+        self.month_total = 0.0
+        self.prev_month_key = ''
+        self.prev_month_total = 0.0
+
+    def update(self, amount: float, month_key: str):
+        # Welford's online mean/variance
+        self.count += 1
+        delta = amount - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (amount - self.mean)
+        self.baseline.update(amount)
+
+        if month_key == self.month_key:
+            self.month_total += amount
+        elif month_key > self.month_key:
+            # Month rolled over
+            self.prev_month_key, self.prev_month_total = self.month_key, self.month_total
+            self.month_key, self.month_total = month_key, amount
+        elif month_key == self.prev_month_key:
+            self.prev_month_total += amount
+
+    @property
+    def variance(self) -> float:
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    @property
+    def std(self) -> float:
+        return math.sqrt(self.variance)
+
+    def total_for_month(self, month_key: str) -> float:
+        if month_key == self.month_key:
+            return self.month_total
+        if month_key == self.prev_month_key:
+            return self.prev_month_total
+        return 0.0
+
+
+class MerchantFeatures:
+    """Running totals for one merchant"""
+
+    __slots__ = ('count', 'total', 'last_seen')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.last_seen = ''
+
+    def update(self, amount: float, date: str):
+        self.count += 1
+        self.total += amount
+        if date > self.last_seen:
+            self.last_seen = date
+
+    @property
+    def average(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+
+class UserFeatures:
+    """All rolling features for a single user"""
+
+    __slots__ = (
+        'categories', 'merchants', 'hour_histogram', 'burst_counter', 'high_value_counter', 'recent_ids',
+        'recent', 'transaction_count', 'expense_count', 'expense_total', 'first_date', 'seeded_at',
+    )
+
+    RECENT_ID_SIZE = 64
+    RECENT_TRANSACTION_SIZE = 50
+    RECENT_FIELDS = ('id', 'date', 'amount', 'category', 'vendor', 'type')
+    MAX_MERCHANTS = 256
+    BURST_WINDOW_SECONDS = 600
+    HIGH_VALUE_WINDOW_SECONDS = 3600
+    HIGH_VALUE_AMOUNT = 5000.0
+
+    def __init__(self):
+        self.categories: Dict[str, CategoryFeatures] = {}
+        self.merchants: "OrderedDict[str, MerchantFeatures]" = OrderedDict()
+        self.hour_histogram = array('I', bytes(4 * 24))
+        self.burst_counter = SlidingWindowCounter(self.BURST_WINDOW_SECONDS)
+        self.high_value_counter = SlidingWindowCounter(self.HIGH_VALUE_WINDOW_SECONDS)
+        self.recent_ids: Deque[str] = deque(maxlen=self.RECENT_ID_SIZE)
+        # (parsed date, projected transaction), oldest first
+        self.recent: Deque[Tuple[str, Dict[str, Any]]] = deque(maxlen=self.RECENT_TRANSACTION_SIZE)
+        self.transaction_count = 0
+        self.expense_count = 0
+        self.expense_total = 0.0
+        self.first_date = ''
+        self.seeded_at = time.monotonic()
+
+    def observe(self, transaction: Dict[str, Any]) -> bool:
+        """Fold one transaction into the features. Returns False for duplicates."""
+
+        txn_id = transaction.get('id')
+        if txn_id:
+            if txn_id in self.recent_ids:
+                return False
+            self.recent_ids.append(txn_id)
+
+        dt = parse_transaction_date(transaction.get('date')) or datetime.now()
+        date = dt.isoformat()
+        amount = abs(float(transaction.get('amount', 0) or 0))
+
+        self.transaction_count += 1
+        self.hour_histogram[dt.hour] += 1
+        timestamp = dt.timestamp()
+        self.burst_counter.add(timestamp)
+        if amount >= self.HIGH_VALUE_AMOUNT:
+            self.high_value_counter.add(timestamp)
+        if not self.first_date or date < self.first_date:
+            self.first_date = date
+        self._remember(date, transaction)
+
+        if transaction.get('type', 'expense') == 'expense':
+            self.expense_count += 1
+            self.expense_total += amount
+            category = transaction.get('category') or 'Uncategorized'
+            stats = self.categories.get(category)
+            if stats is None:
+                stats = self.categories[category] = CategoryFeatures()
+            stats.update(amount, dt.strftime('%Y-%m'))
+
+        vendor = transaction.get('vendor')
+        if vendor:
+            merchant = self.merchants.get(vendor)
+            if merchant is None:
+                merchant = self.merchants[vendor] = MerchantFeatures()
+                if len(self.merchants) > self.MAX_MERCHANTS:
+                    self.merchants.popitem(last=False)
+            else:
+                self.merchants.move_to_end(vendor)
+            merchant.update(amount, date)
+
+        return True
+
+    def _remember(self, date: str, transaction: Dict[str, Any]):
+        recent = self.recent
+        if len(recent) == recent.maxlen and date < recent[0][0]:
+            return  # Older than everything kept
+        entry = (date, {field: transaction.get(field) for field in self.RECENT_FIELDS})
+        if not recent or date >= recent[-1][0]:
+            recent.append(entry)
+            return
+        # Out of order: insert in place (the window is small)
+        if len(recent) == recent.maxlen:
+            recent.popleft()
+        i = len(recent)
+        while i and recent[i - 1][0] > date:
+            i -= 1
+        recent.insert(i, entry)
+
+    def recent_transactions(self) -> List[Dict[str, Any]]:
+        """The most recent transactions, newest first"""
+        return [transaction for _, transaction in reversed(self.recent)]
+
+    def category(self, category: str) -> Optional[CategoryFeatures]:
+        return self.categories.get(category)
+
+    def merchant(self, vendor: str) -> Optional[MerchantFeatures]:
+        return self.merchants.get(vendor)
+
+    def peak_hours(self, n: int = 3) -> List[int]:
+        ranked = sorted(range(24), key=lambda h: self.hour_histogram[h], reverse=True)
+        return [h for h in ranked[:n] if self.hour_histogram[h] > 0]
+
+    def is_unusual_hour(self, hour: int, min_share: float = 0.02) -> bool:
+        """True if the user has history and rarely transacts at this hour"""
+        if self.transaction_count < 10:
+            return False
+        return self.hour_histogram[hour] / self.transaction_count < min_share
+
+
+class UserFeatureStore:
+    """LRU-bounded map of user_id -> UserFeatures"""
+
+    MAX_USERS = 20000
+    MAX_AGE_SECONDS = 6 * 3600
+
+    def __init__(self, max_users: int = MAX_USERS, max_age_seconds: float = MAX_AGE_SECONDS):
+        self.max_users = max_users
+        self.max_age_seconds = max_age_seconds
+        self._users: "OrderedDict[str, UserFeatures]" = OrderedDict()
+        self._lock = threading.Lock()
+        logger.info("🧮 User Feature Store initialized")
+
+    def get(self, user_id: str) -> Optional[UserFeatures]:
+        """Return fresh features for the user, or None if missing or stale"""
+        with self._lock:
+            features = self._users.get(user_id)
+            if features is None:
+                return None
+            if time.monotonic() - features.seeded_at > self.max_age_seconds:
+                del self._users[user_id]
+                return None
+            self._users.move_to_end(user_id)
+            return features
+
+    def seed(self, user_id: str, transactions: Iterable[Dict[str, Any]]) -> UserFeatures:
+        """Build features from a transaction history (any order)"""
+
+        features = UserFeatures()
+        ordered = sorted(transactions, key=lambda t: str(t.get('date', '')))
+        for txn in ordered:
+            try:
+                features.observe(txn)
+            except (TypeError, ValueError):
+                continue
+
+        with self._lock:
+            self._users[user_id] = features
+            self._users.move_to_end(user_id)
+            self._evict()
+        return features
+
+    def record_transaction(self, user_id: str, transaction: Dict[str, Any]) -> bool:
+        """Update a user's features with a new transaction, if they are loaded"""
+        with self._lock:
+            features = self._users.get(user_id)
+            if features is None:
+                return False
+            self._users.move_to_end(user_id)
+            try:
+                return features.observe(transaction)
+            except (TypeError, ValueError) as e:
+                logger.debug(f"Skipping malformed transaction for features: {e}")
+                return False
+
+    def invalidate(self, user_id: str):
+        with self._lock:
+            self._users.pop(user_id, None)
+
+    def _evict(self):
+        while len(self._users) > self.max_users:
+            self._users.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._users)
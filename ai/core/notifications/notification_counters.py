@@ -0,0 +1,457 @@
+"""
+Notification Counters
+=====================
+
+Per-user notification statistics kept in one document,
+notification_counters/{user_id}, instead of scanning every notification:
+- Creating, reading and deleting a notification adds a write that
+  increments (or decrements) the user's counters; it is committed in the
+  same WriteBatch as the notification change itself
+- The last-24h count comes from hourly buckets in the same document; stale
+  buckets are pruned when the counters are read
+- Stats are served from a single document read
+- A reconciliation job recomputes counters from the notifications
+  collection to repair drift (concurrent updates, failed writes); the
+  rebuilt document is written in a transaction only if no increment
+  landed during the scan. Users whose counters were never reconciled
+  (e.g. notifications that predate the counters) fall back to
+  server-side count() queries until they have been
+
+The same document holds the user's read watermark, last_read_at: every
+notification up to it counts as read, whatever its own is_read says.
+Mark-all-read only moves the watermark; the per-document is_read flags
+are caught up afterwards in the background, in WriteBatch-sized chunks.
+"""
+
+import asyncio
+import logging
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional, Set
+
+from firebase_admin import firestore
+
+from .notification_types import Notification, NotificationCategory, NotificationPriority
+from .notification_writer import NotificationWriter, WriteOp
+
+logger = logging.getLogger(__name__)
+
+RECENT_HOURS = 24
+
+
+def _hour_key(moment: datetime) -> str:
+    return moment.strftime('%Y%m%d%H')
+
+
+def _parse_timestamp(value: Any) -> Optional[datetime]:
+    if isinstance(value, datetime):
+        return value
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def is_read(data: Dict[str, Any], last_read_at: Optional[str] = None) -> bool:
+    """A stored notification's read state: its own flag or the user's read watermark"""
+    if data.get('is_read', False):
+        return True
+    return bool(last_read_at) and (data.get('timestamp') or '') <= last_read_at
+
+
+def is_counted_unread(data: Dict[str, Any], last_read_at: Optional[str] = None) -> bool:
+    """Whether a stored notification currently counts towards the unread total"""
+    return not data.get('is_deleted', False) and not is_read(data, last_read_at)
+
+
+class NotificationCounters:
+    """Maintains and serves notification_counters/{user_id}"""
+
+    COLLECTION = "notification_counters"
+    NOTIFICATIONS_COLLECTION = "notifications"
+    # Counters older than this are recomputed in the background
+    RECONCILE_AFTER = timedelta(days=1)
+    RECONCILE_INTERVAL_SECONDS = 6 * 3600
+    RECONCILE_BATCH_SIZE = 100
+    # Documents marked read per WriteBatch when catching up to a watermark
+    READ_CHUNK_SIZE = 500
+    # Scans retried when counters change underneath a reconciliation
+    RECONCILE_ATTEMPTS = 3
+
+    def __init__(self, firestore_client=None, writer: Optional[NotificationWriter] = None):
+        self.db = firestore_client
+        self.writer = writer if writer is not None else NotificationWriter(firestore_client)
+
+        self._reconciling: Set[str] = set()
+        self._catching_up: Set[str] = set()
+        self._background: Set[asyncio.Task] = set()
+        self._task: Optional[asyncio.Task] = None
+
+        self.reconciled = 0
+        self.reconcile_conflicts = 0
+        self.aggregation_fallbacks = 0
+        self.marked_read = 0
+
+    # ========================================================================
+    # COUNTER UPDATES
+    # ========================================================================
+
+    def created_op(self, notification: Notification) -> WriteOp:
+        """Counter increments for a newly stored notification"""
+
+        return ('merge', self.COLLECTION, notification.user_id, {
+            'user_id': notification.user_id,
+            'total': firestore.Increment(1),
+            'unread': firestore.Increment(0 if notification.is_read else 1),
+            'by_category': {notification.category.value: firestore.Increment(1)},
+            'by_priority': {notification.priority.value: firestore.Increment(1)},
+            'recent_hours': {_hour_key(notification.timestamp): firestore.Increment(1)},
+            'updated_at': datetime.now().isoformat(),
+        })
+
+    def unread_op(self, user_id: str, delta: int) -> WriteOp:
+        """Adjust the unread count, e.g. -1 when a notification is read"""
+
+        return ('merge', self.COLLECTION, user_id, {
+            'unread': firestore.Increment(delta),
+            'updated_at': datetime.now().isoformat(),
+        })
+
+    def deleted_op(self, user_id: str, data: Dict[str, Any], unread: bool) -> WriteOp:
+        """Counter decrements for a notification that is being deleted"""
+
+        update = {
+            'total': firestore.Increment(-1),
+            'unread': firestore.Increment(-1 if unread else 0),
+            'updated_at': datetime.now().isoformat(),
+        }
+        if data.get('category'):
+            update['by_category'] = {data['category']: firestore.Increment(-1)}
+        if data.get('priority'):
+            update['by_priority'] = {data['priority']: firestore.Increment(-1)}
+
+        timestamp = _parse_timestamp(data.get('timestamp'))
+        if timestamp is not None and _hour_key(timestamp) >= self._recent_cutoff():
+            update['recent_hours'] = {_hour_key(timestamp): firestore.Increment(-1)}
+        return ('merge', self.COLLECTION, user_id, update)
+
+    # ========================================================================
+    # READ WATERMARK
+    # ========================================================================
+
+    async def get_last_read_at(self, user_id: str) -> Optional[str]:
+        """The user's read watermark (ISO timestamp), if they ever marked all read"""
+
+        doc = await asyncio.to_thread(
+            self.db.collection(self.COLLECTION).document(user_id).get, ['last_read_at']
+        )
+        return (doc.to_dict() or {}).get('last_read_at') if doc.exists else None
+
+    async def is_unread(self, user_id: str, data: Dict[str, Any]) -> bool:
+        """is_counted_unread, reading the watermark only when it matters"""
+
+        if not is_counted_unread(data):
+            return False
+        return is_counted_unread(data, await self.get_last_read_at(user_id))
+
+    async def mark_all_read(self, user_id: str) -> str:
+        """
+        Mark everything up to now as read with one write.
+
+        Returns:
+            The new watermark; is_read flags catch up in the background
+        """
+
+        watermark = datetime.now().isoformat()
+        await self.writer.write([('merge', self.COLLECTION, user_id, {
+            'user_id': user_id,
+            'last_read_at': watermark,
+            'unread': 0,
+            'updated_at': watermark,
+        })])
+
+        if user_id not in self._catching_up:
+            self._catching_up.add(user_id)
+            self._spawn(self._catch_up_read(user_id, watermark))
+        return watermark
+
+    async def _catch_up_read(self, user_id: str, watermark: str):
+        """Set is_read on documents below the watermark, one WriteBatch per chunk"""
+
+        try:
+            query = self.db.collection(self.NOTIFICATIONS_COLLECTION) \
+                .where('user_id', '==', user_id) \
+                .where('is_read', '==', False) \
+                .where('timestamp', '<=', watermark) \
+                .select([]) \
+                .limit(self.READ_CHUNK_SIZE)
+
+            # Updated documents drop out of the query, so each round reads the next chunk
+            while True:
+                doc_ids = await asyncio.to_thread(lambda: [doc.id for doc in query.stream()])
+                if not doc_ids:
+                    break
+                await self.writer.write([
+                    ('update', self.NOTIFICATIONS_COLLECTION, doc_id, {'is_read': True, 'opened_at': watermark})
+                    for doc_id in doc_ids
+                ])
+                self.marked_read += len(doc_ids)
+                if len(doc_ids) < self.READ_CHUNK_SIZE:
+                    break
+            logger.debug(f"✅ Caught up read flags for user {user_id}")
+        except Exception as e:
+            logger.error(f"❌ Error marking notifications read for {user_id}: {e}")
+        finally:
+            self._catching_up.discard(user_id)
+
+    # ========================================================================
+    # STATS
+    # ========================================================================
+
+    async def get_stats(self, user_id: str) -> Dict[str, Any]:
+        """
+        Notification statistics for a user.
+
+        Returns:
+            Dict with total_notifications, unread_count, by_category,
+            by_priority and recent_count (last 24 hours)
+        """
+
+        doc = await asyncio.to_thread(self.db.collection(self.COLLECTION).document(user_id).get)
+        data = doc.to_dict() if doc.exists else None
+
+        if data is None or self._needs_reconcile(data):
+            self._spawn_reconcile(user_id)
+        if data is None or not data.get('reconciled_at'):
+            # Never reconciled: the increments only cover notifications
+            # created since counters were introduced
+            self.aggregation_fallbacks += 1
+            return await self.aggregate_stats(user_id)
+
+        cutoff = self._recent_cutoff()
+        recent_hours = data.get('recent_hours') or {}
+        stale = [key for key in recent_hours if key < cutoff]
+        if stale:
+            self._spawn(self.writer.write([('merge', self.COLLECTION, user_id, {
+                'recent_hours': {key: firestore.DELETE_FIELD for key in stale},
+            })]))
+
+        return {
+            'total_notifications': max(int(data.get('total', 0)), 0),
+            'unread_count': max(int(data.get('unread', 0)), 0),
+            'by_category': {k: int(v) for k, v in (data.get('by_category') or {}).items() if v > 0},
+            'by_priority': {k: int(v) for k, v in (data.get('by_priority') or {}).items() if v > 0},
+            'recent_count': sum(int(v) for k, v in recent_hours.items() if k >= cutoff and v > 0),
+        }
+
+    async def aggregate_stats(self, user_id: str) -> Dict[str, Any]:
+        """
+        Compute the same stats with server-side count() aggregations.
+
+        Each bucket is one count() over indexed fields. Soft-deleted
+        notifications (rare, and not every document has is_deleted) are
+        read once with a projection and subtracted locally, so no bucket
+        needs an is_deleted composite index.
+        """
+
+        base = self.db.collection(self.NOTIFICATIONS_COLLECTION).where('user_id', '==', user_id)
+        yesterday = (datetime.now() - timedelta(hours=RECENT_HOURS)).isoformat()
+
+        buckets = {
+            'total': [],
+            'unread': [('is_read', '==', False)],
+            'recent': [('timestamp', '>=', yesterday)],
+        }
+        for category in NotificationCategory:
+            buckets[('category', category.value)] = [('category', '==', category.value)]
+        for priority in NotificationPriority:
+            buckets[('priority', priority.value)] = [('priority', '==', priority.value)]
+
+        deleted_query = base.where('is_deleted', '==', True) \
+            .select(['is_read', 'category', 'priority', 'timestamp'])
+        keys = list(buckets)
+        counts, deleted = await asyncio.gather(
+            asyncio.gather(*(self._count(base, buckets[key]) for key in keys)),
+            asyncio.to_thread(lambda: [doc.to_dict() for doc in deleted_query.stream()]),
+        )
+        totals = dict(zip(keys, counts))
+        for data in deleted:
+            for key in ('total', ('category', data.get('category')), ('priority', data.get('priority'))):
+                if key in totals:
+                    totals[key] -= 1
+            if not data.get('is_read', False):
+                totals['unread'] -= 1
+            if (data.get('timestamp') or '') >= yesterday:
+                totals['recent'] -= 1
+        totals = {key: max(n, 0) for key, n in totals.items()}
+
+        return {
+            'total_notifications': totals['total'],
+            'unread_count': totals['unread'],
+            'by_category': {key[1]: n for key, n in totals.items() if isinstance(key, tuple) and key[0] == 'category' and n > 0},
+            'by_priority': {key[1]: n for key, n in totals.items() if isinstance(key, tuple) and key[0] == 'priority' and n > 0},
+            'recent_count': totals['recent'],
+        }
+
+    @staticmethod
+    async def _count(query, filters) -> int:
+        for field, op, value in filters:
+            query = query.where(field, op, value)
+        result = await asyncio.to_thread(query.count().get)
+        return int(result[0][0].value)
+
+    # ========================================================================
+    # RECONCILIATION
+    # ========================================================================
+
+    async def reconcile(self, user_id: str) -> Dict[str, Any]:
+        """
+        Recompute a user's counters from their notifications and overwrite the document.
+
+        The document's update time is read before the scan; the rebuilt
+        counters are written in a transaction only if it is unchanged, so an
+        increment committed during the scan is never lost. On a conflict
+        the scan is repeated, up to RECONCILE_ATTEMPTS times.
+
+        Returns:
+            The written counters, or None if every attempt conflicted
+        """
+
+        ref = self.db.collection(self.COLLECTION).document(user_id)
+        for _ in range(self.RECONCILE_ATTEMPTS):
+            before = await asyncio.to_thread(ref.get)
+            update_time = before.update_time if before.exists else None
+            last_read_at = (before.to_dict() or {}).get('last_read_at') if before.exists else None
+
+            counters = await self._recount(user_id, last_read_at)
+            if await asyncio.to_thread(self._write_if_unchanged, ref, update_time, counters):
+                self.reconciled += 1
+                logger.debug(f"🔢 Reconciled notification counters for user {user_id}")
+                return counters
+            self.reconcile_conflicts += 1
+
+        logger.warning(f"⚠️ Notification counters for {user_id} kept changing, reconciliation skipped")
+        return None
+
+    async def _recount(self, user_id: str, last_read_at: Optional[str]) -> Dict[str, Any]:
+        query = self.db.collection(self.NOTIFICATIONS_COLLECTION) \
+            .where('user_id', '==', user_id) \
+            .select(['is_read', 'is_deleted', 'category', 'priority', 'timestamp'])
+        docs = await asyncio.to_thread(lambda: [doc.to_dict() for doc in query.stream()])
+
+        cutoff = self._recent_cutoff()
+        total = unread = 0
+        by_category, by_priority, recent_hours = Counter(), Counter(), Counter()
+        for data in docs:
+            if data.get('is_deleted', False):
+                continue
+            total += 1
+            unread += is_counted_unread(data, last_read_at)
+            by_category[data.get('category', 'unknown')] += 1
+            by_priority[data.get('priority', 'medium')] += 1
+            timestamp = _parse_timestamp(data.get('timestamp'))
+            if timestamp is not None and _hour_key(timestamp) >= cutoff:
+                recent_hours[_hour_key(timestamp)] += 1
+
+        now = datetime.now().isoformat()
+        return {
+            'user_id': user_id,
+            'total': total,
+            'unread': unread,
+            'by_category': dict(by_category),
+            'by_priority': dict(by_priority),
+            'recent_hours': dict(recent_hours),
+            'last_read_at': last_read_at,
+            'updated_at': now,
+            'reconciled_at': now,
+        }
+
+    def _write_if_unchanged(self, ref, update_time, counters: Dict[str, Any]) -> bool:
+        """Overwrite the counters document unless it changed since update_time (runs in a thread)"""
+
+        @firestore.transactional
+        def write(transaction) -> bool:
+            current = ref.get(transaction=transaction)
+            if (current.update_time if current.exists else None) != update_time:
+                return False
+            transaction.set(ref, counters)
+            return True
+
+        return write(self.db.transaction())
+
+    async def reconcile_stale(self, limit: int = RECONCILE_BATCH_SIZE) -> int:
+        """Reconcile the counters that have gone longest without it"""
+
+        cutoff = (datetime.now() - self.RECONCILE_AFTER).isoformat()
+        query = self.db.collection(self.COLLECTION) \
+            .where('reconciled_at', '<', cutoff) \
+            .order_by('reconciled_at') \
+            .limit(limit)
+        user_ids = await asyncio.to_thread(lambda: [doc.id for doc in query.stream()])
+
+        for user_id in user_ids:
+            try:
+                await self.reconcile(user_id)
+            except Exception as e:
+                logger.error(f"❌ Error reconciling notification counters for {user_id}: {e}")
+        return len(user_ids)
+
+    def start(self, interval_seconds: float = RECONCILE_INTERVAL_SECONDS):
+        """Run reconcile_stale periodically on the running loop"""
+
+        if self._task is None and self.db is not None:
+            self._task = asyncio.create_task(self._reconcile_loop(interval_seconds))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "reconciled": self.reconciled,
+            "reconcile_conflicts": self.reconcile_conflicts,
+            "reconciling": len(self._reconciling),
+            "aggregation_fallbacks": self.aggregation_fallbacks,
+            "marked_read": self.marked_read,
+        }
+
+    async def _reconcile_loop(self, interval_seconds: float):
+        while True:
+            try:
+                count = await self.reconcile_stale()
+                if count:
+                    logger.info(f"🔢 Reconciled notification counters for {count} users")
+            except Exception as e:
+                logger.error(f"❌ Notification counter reconciliation failed: {e}")
+            await asyncio.sleep(interval_seconds)
+
+    def _needs_reconcile(self, data: Dict[str, Any]) -> bool:
+        reconciled_at = _parse_timestamp(data.get('reconciled_at'))
+        return reconciled_at is None or datetime.now() - reconciled_at > self.RECONCILE_AFTER
+
+    def _spawn_reconcile(self, user_id: str):
+        if user_id in self._reconciling:
+            return
+        self._reconciling.add(user_id)
+
+        async def run():
+            try:
+                await self.reconcile(user_id)
+            except Exception as e:
+                logger.error(f"❌ Error reconciling notification counters for {user_id}: {e}")
+            finally:
+                self._reconciling.discard(user_id)
+
+        self._spawn(run())
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+    @staticmethod
+    def _recent_cutoff() -> str:
+        return _hour_key(datetime.now() - timedelta(hours=RECENT_HOURS))
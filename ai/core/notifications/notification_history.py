@@ -0,0 +1,132 @@
+"""
+Notification History
+====================
+
+Bounded in-memory record of recently created notifications:
+- Only a compact summary is kept (id, category, priority, timestamp,
+  scores), never the full Notification with its context
+- Each user has a fixed-size ring buffer of their latest summaries
+- Users are evicted least recently used first, and after going idle, so
+  memory stays flat under sustained load
+
+Firestore remains the source of truth; this is for cheap recent lookups.
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, List, Optional
+
+from .notification_types import Notification
+
+logger = logging.getLogger(__name__)
+
+
+class NotificationSummary:
+    """The fields of a notification worth keeping in memory"""
+
+    __slots__ = ('id', 'category', 'priority', 'timestamp', 'importance_score', 'relevance_score')
+
+    def __init__(
+        self,
+        id: str,
+        category: str,
+        priority: str,
+        timestamp: float,
+        importance_score: float,
+        relevance_score: float
+    ):
+        self.id = id
+        self.category = category
+        self.priority = priority
+        self.timestamp = timestamp
+        self.importance_score = importance_score
+        self.relevance_score = relevance_score
+
+    @staticmethod
+    def from_notification(notification: Notification) -> 'NotificationSummary':
+        return NotificationSummary(
+            notification.id,
+            notification.category.value,
+            notification.priority.value,
+            notification.timestamp.timestamp(),
+            notification.importance_score,
+            notification.relevance_score,
+        )
+
+    def to_dict(self) -> Dict[str, object]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class _UserHistory:
+    __slots__ = ('items', 'last_seen')
+
+    def __init__(self, size: int):
+        self.items: Deque[NotificationSummary] = deque(maxlen=size)
+        self.last_seen = 0.0
+
+
+class NotificationHistory:
+    """Per-user ring buffers of notification summaries with LRU eviction"""
+
+    PER_USER = 50
+    MAX_USERS = 20000
+    IDLE_SECONDS = 24 * 3600
+
+    def __init__(
+        self,
+        per_user: int = PER_USER,
+        max_users: int = MAX_USERS,
+        idle_seconds: float = IDLE_SECONDS
+    ):
+        self.per_user = per_user
+        self.max_users = max_users
+        self.idle_seconds = idle_seconds
+        self._users: "OrderedDict[str, _UserHistory]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def add(self, notification: Notification):
+        """Record a notification, dropping the user's oldest summary if full"""
+
+        summary = NotificationSummary.from_notification(notification)
+        now = time.monotonic()
+        with self._lock:
+            history = self._users.get(notification.user_id)
+            if history is None:
+                history = self._users[notification.user_id] = _UserHistory(self.per_user)
+            else:
+                self._users.move_to_end(notification.user_id)
+            history.items.append(summary)
+            history.last_seen = now
+            self._evict(now)
+
+    def recent(self, user_id: str, limit: Optional[int] = None) -> List[NotificationSummary]:
+        """A user's summaries, newest first"""
+
+        with self._lock:
+            history = self._users.get(user_id)
+            if history is None:
+                return []
+            items = list(reversed(history.items))
+        return items[:limit] if limit is not None else items
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "users": len(self._users),
+                "summaries": sum(len(h.items) for h in self._users.values()),
+                "evictions": self.evictions,
+            }
+
+    def _evict(self, now: float):
+        while self._users:
+            user_id, history = next(iter(self._users.items()))
+            if len(self._users) <= self.max_users and now - history.last_seen < self.idle_seconds:
+                break
+            del self._users[user_id]
+            self.evictions += 1
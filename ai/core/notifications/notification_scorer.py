@@ -22,6 +22,13 @@ logger = logging.getLogger(__name__)
 class NotificationScorer:
     """Calculate importance scores for notifications"""
     
+    # Most the context-dependent terms can add, per trigger type
+    MAX_CONTEXT_POINTS = {
+        "transaction_created": 45.0,  # vs. user average, budget impact, unusual time
+        "budget_threshold": 10.0,     # usually exceeds budget
+    }
+    ANOMALY_BOOST = 30.0
+    
     def calculate_importance(
         self,
         trigger: NotificationTrigger,
@@ -49,12 +56,14 @@ class NotificationScorer:
                 score = 95.0  # Anomalies are always high importance
             elif trigger.trigger_type == "insight_generated":
                 score = self._score_insight(trigger, context)
+            elif trigger.trigger_type == "transaction_digest":
+                score = self._score_digest(trigger, context)
             else:
                 score = 50.0  # Default medium importance
             
             # Boost score if anomalies detected
             if anomalies and anomalies.get('is_anomaly'):
-                score = min(100.0, score + 30.0)
+                score = min(100.0, score + self.ANOMALY_BOOST)
             
             # Cap between 0-100
             score = max(0.0, min(100.0, score))
@@ -67,6 +76,59 @@ class NotificationScorer:
         
         return score
     
+    def pre_score(self, trigger: NotificationTrigger) -> float:
+        """
+        Cheap importance estimate from trigger data alone (no context).
+        
+        Used to rank bursts of triggers before any Firestore reads or LLM calls.
+        """
+        
+        if trigger.trigger_type != "transaction_created":
+            return 50.0
+        
+        txn = trigger.data.get("transaction", {})
+        amount = abs(float(txn.get("amount", 0) or 0))
+        
+        score = 40.0 + self._amount_points(amount)
+        if txn.get("type", "expense") == "income":
+            score += 15.0
+        
+        anomaly = trigger.data.get("anomaly")
+        if anomaly and anomaly.get('is_anomaly'):
+            score += 30.0
+        
+        return min(100.0, score)
+    
+    def importance_upper_bound(self, trigger: NotificationTrigger) -> float:
+        """
+        Highest importance the trigger could reach once its context is known.
+        
+        Scores the trigger against an empty context, then adds the most each
+        context-dependent term could contribute (and the anomaly boost, unless
+        the trigger was already scored for anomalies).
+        """
+        
+        anomalies = trigger.data.get("anomaly")
+        score = self.calculate_importance(trigger, NotificationContext(), anomalies)
+        score += self.MAX_CONTEXT_POINTS.get(trigger.trigger_type, 0.0)
+        
+        if trigger.trigger_type == "transaction_created" and "anomaly" not in trigger.data:
+            score += self.ANOMALY_BOOST
+        
+        return min(100.0, score)
+    
+    @staticmethod
+    def _amount_points(amount: float) -> float:
+        if amount >= 50000:
+            return 30.0
+        elif amount >= 10000:
+            return 20.0
+        elif amount >= 5000:
+            return 10.0
+        elif amount >= 1000:
+            return 5.0
+        return 0.0
+    
     def _score_transaction(
         self,
         trigger: NotificationTrigger,
@@ -82,14 +144,7 @@ class NotificationScorer:
         score = 40.0  # Base score
         
         # Amount-based scoring
-        if amount >= 50000:
-            score += 30.0
-        elif amount >= 10000:
-            score += 20.0
-        elif amount >= 5000:
-            score += 10.0
-        elif amount >= 1000:
-            score += 5.0
+        score += self._amount_points(amount)
         
         # Income always important
         if tx_type == "income":
@@ -126,6 +181,29 @@ class NotificationScorer:
         
         return score
     
+    def _score_digest(
+        self,
+        trigger: NotificationTrigger,
+        context: NotificationContext
+    ) -> float:
+        """Score transaction digest notifications"""
+        
+        count = trigger.data.get("count", 0)
+        largest = max(
+            (abs(float(t.get("amount", 0) or 0)) for t in trigger.data.get("transactions", [])),
+            default=0.0
+        )
+        
+        score = 40.0 + self._amount_points(largest)
+        
+        # Bigger bursts are more worth a summary
+        if count >= 20:
+            score += 10.0
+        elif count >= 10:
+            score += 5.0
+        
+        return score
+    
     def _score_budget(
         self,
         trigger: NotificationTrigger,
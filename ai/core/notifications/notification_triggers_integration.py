@@ -4,6 +4,9 @@ Notification Triggers Integration
 
 Helper functions to easily trigger notifications from anywhere in the codebase.
 
+Triggers are put on the notification trigger queue and processed by its
+worker pool, so these helpers return as soon as the trigger is queued.
+
 Usage:
     from core.notifications.notification_triggers_integration import (
         notify_transaction_created,
@@ -16,14 +19,23 @@ Usage:
 """
 
 import logging
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional
 from datetime import datetime
 from core.notifications.notification_types import NotificationTrigger
-from endpoints_notifications import notification_engine
+from endpoints_notifications import trigger_queue
 
 logger = logging.getLogger(__name__)
 
 
+async def _enqueue(trigger: NotificationTrigger) -> bool:
+    """Queue a trigger for the notification workers"""
+    if not trigger_queue:
+        logger.warning("Notification trigger queue not initialized")
+        return False
+    await trigger_queue.enqueue(trigger)
+    return True
+
+
 # ============================================================================
 # TRANSACTION NOTIFICATIONS
 # ============================================================================
@@ -47,32 +59,46 @@ async def notify_transaction_created(
             - description (optional)
     
     Returns:
-        True if notification was created, False otherwise
+        True if the trigger was queued, False otherwise
     """
     try:
-        if not notification_engine:
-            logger.warning("Notification engine not initialized")
-            return False
-        
         trigger = NotificationTrigger.transaction_created(
             user_id=user_id,
             transaction=transaction
         )
+        return await _enqueue(trigger)
         
-        notification = await notification_engine.process_trigger(trigger)
-        
-        if notification:
-            logger.info(f"✅ Transaction notification created: {notification.id}")
-            return True
-        else:
-            logger.debug(f"Transaction notification filtered out (not important enough)")
-            return False
-            
     except Exception as e:
         logger.error(f"❌ Error triggering transaction notification: {e}")
         return False
 
 
+async def notify_transactions_created(
+    user_id: str,
+    transactions: List[Dict[str, Any]],
+) -> int:
+    """
+    Trigger notifications for a batch of one user's transactions (e.g. an SMS import).
+    
+    The queue hands a user's queued triggers to the engine together, which
+    scores their anomalies in one vectorized pass.
+    
+    Args:
+        user_id: User ID
+        transactions: Transaction dictionaries (same keys as notify_transaction_created)
+    
+    Returns:
+        Number of triggers queued
+    """
+    count = 0
+    
+    for transaction in transactions:
+        if await notify_transaction_created(user_id, transaction):
+            count += 1
+    
+    return count
+
+
 async def notify_high_value_transaction(
     user_id: str,
     transaction: Dict[str, Any],
@@ -109,26 +135,18 @@ async def notify_budget_threshold(
         percentage: Percentage used (e.g., 90)
     
     Returns:
-        True if notification was created
+        True if the trigger was queued
     """
     try:
-        if not notification_engine:
-            return False
-        
-        trigger = NotificationTrigger.budget_threshold(
+        trigger = NotificationTrigger.budget_threshold_reached(
             user_id=user_id,
+            budget_id=None,
+            percentage=percentage / 100.0,
             category=category,
             current_amount=current_amount,
-            budget_amount=budget_amount,
-            percentage=percentage
+            budget_amount=budget_amount
         )
-        
-        notification = await notification_engine.process_trigger(trigger)
-        
-        if notification:
-            logger.info(f"✅ Budget alert notification created: {notification.id}")
-            return True
-        return False
+        return await _enqueue(trigger)
         
     except Exception as e:
         logger.error(f"❌ Error triggering budget notification: {e}")
@@ -170,25 +188,19 @@ async def notify_bill_reminder(
         days_until_due: Number of days until due
     
     Returns:
-        True if notification was created
+        True if the trigger was queued
     """
     try:
-        if not notification_engine:
-            return False
-        
         trigger = NotificationTrigger.bill_due_soon(
             user_id=user_id,
-            bill_name=bill_name,
-            amount=amount,
-            due_date=due_date
+            bill={
+                'name': bill_name,
+                'amount': amount,
+                'due_date': due_date,
+            },
+            days_until_due=days_until_due
         )
-        
-        notification = await notification_engine.process_trigger(trigger)
-        
-        if notification:
-            logger.info(f"✅ Bill reminder notification created: {notification.id}")
-            return True
-        return False
+        return await _enqueue(trigger)
         
     except Exception as e:
         logger.error(f"❌ Error triggering bill notification: {e}")
@@ -217,26 +229,18 @@ async def notify_goal_milestone(
         milestone: Milestone percentage (25, 50, 75, 100)
     
     Returns:
-        True if notification was created
+        True if the trigger was queued
     """
     try:
-        if not notification_engine:
-            return False
-        
-        trigger = NotificationTrigger.goal_milestone(
+        trigger = NotificationTrigger.goal_milestone_reached(
             user_id=user_id,
+            goal_id=None,
+            milestone_percentage=milestone,
             goal_name=goal_name,
             current_amount=current_amount,
-            target_amount=target_amount,
-            milestone=milestone
+            target_amount=target_amount
         )
-        
-        notification = await notification_engine.process_trigger(trigger)
-        
-        if notification:
-            logger.info(f"✅ Goal milestone notification created: {notification.id}")
-            return True
-        return False
+        return await _enqueue(trigger)
         
     except Exception as e:
         logger.error(f"❌ Error triggering goal notification: {e}")
@@ -265,26 +269,19 @@ async def notify_ai_insight(
         data: Additional data for context
     
     Returns:
-        True if notification was created
+        True if the trigger was queued
     """
     try:
-        if not notification_engine:
-            return False
-        
-        trigger = NotificationTrigger.ai_insight(
+        trigger = NotificationTrigger.insight_generated(
             user_id=user_id,
             insight_type=insight_type,
-            title=title,
-            description=description,
-            data=data or {}
+            insight_data={
+                **(data or {}),
+                'title': title,
+                'description': description,
+            }
         )
-        
-        notification = await notification_engine.process_trigger(trigger)
-        
-        if notification:
-            logger.info(f"✅ AI insight notification created: {notification.id}")
-            return True
-        return False
+        return await _enqueue(trigger)
         
     except Exception as e:
         logger.error(f"❌ Error triggering AI insight notification: {e}")
@@ -311,12 +308,9 @@ async def notify_suspicious_activity(
         risk_score: Risk score 0.0-1.0
     
     Returns:
-        True if notification was created
+        True if the trigger was queued
     """
     try:
-        if not notification_engine:
-            return False
-        
         # Add anomaly info to transaction data
         transaction_with_anomaly = {
             **transaction,
@@ -330,12 +324,10 @@ async def notify_suspicious_activity(
             transaction=transaction_with_anomaly
         )
         
-        notification = await notification_engine.process_trigger(trigger)
-        
-        if notification:
-            logger.warning(f"🚨 FRAUD ALERT notification created: {notification.id}")
-            return True
-        return False
+        queued = await _enqueue(trigger)
+        if queued:
+            logger.warning(f"🚨 FRAUD ALERT trigger queued for user {user_id}")
+        return queued
         
     except Exception as e:
         logger.error(f"❌ Error triggering fraud notification: {e}")
@@ -346,6 +338,9 @@ async def notify_suspicious_activity(
 # BATCH NOTIFICATION TRIGGERS
 # ============================================================================
 
+# Triggers queued together reach the workers together, so the engine writes
+# their content in batched Gemini requests instead of one call each.
+
 async def check_and_notify_budgets(user_id: str, budgets: list[Dict[str, Any]]) -> int:
     """
     Check all budgets and trigger notifications for those exceeding thresholds.
@@ -358,7 +353,7 @@ async def check_and_notify_budgets(user_id: str, budgets: list[Dict[str, Any]])
             - budget: Budget limit
     
     Returns:
-        Number of notifications created
+        Number of notifications queued
     """
     count = 0
     
@@ -400,7 +395,7 @@ async def check_and_notify_bills(user_id: str, bills: list[Dict[str, Any]]) -> i
             - days_until_due: Days until due
     
     Returns:
-        Number of notifications created
+        Number of notifications queued
     """
     count = 0
     
@@ -2,7 +2,10 @@
 Notification Types and Data Models
 """
 
+import json
+import zlib
 from enum import Enum
+from operator import attrgetter
 from dataclasses import dataclass, field
 from typing import Dict, List, Optional, Any
 from datetime import datetime
@@ -159,6 +162,36 @@ class Notification:
     variant: Optional[str] = None
     test_group: Optional[str] = None
     
+    def to_storage_dict(self, context_ref: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Lean document for the notifications collection: display fields,
+        scores and status, with the context stored separately (see
+        context_snapshot) and only referenced here.
+        """
+        doc = dict(zip(_STORED_FIELDS, _get_stored_fields(self)))
+        for name, value in zip(_STORED_DATETIME_FIELDS, _get_stored_datetimes(self)):
+            doc[name] = value.isoformat() if value else None
+        doc['category'] = _ENUM_VALUES[self.category]
+        doc['priority'] = _ENUM_VALUES[self.priority]
+        doc['channels'] = [_ENUM_VALUES[c] for c in self.channels]
+        doc['available_actions'] = [_ENUM_VALUES[a] for a in self.available_actions]
+        doc['action_taken'] = _ENUM_VALUES[self.action_taken] if self.action_taken else None
+        doc['context_ref'] = context_ref
+        return doc
+    
+    def context_snapshot(self) -> Optional[bytes]:
+        """The stored part of the context as compressed JSON, or None if empty"""
+        data = {name: getattr(self.context, name) for name in _SNAPSHOT_CONTEXT_FIELDS}
+        data = {name: value for name, value in data.items() if value}
+        if not data:
+            return None
+        return zlib.compress(json.dumps(data, separators=(',', ':'), default=str).encode('utf-8'))
+    
+    @staticmethod
+    def decode_context_snapshot(snapshot: bytes) -> Dict[str, Any]:
+        """Inverse of context_snapshot()"""
+        return json.loads(zlib.decompress(snapshot).decode('utf-8'))
+    
     def to_dict(self) -> Dict[str, Any]:
         """Convert to dictionary for storage/API"""
         return {
@@ -194,6 +227,72 @@ class Notification:
             'optimal_delivery_time': self.optimal_delivery_time.isoformat() if self.optimal_delivery_time else None,
             'user_preference_score': self.user_preference_score,
         }
+    
+    @staticmethod
+    def from_dict(data: Dict[str, Any]) -> 'Notification':
+        """Rebuild a notification from to_dict() output"""
+        
+        def _dt(key: str) -> Optional[datetime]:
+            return datetime.fromisoformat(data[key]) if data.get(key) else None
+        
+        context = data.get('context') or {}
+        return Notification(
+            id=data['id'],
+            user_id=data['user_id'],
+            category=NotificationCategory(data['category']),
+            priority=NotificationPriority(data['priority']),
+            title=data.get('title', ''),
+            body=data.get('body', ''),
+            rich_content=data.get('rich_content'),
+            timestamp=_dt('timestamp') or datetime.now(),
+            importance_score=data.get('importance_score', 0.0),
+            relevance_score=data.get('relevance_score', 0.0),
+            context=NotificationContext(
+                user_spending_pattern=context.get('user_spending_pattern') or {},
+                budget_status=context.get('budget_status') or {},
+                financial_health_score=context.get('financial_health_score'),
+                gemini_analysis=context.get('gemini_analysis'),
+                recommendations=context.get('recommendations') or [],
+            ),
+            related_transaction_id=data.get('related_transaction_id'),
+            related_budget_id=data.get('related_budget_id'),
+            related_goal_id=data.get('related_goal_id'),
+            channels=[NotificationChannel(c) for c in data.get('channels', [])],
+            sent_at=_dt('sent_at'),
+            delivered_at=_dt('delivered_at'),
+            opened_at=_dt('opened_at'),
+            action_taken=NotificationAction(data['action_taken']) if data.get('action_taken') else None,
+            action_taken_at=_dt('action_taken_at'),
+            is_read=data.get('is_read', False),
+            is_archived=data.get('is_archived', False),
+            available_actions=[NotificationAction(a) for a in data.get('available_actions', [])],
+            optimal_delivery_time=_dt('optimal_delivery_time'),
+            user_preference_score=data.get('user_preference_score', 1.0),
+        )
+
+
+# Notification fields stored as-is in the lean document
+_STORED_FIELDS = (
+    'id', 'user_id', 'title', 'body', 'rich_content',
+    'importance_score', 'relevance_score',
+    'related_transaction_id', 'related_budget_id', 'related_goal_id',
+    'is_read', 'is_archived', 'user_preference_score',
+)
+_STORED_DATETIME_FIELDS = (
+    'timestamp', 'sent_at', 'delivered_at', 'opened_at', 'action_taken_at', 'optimal_delivery_time',
+)
+_get_stored_fields = attrgetter(*_STORED_FIELDS)
+_get_stored_datetimes = attrgetter(*_STORED_DATETIME_FIELDS)
+# Context fields kept in the separately stored snapshot
+_SNAPSHOT_CONTEXT_FIELDS = (
+    'user_spending_pattern', 'budget_status', 'financial_health_score',
+    'gemini_analysis', 'recommendations',
+)
+_ENUM_VALUES = {
+    member: member.value
+    for enum in (NotificationCategory, NotificationPriority, NotificationChannel, NotificationAction)
+    for member in enum
+}
 
 
 @dataclass
@@ -281,6 +380,27 @@ class NotificationTrigger:
     timestamp: datetime = field(default_factory=datetime.now)
     priority_override: Optional[NotificationPriority] = None
     
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert to dictionary for queueing"""
+        return {
+            'trigger_type': self.trigger_type,
+            'user_id': self.user_id,
+            'data': self.data,
+            'timestamp': self.timestamp.isoformat(),
+            'priority_override': self.priority_override.value if self.priority_override else None,
+        }
+    
+    @staticmethod
+    def from_dict(data: Dict[str, Any]) -> 'NotificationTrigger':
+        """Rebuild a trigger from to_dict() output"""
+        return NotificationTrigger(
+            trigger_type=data['trigger_type'],
+            user_id=data['user_id'],
+            data=data.get('data') or {},
+            timestamp=datetime.fromisoformat(data['timestamp']) if data.get('timestamp') else datetime.now(),
+            priority_override=NotificationPriority(data['priority_override']) if data.get('priority_override') else None,
+        )
+    
     # Transaction triggers
     @staticmethod
     def transaction_created(user_id: str, transaction: Dict[str, Any]):
@@ -290,13 +410,48 @@ class NotificationTrigger:
             data={"transaction": transaction}
         )
     
+    @staticmethod
+    def transaction_digest(user_id: str, transactions: List[Dict[str, Any]], max_items: int = 5):
+        """Summarize a burst of transactions (already ranked, most important first)"""
+        spent = sum(abs(float(t.get("amount", 0) or 0)) for t in transactions if t.get("type", "expense") == "expense")
+        received = sum(abs(float(t.get("amount", 0) or 0)) for t in transactions if t.get("type") == "income")
+        
+        category_totals: Dict[str, float] = {}
+        for t in transactions:
+            if t.get("type", "expense") == "expense":
+                category = t.get("category") or "Uncategorized"
+                category_totals[category] = category_totals.get(category, 0.0) + abs(float(t.get("amount", 0) or 0))
+        
+        return NotificationTrigger(
+            trigger_type="transaction_digest",
+            user_id=user_id,
+            data={
+                "transactions": transactions[:max_items],
+                "transaction_ids": [t.get("id") for t in transactions if t.get("id")],
+                "count": len(transactions),
+                "total_spent": spent,
+                "total_received": received,
+                "top_categories": sorted(category_totals, key=category_totals.get, reverse=True)[:3],
+            }
+        )
+    
     # Budget triggers
     @staticmethod
-    def budget_threshold_reached(user_id: str, budget_id: str, percentage: float):
+    def budget_threshold_reached(
+        user_id: str,
+        budget_id: Optional[str],
+        percentage: float,
+        category: Optional[str] = None,
+        current_amount: Optional[float] = None,
+        budget_amount: Optional[float] = None
+    ):
+        data = {"budget_id": budget_id, "percentage": percentage}
+        if category is not None:
+            data.update({"category": category, "current_amount": current_amount, "budget_amount": budget_amount})
         return NotificationTrigger(
             trigger_type="budget_threshold",
             user_id=user_id,
-            data={"budget_id": budget_id, "percentage": percentage}
+            data=data
         )
     
     # Bill triggers
@@ -310,11 +465,21 @@ class NotificationTrigger:
     
     # Goal triggers
     @staticmethod
-    def goal_milestone_reached(user_id: str, goal_id: str, milestone_percentage: float):
+    def goal_milestone_reached(
+        user_id: str,
+        goal_id: Optional[str],
+        milestone_percentage: float,
+        goal_name: Optional[str] = None,
+        current_amount: Optional[float] = None,
+        target_amount: Optional[float] = None
+    ):
+        data = {"goal_id": goal_id, "milestone": milestone_percentage}
+        if goal_name is not None:
+            data.update({"goal_name": goal_name, "current_amount": current_amount, "target_amount": target_amount})
         return NotificationTrigger(
             trigger_type="goal_milestone",
             user_id=user_id,
-            data={"goal_id": goal_id, "milestone": milestone_percentage}
+            data=data
         )
     
     # Anomaly triggers
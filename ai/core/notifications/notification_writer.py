@@ -0,0 +1,189 @@
+"""
+Notification Writer
+===================
+
+Buffered Firestore persistence for the notification engine:
+- Writes are queued as groups (e.g. a notification and its context
+  snapshot) that always land in the same WriteBatch
+- The buffer is flushed in WriteBatches of up to 500 writes when it fills
+  up or after a short interval, so a burst of notifications costs a few
+  commits instead of one round trip each
+- Each caller gets a future that resolves once its writes are committed
+- Uses the async Firestore client when available, else commits the sync
+  admin client's batches in a worker thread
+"""
+
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# (operation, collection, document id, data); operation is 'set', 'merge'
+# (set with merge=True) or 'update'
+WriteOp = Tuple[str, str, str, Dict[str, Any]]
+
+
+class NotificationWriter:
+    """Coalesces Firestore writes into WriteBatches and confirms them via futures"""
+
+    # Firestore limit on writes per batch
+    MAX_BATCH_SIZE = 500
+    FLUSH_INTERVAL_SECONDS = 0.05
+
+    def __init__(
+        self,
+        firestore_client=None,
+        async_client=None,
+        max_batch_size: int = MAX_BATCH_SIZE,
+        flush_interval_seconds: float = FLUSH_INTERVAL_SECONDS
+    ):
+        self.firestore_client = firestore_client
+        self.async_client = async_client if async_client is not None else self._resolve_async_client(firestore_client)
+        self.max_batch_size = max_batch_size
+        self.flush_interval_seconds = flush_interval_seconds
+
+        self._buffer: Deque[Tuple[List[WriteOp], asyncio.Future]] = deque()
+        self._buffered_ops = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._flushing: Optional[asyncio.Task] = None
+
+        self.commits = 0
+        self.writes = 0
+        self.failed = 0
+
+    @staticmethod
+    def _resolve_async_client(firestore_client):
+        """Create an async Firestore client alongside the sync admin client, if possible."""
+        if firestore_client is None:
+            return None
+        try:
+            from firebase_admin import firestore_async
+            return firestore_async.client()
+        except Exception as e:
+            logger.debug(f"Async Firestore client unavailable, using threaded batch commits: {e}")
+            return None
+
+    @property
+    def client(self):
+        return self.async_client or self.firestore_client
+
+    def submit(self, ops: List[WriteOp]) -> asyncio.Future:
+        """
+        Queue a group of writes that must be committed together.
+
+        Returns:
+            Future resolved once the group is committed (or failed)
+        """
+
+        if len(ops) > self.max_batch_size:
+            raise ValueError(f"A write group can hold at most {self.max_batch_size} writes")
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._buffer.append((ops, future))
+        self._buffered_ops += len(ops)
+
+        if self._buffered_ops >= self.max_batch_size:
+            self._start_flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.flush_interval_seconds, self._start_flush)
+        return future
+
+    async def write(self, ops: List[WriteOp]):
+        """Queue a group of writes and wait until it is committed"""
+        await self.submit(ops)
+
+    async def set(self, collection: str, document_id: str, data: Dict[str, Any]):
+        await self.write([('set', collection, document_id, data)])
+
+    async def update(self, collection: str, document_id: str, data: Dict[str, Any]):
+        await self.write([('update', collection, document_id, data)])
+
+    async def flush(self):
+        """Commit everything buffered so far"""
+        self._start_flush()
+        while self._flushing is not None:
+            await asyncio.shield(self._flushing)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "buffered": self._buffered_ops,
+            "commits": self.commits,
+            "writes": self.writes,
+            "failed": self.failed,
+        }
+
+    def _start_flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._flushing is None and self._buffer:
+            self._flushing = asyncio.get_running_loop().create_task(self._flush_all())
+
+    async def _flush_all(self):
+        try:
+            while self._buffer:
+                groups: List[Tuple[List[WriteOp], asyncio.Future]] = []
+                count = 0
+                while self._buffer and count + len(self._buffer[0][0]) <= self.max_batch_size:
+                    ops, future = self._buffer.popleft()
+                    groups.append((ops, future))
+                    count += len(ops)
+                self._buffered_ops -= count
+                await self._commit_groups(groups)
+        finally:
+            self._flushing = None
+            # Writes that arrived during the last commit are below the size
+            # trigger; give them their own timer
+            if self._buffer and self._timer is None:
+                self._timer = asyncio.get_running_loop().call_later(
+                    self.flush_interval_seconds, self._start_flush
+                )
+
+    async def _commit_groups(self, groups: List[Tuple[List[WriteOp], asyncio.Future]]):
+        try:
+            await self._commit([op for ops, _ in groups for op in ops])
+        except Exception as e:
+            if len(groups) == 1:
+                self._resolve(groups[0][1], e)
+                return
+            # Find the failing group without failing everyone else's writes
+            logger.warning(f"⚠️ Batch of {len(groups)} notification writes failed, retrying individually: {e}")
+            for group in groups:
+                await self._commit_groups([group])
+            return
+
+        for _, future in groups:
+            self._resolve(future, None)
+
+    def _resolve(self, future: asyncio.Future, error: Optional[Exception]):
+        if future.done():
+            return
+        if error is None:
+            future.set_result(True)
+        else:
+            self.failed += 1
+            logger.error(f"❌ Notification write failed: {error}")
+            future.set_exception(error)
+
+    async def _commit(self, ops: List[WriteOp]):
+        client = self.client
+        batch = client.batch()
+        for operation, collection, document_id, data in ops:
+            ref = client.collection(collection).document(document_id)
+            if operation == 'update':
+                batch.update(ref, data)
+            elif operation == 'merge':
+                batch.set(ref, data, merge=True)
+            else:
+                batch.set(ref, data)
+
+        if self.async_client is not None:
+            await batch.commit()
+        else:
+            await asyncio.to_thread(batch.commit)
+
+        self.commits += 1
+        self.writes += len(ops)
@@ -7,12 +7,24 @@ Learns from user behavior to personalize notifications:
 - Relevance scoring
 - Interaction patterns
 - Preference learning
+
+Preferences, profiles and interaction history are held in bounded TTL+LRU
+caches, so reads on the trigger path are mostly memory hits and memory
+stays flat as the user count grows. One instance is shared by the engine
+and the API so saved preferences invalidate the cache the engine reads.
+
+Interactions are looked up by notification id and applied to the in-memory
+profile; changed profiles are written back in batches on a debounce
+interval, so an active user costs one profile write per interval rather
+than one per tap or dismiss.
 """
 
+import asyncio
+import copy
 import logging
-from typing import Dict, List, Optional, Any
+from typing import Deque, Dict, Iterator, List, Optional, Any
 from datetime import datetime, timedelta
-from collections import defaultdict, Counter
+from collections import deque
 
 from .notification_types import (
     NotificationTrigger,
@@ -22,17 +34,90 @@ from .notification_types import (
     NotificationChannel,
     UserNotificationPreferences,
 )
+from .notification_writer import NotificationWriter
+from core.services.ttl_cache import TTLCache
 
 logger = logging.getLogger(__name__)
 
+PROFILES_COLLECTION = 'user_notification_profiles'
+
+
+class _InteractionLog:
+    """A user's latest interaction records, indexed by notification id"""
+    
+    __slots__ = ('items', 'by_id')
+    
+    def __init__(self, size: int):
+        self.items: Deque[Dict[str, Any]] = deque(maxlen=size)
+        self.by_id: Dict[str, Dict[str, Any]] = {}
+    
+    def append(self, interaction: Dict[str, Any]):
+        if len(self.items) == self.items.maxlen:
+            oldest = self.items[0]
+            if self.by_id.get(oldest['notification_id']) is oldest:
+                del self.by_id[oldest['notification_id']]
+        self.items.append(interaction)
+        self.by_id[interaction['notification_id']] = interaction
+    
+    def get(self, notification_id: str) -> Optional[Dict[str, Any]]:
+        return self.by_id.get(notification_id)
+    
+    def recent(self, count: int) -> List[Dict[str, Any]]:
+        start = max(0, len(self.items) - count)
+        return [self.items[i] for i in range(start, len(self.items))]
+    
+    def __len__(self) -> int:
+        return len(self.items)
+    
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        return iter(self.items)
+
 
 class PersonalizationEngine:
     """Learn from user interactions to personalize notifications"""
     
-    def __init__(self, db_client=None):
+    # Most the context-dependent terms can add, per trigger type
+    MAX_CONTEXT_RELEVANCE = {
+        "transaction_created": 15.0,  # user has a budget for the category
+    }
+    
+    # Other instances' preference changes are picked up within this TTL
+    PREFERENCES_CACHE_SIZE = 20000
+    PREFERENCES_TTL_SECONDS = 300
+    PROFILE_CACHE_SIZE = 20000
+    PROFILE_TTL_SECONDS = 1800
+    # Interaction history is in-memory only; kept per user for a day
+    HISTORY_USERS = 20000
+    HISTORY_TTL_SECONDS = 24 * 3600
+    HISTORY_PER_USER = 100
+    # Changed profiles are written back at most this often
+    PROFILE_FLUSH_SECONDS = 30.0
+    
+    def __init__(
+        self,
+        db_client=None,
+        writer: Optional[NotificationWriter] = None,
+        profile_flush_seconds: float = PROFILE_FLUSH_SECONDS
+    ):
         self.db = db_client
-        self._user_profiles: Dict[str, Dict[str, Any]] = {}
-        self._interaction_history: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        self.writer = writer if writer is not None or db_client is None else NotificationWriter(db_client)
+        self.profile_flush_seconds = profile_flush_seconds
+        self._preferences = TTLCache(
+            max_size=self.PREFERENCES_CACHE_SIZE, ttl_seconds=self.PREFERENCES_TTL_SECONDS
+        )
+        self._user_profiles = TTLCache(
+            max_size=self.PROFILE_CACHE_SIZE, ttl_seconds=self.PROFILE_TTL_SECONDS
+        )
+        self._interaction_history = TTLCache(
+            max_size=self.HISTORY_USERS, ttl_seconds=self.HISTORY_TTL_SECONDS
+        )
+        # Profiles changed since the last flush; held here so cache
+        # eviction can't drop an unsaved change
+        self._dirty_profiles: Dict[str, Dict[str, Any]] = {}
+        self._flush_timer: Optional[asyncio.TimerHandle] = None
+        self._flushing: Optional[asyncio.Task] = None
+        self.profile_flushes = 0
+        self.profiles_written = 0
         logger.info("🎯 Personalization Engine initialized")
     
     async def get_user_preferences(
@@ -41,21 +126,30 @@ class PersonalizationEngine:
     ) -> UserNotificationPreferences:
         """Load or create user notification preferences"""
         
+        cached = self._preferences.get(user_id)
+        if cached is not None:
+            return cached
+        
+        # Default preferences, unless the user saved their own
+        preferences = UserNotificationPreferences(user_id=user_id)
+        
         if self.db:
             try:
                 # Try to load from database
                 pref_ref = self.db.collection('notification_preferences').document(user_id)
-                pref_doc = pref_ref.get()
+                pref_doc = await asyncio.to_thread(pref_ref.get)
                 
                 if pref_doc.exists:
                     data = pref_doc.to_dict()
-                    return self._dict_to_preferences(user_id, data)
+                    preferences = self._dict_to_preferences(user_id, data)
                     
             except Exception as e:
                 logger.error(f"Error loading preferences: {e}")
+                # Don't cache defaults that may hide saved preferences
+                return preferences
         
-        # Return default preferences
-        return UserNotificationPreferences(user_id=user_id)
+        self._preferences.set(user_id, preferences)
+        return preferences
     
     async def save_user_preferences(
         self,
@@ -68,12 +162,26 @@ class PersonalizationEngine:
         
         try:
             pref_ref = self.db.collection('notification_preferences').document(preferences.user_id)
-            await pref_ref.set(preferences.to_dict())
+            await asyncio.to_thread(pref_ref.set, preferences.to_dict())
+            # Write through, so the next trigger sees the new preferences
+            self._preferences.set(preferences.user_id, preferences)
             logger.debug(f"💾 Saved preferences for {preferences.user_id}")
             
         except Exception as e:
+            # The caller may have changed the cached object before saving
+            self._preferences.invalidate(preferences.user_id)
             logger.error(f"Error saving preferences: {e}")
     
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "preferences_cache": self._preferences.stats(),
+            "profile_cache": self._user_profiles.stats(),
+            "history_users": len(self._interaction_history),
+            "dirty_profiles": len(self._dirty_profiles),
+            "profile_flushes": self.profile_flushes,
+            "profiles_written": self.profiles_written,
+        }
+    
     async def calculate_relevance(
         self,
         trigger: NotificationTrigger,
@@ -118,6 +226,20 @@ class PersonalizationEngine:
         
         return score
     
+    async def relevance_upper_bound(
+        self,
+        trigger: NotificationTrigger,
+        user_id: str
+    ) -> float:
+        """
+        Highest relevance the trigger could reach once its context is known.
+        
+        Uses only the (cached) user profile and interaction history.
+        """
+        
+        score = await self.calculate_relevance(trigger, NotificationContext(), user_id)
+        return min(100.0, score + self.MAX_CONTEXT_RELEVANCE.get(trigger.trigger_type, 0.0))
+    
     def _calculate_transaction_relevance(
         self,
         trigger: NotificationTrigger,
@@ -246,14 +368,14 @@ class PersonalizationEngine:
     ) -> float:
         """Calculate boost/penalty based on past interactions"""
         
-        interactions = self._interaction_history.get(user_id, [])
+        interactions = self._interaction_history.get(user_id, ())
         
         if not interactions:
             return 0.0
         
         # Get interactions for this trigger type
         relevant_interactions = [
-            i for i in interactions[-20:]  # Last 20 interactions
+            i for i in interactions.recent(20)  # Last 20 interactions
             if i.get('trigger_type') == trigger_type
         ]
         
@@ -350,10 +472,13 @@ class PersonalizationEngine:
         try:
             user_id = notification.user_id
             
-            if user_id not in self._interaction_history:
-                self._interaction_history[user_id] = []
+            # Keep only the last 100 interactions per user
+            history: Optional[_InteractionLog] = self._interaction_history.get(user_id)
+            if history is None:
+                history = _InteractionLog(self.HISTORY_PER_USER)
+                self._interaction_history.set(user_id, history)
             
-            self._interaction_history[user_id].append({
+            history.append({
                 'notification_id': notification.id,
                 'category': notification.category.value,
                 'created_at': datetime.now().isoformat(),
@@ -361,10 +486,6 @@ class PersonalizationEngine:
                 'relevance_score': notification.relevance_score,
             })
             
-            # Keep only last 100 interactions per user
-            if len(self._interaction_history[user_id]) > 100:
-                self._interaction_history[user_id] = self._interaction_history[user_id][-100:]
-            
         except Exception as e:
             logger.error(f"Error recording notification: {e}")
     
@@ -378,21 +499,20 @@ class PersonalizationEngine:
         
         try:
             # Find the notification in history
-            for interaction in self._interaction_history.get(user_id, []):
-                if interaction.get('notification_id') == notification_id:
-                    interaction['opened'] = True
-                    interaction['action_taken'] = action.value
-                    interaction['action_taken_at'] = datetime.now().isoformat()
-                    
-                    # Calculate dismissal time
-                    created_at = datetime.fromisoformat(interaction['created_at'])
-                    dismissed_seconds = (datetime.now() - created_at).total_seconds()
-                    interaction['dismissed_within_seconds'] = dismissed_seconds
-                    
-                    break
+            history = self._interaction_history.get(user_id)
+            interaction = history.get(notification_id) if history is not None else None
+            if interaction is not None:
+                interaction['opened'] = True
+                interaction['action_taken'] = action.value
+                interaction['action_taken_at'] = datetime.now().isoformat()
+                
+                # Calculate dismissal time
+                created_at = datetime.fromisoformat(interaction['created_at'])
+                dismissed_seconds = (datetime.now() - created_at).total_seconds()
+                interaction['dismissed_within_seconds'] = dismissed_seconds
             
             # Update user profile based on interaction
-            await self._update_profile_from_interaction(user_id, notification_id, action)
+            await self._update_profile_from_interaction(user_id, interaction, action)
             
             logger.debug(f"📊 Recorded interaction: {action.value}")
             
@@ -402,9 +522,12 @@ class PersonalizationEngine:
     async def _load_user_profile(self, user_id: str) -> Dict[str, Any]:
         """Load or build user profile for personalization"""
         
-        # Check cache
-        if user_id in self._user_profiles:
-            return self._user_profiles[user_id]
+        # Check cache, then changes not yet flushed
+        cached = self._user_profiles.get(user_id)
+        if cached is None:
+            cached = self._dirty_profiles.get(user_id)
+        if cached is not None:
+            return cached
         
         # Build profile
         profile = {
@@ -422,8 +545,8 @@ class PersonalizationEngine:
         if self.db:
             try:
                 # Load from database if available
-                profile_ref = self.db.collection('user_notification_profiles').document(user_id)
-                profile_doc = profile_ref.get()
+                profile_ref = self.db.collection(PROFILES_COLLECTION).document(user_id)
+                profile_doc = await asyncio.to_thread(profile_ref.get)
                 
                 if profile_doc.exists:
                     profile.update(profile_doc.to_dict())
@@ -432,64 +555,105 @@ class PersonalizationEngine:
                 logger.debug(f"Building new profile for {user_id}")
         
         # Cache it
-        self._user_profiles[user_id] = profile
+        self._user_profiles.set(user_id, profile)
         
         return profile
     
     async def _update_profile_from_interaction(
         self,
         user_id: str,
-        notification_id: str,
+        interaction: Optional[Dict[str, Any]],
         action: NotificationAction
     ):
-        """Update user profile based on their interaction"""
+        """Apply an interaction to the in-memory profile and schedule its write"""
         
         try:
             profile = await self._load_user_profile(user_id)
             
-            # Find the interaction
-            for interaction in self._interaction_history.get(user_id, []):
-                if interaction.get('notification_id') == notification_id:
-                    category = interaction.get('category', '')
-                    
-                    # Update engagement scores
-                    if category not in profile['engagement_scores']:
-                        profile['engagement_scores'][category] = 0.5
-                    
-                    # Positive actions increase score
-                    if action in [NotificationAction.VIEW, NotificationAction.PAY_NOW, NotificationAction.ADD_MONEY]:
-                        profile['engagement_scores'][category] = min(
-                            1.0,
-                            profile['engagement_scores'][category] + 0.1
+            if interaction is not None:
+                category = interaction.get('category', '')
+                
+                # Update engagement scores
+                if category not in profile['engagement_scores']:
+                    profile['engagement_scores'][category] = 0.5
+                
+                # Positive actions increase score
+                if action in [NotificationAction.VIEW, NotificationAction.PAY_NOW, NotificationAction.ADD_MONEY]:
+                    profile['engagement_scores'][category] = min(
+                        1.0,
+                        profile['engagement_scores'][category] + 0.1
+                    )
+                # Negative actions decrease score
+                elif action == NotificationAction.DISMISS:
+                    dismiss_time = interaction.get('dismissed_within_seconds', 10)
+                    if dismiss_time < 5:  # Quick dismiss = not interested
+                        profile['engagement_scores'][category] = max(
+                            0.0,
+                            profile['engagement_scores'][category] - 0.1
                         )
-                    # Negative actions decrease score
-                    elif action == NotificationAction.DISMISS:
-                        dismiss_time = interaction.get('dismissed_within_seconds', 10)
-                        if dismiss_time < 5:  # Quick dismiss = not interested
-                            profile['engagement_scores'][category] = max(
-                                0.0,
-                                profile['engagement_scores'][category] - 0.1
-                            )
-                    
-                    # Track active hours
-                    hour = datetime.now().hour
-                    if str(hour) not in profile['active_hours']:
-                        profile['active_hours'][str(hour)] = 0
-                    profile['active_hours'][str(hour)] += 1
-                    
-                    break
-            
-            # Save updated profile
-            if self.db:
-                profile_ref = self.db.collection('user_notification_profiles').document(user_id)
-                await profile_ref.set(profile)
-            
-            # Update cache
-            self._user_profiles[user_id] = profile
+                
+                # Track active hours
+                hour = datetime.now().hour
+                if str(hour) not in profile['active_hours']:
+                    profile['active_hours'][str(hour)] = 0
+                profile['active_hours'][str(hour)] += 1
+                
+                # Update cache; the write is debounced
+                self._user_profiles.set(user_id, profile)
+                if self.writer is not None:
+                    self._dirty_profiles[user_id] = profile
+                    self._schedule_profile_flush()
             
         except Exception as e:
             logger.error(f"Error updating profile: {e}")
     
+    async def flush_profiles(self):
+        """Write every changed profile now"""
+        
+        if self._flushing is not None:
+            await asyncio.shield(self._flushing)
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+        if self._dirty_profiles:
+            await self._flush_profiles()
+    
+    def _schedule_profile_flush(self):
+        if self._flush_timer is None and self._flushing is None:
+            loop = asyncio.get_running_loop()
+            self._flush_timer = loop.call_later(self.profile_flush_seconds, self._start_profile_flush)
+    
+    def _start_profile_flush(self):
+        self._flush_timer = None
+        if self._flushing is None and self._dirty_profiles:
+            self._flushing = asyncio.get_running_loop().create_task(self._flush_profiles())
+    
+    async def _flush_profiles(self):
+        dirty, self._dirty_profiles = self._dirty_profiles, {}
+        try:
+            # Snapshot each profile; interactions keep changing the cached one
+            futures = {
+                user_id: self.writer.submit([('set', PROFILES_COLLECTION, user_id, copy.deepcopy(profile))])
+                for user_id, profile in dirty.items()
+            }
+            results = await asyncio.gather(*futures.values(), return_exceptions=True)
+            failed = 0
+            for user_id, result in zip(futures, results):
+                if isinstance(result, Exception):
+                    # Retry on the next flush unless the profile changed again
+                    self._dirty_profiles.setdefault(user_id, dirty[user_id])
+                    failed += 1
+            self.profile_flushes += 1
+            self.profiles_written += len(dirty) - failed
+            logger.debug(f"💾 Flushed {len(dirty) - failed} notification profiles")
+            if failed:
+                logger.warning(f"⚠️ {failed} notification profile writes failed, will retry")
+        finally:
+            self._flushing = None
+            # Profiles changed during this flush wait for the next interval
+            if self._dirty_profiles:
+                self._schedule_profile_flush()
+    
     def _dict_to_preferences(
         self,
         user_id: str,
@@ -0,0 +1,279 @@
+"""
+Push Notification Outbox
+========================
+
+Takes push delivery out of the request path:
+- Pushes are persisted to a queue backend and sent by a fixed pool of
+  workers, so the number of concurrent FCM calls is bounded
+- A worker takes every push that is ready (up to a limit) and sends them
+  through one batched FCM request
+- Tokens that fail with a transient error are retried on their own with
+  exponential backoff and jitter; after max_attempts the push goes to a
+  dead-letter queue in the same backend, where it can be inspected and
+  requeued
+- Delivery latency (enqueue to final outcome) percentiles and success
+  rates are kept for the stats endpoint
+
+The sender only needs an async send_batch(messages) like FCMService's, so
+the outbox can be exercised with a fake sender and the in-memory or SQLite
+backend.
+"""
+
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+from core.services.queue_backends import QueueBackend, QueueItem, InMemoryQueueBackend
+
+logger = logging.getLogger(__name__)
+
+
+def _percentile(sorted_values: List[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class PushOutbox:
+    """Durable push queue with a bounded worker pool, retries and dead-lettering"""
+
+    QUEUE_NAME = "push_outbox"
+    DEAD_LETTER_QUEUE = "push_dead_letter"
+    NUM_WORKERS = 4
+    # Pushes handed to the sender in one batched request
+    MAX_BATCH_SIZE = 100
+    MAX_ATTEMPTS = 5
+    BASE_DELAY_SECONDS = 1.0
+    MAX_DELAY_SECONDS = 300.0
+    # Latency samples kept for percentiles
+    LATENCY_WINDOW = 1000
+
+    def __init__(
+        self,
+        sender,
+        backend: Optional[QueueBackend] = None,
+        num_workers: int = NUM_WORKERS,
+        max_batch_size: int = MAX_BATCH_SIZE,
+        max_attempts: int = MAX_ATTEMPTS,
+        base_delay_seconds: float = BASE_DELAY_SECONDS,
+        max_delay_seconds: float = MAX_DELAY_SECONDS
+    ):
+        self.sender = sender
+        self.backend = backend if backend is not None else InMemoryQueueBackend()
+        self.num_workers = num_workers
+        self.max_batch_size = max_batch_size
+        self.max_attempts = max_attempts
+        self.base_delay_seconds = base_delay_seconds
+        self.max_delay_seconds = max_delay_seconds
+
+        self._ready: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        self._latencies: Deque[float] = deque(maxlen=self.LATENCY_WINDOW)
+
+        self.enqueued = 0
+        self.delivered = 0
+        self.no_tokens = 0
+        self.failed = 0
+        self.retried = 0
+        self.dead_lettered = 0
+        self.tokens_sent = 0
+        self.tokens_failed = 0
+
+        logger.info("📤 Push Outbox initialized")
+
+    @property
+    def is_running(self) -> bool:
+        return bool(self._workers)
+
+    def start(self):
+        """Start the worker pool on the running loop and recover persisted pushes"""
+
+        if self.is_running:
+            return
+
+        self._ready = asyncio.Queue()
+
+        recovered = self.backend.load_pending(self.QUEUE_NAME)
+        for item in recovered:
+            self._schedule(item)
+        if recovered:
+            logger.info(f"📤 Recovered {len(recovered)} queued push notifications")
+
+        self._workers = [
+            asyncio.create_task(self._worker(i)) for i in range(self.num_workers)
+        ]
+
+    async def stop(self):
+        """Stop the workers; unsent pushes stay in the backend"""
+
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers.clear()
+        await asyncio.to_thread(self.backend.flush)
+
+    def enqueue(self, message: Dict[str, Any]) -> str:
+        """
+        Persist a push and schedule it for delivery.
+
+        Args:
+            message: user_id, title, body and optionally data, priority and
+                notification_id, as accepted by the sender's send_batch
+
+        Returns:
+            Queue item ID
+        """
+
+        return self._enqueue_payload({
+            'message': message,
+            'tokens': None,  # All of the user's tokens
+            'attempt': 0,
+            'enqueued_at': time.time(),
+        })
+
+    def dead_letters(self, limit: int = 100) -> List[Dict[str, Any]]:
+        """Pushes that ran out of attempts, oldest first"""
+
+        return [
+            {'id': item.id, 'created_at': item.created_at, **item.payload}
+            for item in self.backend.load_pending(self.DEAD_LETTER_QUEUE)[:limit]
+        ]
+
+    def requeue_dead_letters(self) -> int:
+        """
+        Give every dead-lettered push a fresh set of attempts.
+
+        Only the tokens that were still failing are retried; devices the
+        push already reached don't get it twice.
+        """
+
+        count = 0
+        for item in self.backend.load_pending(self.DEAD_LETTER_QUEUE):
+            payload = {key: value for key, value in item.payload.items() if key != 'last_error'}
+            self._enqueue_payload({**payload, 'attempt': 0, 'enqueued_at': time.time()})
+            self.backend.ack(self.DEAD_LETTER_QUEUE, item.id)
+            count += 1
+        return count
+
+    def stats(self) -> Dict[str, Any]:
+        latencies = sorted(self._latencies)
+        finished = self.delivered + self.failed
+        attempted = self.tokens_sent + self.tokens_failed
+        return {
+            "workers": len(self._workers),
+            "queued": self.backend.count(self.QUEUE_NAME),
+            "dead_letter": self.backend.count(self.DEAD_LETTER_QUEUE),
+            "enqueued": self.enqueued,
+            "delivered": self.delivered,
+            "failed": self.failed,
+            "no_tokens": self.no_tokens,
+            "retried": self.retried,
+            "dead_lettered": self.dead_lettered,
+            "success_rate": round(self.delivered / finished, 4) if finished else 0.0,
+            "token_success_rate": round(self.tokens_sent / attempted, 4) if attempted else 0.0,
+            "latency_ms": {
+                "p50": round(_percentile(latencies, 0.50) * 1000, 1),
+                "p90": round(_percentile(latencies, 0.90) * 1000, 1),
+                "p99": round(_percentile(latencies, 0.99) * 1000, 1),
+            },
+        }
+
+    def _enqueue_payload(self, payload: Dict[str, Any]) -> str:
+        self.start()
+        item = self.backend.put(self.QUEUE_NAME, payload)
+        self.enqueued += 1
+        self._schedule(item)
+        return item.id
+
+    def _schedule(self, item: QueueItem):
+        delay = item.available_at - time.time()
+        if delay > 0:
+            self._timers[item.id] = asyncio.get_running_loop().call_later(delay, self._release, item)
+        else:
+            self._ready.put_nowait(item)
+
+    def _release(self, item: QueueItem):
+        self._timers.pop(item.id, None)
+        self._ready.put_nowait(item)
+
+    async def _worker(self, worker_id: int):
+        while True:
+            items = [await self._ready.get()]
+            while len(items) < self.max_batch_size and not self._ready.empty():
+                items.append(self._ready.get_nowait())
+            try:
+                await self._send(items)
+            except Exception as e:
+                logger.error(f"❌ Push worker {worker_id} failed for {len(items)} pushes: {e}", exc_info=True)
+            finally:
+                for _ in items:
+                    self._ready.task_done()
+
+    async def _send(self, items: List[QueueItem]):
+        messages = [
+            {**item.payload['message'], 'tokens': item.payload.get('tokens')}
+            for item in items
+        ]
+        try:
+            response = await self.sender.send_batch(messages)
+        except Exception as e:
+            response = {"success": False, "error": str(e)}
+        results = response.get('results')
+        if results is None:
+            # The whole request failed; retry every push with the same tokens
+            error = response.get('error', 'send failed')
+            results = [{'sent': 0, 'failed': 0, 'retry_tokens': None, 'error': error} for _ in items]
+
+        for item, result in zip(items, results):
+            self.tokens_sent += result.get('sent', 0)
+            self.tokens_failed += result.get('failed', 0)
+            # Devices reached by this push so far, over all attempts
+            sent = item.payload.get('sent', 0) + result.get('sent', 0)
+            retry_tokens = result.get('retry_tokens')
+            if retry_tokens is None or retry_tokens:
+                self._retry(item, retry_tokens, sent, result.get('error', 'transient FCM error'))
+            elif sent or result.get('failed', 0):
+                self._finish(item, delivered=sent > 0)
+            else:
+                self._finish(item)
+                self.no_tokens += 1
+
+    def _retry(self, item: QueueItem, tokens: Optional[List[str]], sent: int, error: str):
+        payload = item.payload
+        attempt = payload.get('attempt', 0) + 1
+        next_payload = {**payload, 'attempt': attempt, 'sent': sent, 'last_error': error}
+        if tokens is not None:
+            next_payload['tokens'] = tokens
+
+        if attempt >= self.max_attempts:
+            # Only the tokens still failing are dead-lettered; a push that
+            # reached some devices still counts as delivered
+            self.backend.put(self.DEAD_LETTER_QUEUE, next_payload)
+            self._finish(item, delivered=sent > 0)
+            self.dead_lettered += 1
+            logger.warning(f"☠️ Push for user {payload['message'].get('user_id')} dead-lettered after {attempt} attempts: {error}")
+            return
+
+        delay = min(self.max_delay_seconds, self.base_delay_seconds * (2 ** (attempt - 1)))
+        delay *= random.uniform(0.5, 1.0)
+        # Persist the retry before dropping the current attempt
+        retry_item = self.backend.put(self.QUEUE_NAME, next_payload, available_at=time.time() + delay)
+        self.backend.ack(self.QUEUE_NAME, item.id)
+        self.retried += 1
+        self._schedule(retry_item)
+
+    def _finish(self, item: QueueItem, delivered: Optional[bool] = None):
+        self.backend.ack(self.QUEUE_NAME, item.id)
+        self._latencies.append(time.time() - item.payload.get('enqueued_at', item.created_at))
+        if delivered is True:
+            self.delivered += 1
+        elif delivered is False:
+            self.failed += 1
@@ -0,0 +1,232 @@
+"""
+Notification Rate Limiter
+=========================
+
+Per-user hourly and daily notification limits using sliding-window counters:
+- Each window keeps the count of the current and previous fixed bucket; the
+  sliding count is previous * (unexpired share) + current, so the hourly
+  and daily limits are tracked independently and the daily one no longer
+  resets with the hourly one
+- InMemoryRateLimiter stores counters in flat arrays indexed by a per-user
+  slot, evicts users once both windows have fully expired, and caps the
+  number of tracked users, so memory stays flat as the user count grows
+- RedisRateLimiter keeps the same counters in Redis (or any Redis-compatible
+  store) so limits hold across instances; keys expire on their own
+
+Pick one with create_rate_limiter(); REDIS_URL selects Redis.
+"""
+
+import logging
+import os
+import time
+from array import array
+from collections import OrderedDict
+from typing import Callable, List, Optional, Tuple
+
+try:
+    import redis.asyncio as aioredis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+HOUR_SECONDS = 3600
+DAY_SECONDS = 86400
+# (window seconds) for the hourly and daily limits, in that order
+WINDOWS = (HOUR_SECONDS, DAY_SECONDS)
+
+
+def sliding_count(previous: int, current: int, window: int, now: float) -> float:
+    """Estimate events in the last `window` seconds from two fixed buckets"""
+    elapsed = (now % window) / window
+    return previous * (1.0 - elapsed) + current
+
+
+class RateLimiter:
+    """Interface for per-user notification rate limits"""
+
+    async def check(self, user_id: str, per_hour: int, per_day: int) -> bool:
+        """True if the user is below both limits"""
+        raise NotImplementedError
+
+    async def record(self, user_id: str):
+        """Count one notification for the user"""
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        return {}
+
+
+class InMemoryRateLimiter(RateLimiter):
+    """Process-local limiter with compact array storage and idle eviction"""
+
+    MAX_USERS = 100_000
+    # Once both windows have rolled over twice a user's counters are all zero
+    IDLE_SECONDS = 2 * DAY_SECONDS
+
+    def __init__(
+        self,
+        max_users: int = MAX_USERS,
+        idle_seconds: float = IDLE_SECONDS,
+        clock: Callable[[], float] = time.time
+    ):
+        self.max_users = max_users
+        self.idle_seconds = idle_seconds
+        self.clock = clock
+
+        # user_id -> slot, least recently used first
+        self._slots: "OrderedDict[str, int]" = OrderedDict()
+        self._free: List[int] = []
+        self._last_seen = array('d')
+        # Per slot, one entry per window at slot * len(WINDOWS) + window index
+        self._bucket = array('q')
+        self._current = array('L')
+        self._previous = array('L')
+
+        self.evictions = 0
+
+    async def check(self, user_id: str, per_hour: int, per_day: int) -> bool:
+        now = self.clock()
+        self._evict_idle(now)
+
+        slot = self._slots.get(user_id)
+        if slot is None:
+            return per_hour > 0 and per_day > 0
+
+        for index, limit in enumerate((per_hour, per_day)):
+            previous, current = self._roll(slot, index, now)
+            if sliding_count(previous, current, WINDOWS[index], now) >= limit:
+                return False
+        return True
+
+    async def record(self, user_id: str):
+        now = self.clock()
+        slot = self._slot_for(user_id, now)
+        for index in range(len(WINDOWS)):
+            self._roll(slot, index, now)
+            self._current[slot * len(WINDOWS) + index] += 1
+
+    def counts(self, user_id: str) -> Tuple[float, float]:
+        """Current sliding (hourly, daily) counts for a user"""
+        now = self.clock()
+        slot = self._slots.get(user_id)
+        if slot is None:
+            return 0.0, 0.0
+        return tuple(
+            sliding_count(*self._roll(slot, index, now), WINDOWS[index], now)
+            for index in range(len(WINDOWS))
+        )
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def stats(self) -> dict:
+        return {
+            "backend": "memory",
+            "users": len(self._slots),
+            "slots": len(self._last_seen),
+            "evictions": self.evictions,
+        }
+
+    def _roll(self, slot: int, index: int, now: float) -> Tuple[int, int]:
+        """Advance a window's buckets to now and return (previous, current)"""
+        position = slot * len(WINDOWS) + index
+        bucket = int(now // WINDOWS[index])
+        stored = self._bucket[position]
+        if stored != bucket:
+            self._previous[position] = self._current[position] if stored == bucket - 1 else 0
+            self._current[position] = 0
+            self._bucket[position] = bucket
+        return self._previous[position], self._current[position]
+
+    def _slot_for(self, user_id: str, now: float) -> int:
+        slot = self._slots.get(user_id)
+        if slot is not None:
+            self._slots.move_to_end(user_id)
+        else:
+            if len(self._slots) >= self.max_users:
+                self._release(next(iter(self._slots)))
+            if self._free:
+                slot = self._free.pop()
+            else:
+                slot = len(self._last_seen)
+                self._last_seen.append(0.0)
+                for _ in WINDOWS:
+                    self._bucket.append(0)
+                    self._current.append(0)
+                    self._previous.append(0)
+            base = slot * len(WINDOWS)
+            for index in range(len(WINDOWS)):
+                self._bucket[base + index] = 0
+                self._current[base + index] = 0
+                self._previous[base + index] = 0
+            self._slots[user_id] = slot
+        self._last_seen[slot] = now
+        return slot
+
+    def _evict_idle(self, now: float):
+        # The least recently used user is first, so stop at the first active one
+        while self._slots:
+            user_id, slot = next(iter(self._slots.items()))
+            if now - self._last_seen[slot] < self.idle_seconds:
+                break
+            self._release(user_id)
+
+    def _release(self, user_id: str):
+        self._free.append(self._slots.pop(user_id))
+        self.evictions += 1
+
+
+class RedisRateLimiter(RateLimiter):
+    """Shared limiter backed by Redis, so limits hold across instances"""
+
+    KEY_PREFIX = "notif_rl"
+
+    def __init__(self, client, clock: Callable[[], float] = time.time):
+        self.client = client
+        self.clock = clock
+
+    def _key(self, user_id: str, window: int, bucket: int) -> str:
+        return f"{self.KEY_PREFIX}:{user_id}:{window}:{bucket}"
+
+    async def check(self, user_id: str, per_hour: int, per_day: int) -> bool:
+        now = self.clock()
+        keys = []
+        for window in WINDOWS:
+            bucket = int(now // window)
+            keys.extend([self._key(user_id, window, bucket - 1), self._key(user_id, window, bucket)])
+
+        values = [int(v or 0) for v in await self.client.mget(keys)]
+        for index, limit in enumerate((per_hour, per_day)):
+            previous, current = values[2 * index], values[2 * index + 1]
+            if sliding_count(previous, current, WINDOWS[index], now) >= limit:
+                return False
+        return True
+
+    async def record(self, user_id: str):
+        now = self.clock()
+        pipe = self.client.pipeline(transaction=False)
+        for window in WINDOWS:
+            key = self._key(user_id, window, int(now // window))
+            pipe.incr(key)
+            # Kept through the next window, where it is the previous bucket
+            pipe.expire(key, 2 * window)
+        await pipe.execute()
+
+    def stats(self) -> dict:
+        return {"backend": "redis"}
+
+
+def create_rate_limiter(url: Optional[str] = None) -> RateLimiter:
+    """Redis limiter when a URL is given (or REDIS_URL is set), else in-memory"""
+    url = url or os.getenv("REDIS_URL")
+    if url:
+        if REDIS_AVAILABLE:
+            try:
+                return RedisRateLimiter(aioredis.from_url(url))
+            except Exception as e:
+                logger.error(f"❌ Could not connect rate limiter to Redis, using in-memory limits: {e}")
+        else:
+            logger.warning("⚠️ REDIS_URL is set but redis is not installed, using in-memory rate limits")
+    return InMemoryRateLimiter()
@@ -0,0 +1,220 @@
+"""
+Notification Trigger Queue
+==========================
+
+Decouples trigger ingestion from notification processing:
+- notify_* helpers enqueue a trigger and return immediately
+- Triggers are persisted to a pluggable backend until processed
+- A fixed pool of workers drains the queue with bounded concurrency
+- Triggers are coalesced per user: a user's first trigger opens a short
+  window, then one worker takes everything queued for that user and hands
+  it to the engine as a single batch, so a user's triggers are never
+  processed concurrently or out of order
+- A worker also takes any other users that are ready at the same time, so
+  scheduled jobs that notify many users share batched LLM requests
+- Notifications created from a batch are handed to push_sender, like the
+  ones created through the API; deferred ones are pushed by the delivery
+  scheduler when they are due
+"""
+
+import asyncio
+import logging
+from collections import defaultdict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+from .notification_types import Notification, NotificationTrigger
+from core.services.queue_backends import QueueBackend, QueueItem, InMemoryQueueBackend
+
+logger = logging.getLogger(__name__)
+
+
+class TriggerQueue:
+    """In-process trigger queue with a per-user coalescing worker pool"""
+
+    QUEUE_NAME = "notification_triggers"
+    NUM_WORKERS = 4
+    # Upper bound on triggers handed to the engine in one batch
+    MAX_BATCH_SIZE = 500
+    # Upper bound on users a worker takes at once
+    MAX_USERS_PER_BATCH = 20
+    # How long a user's triggers are collected before a worker takes them
+    COALESCE_WINDOW_SECONDS = 2.0
+
+    def __init__(
+        self,
+        engine,
+        backend: Optional[QueueBackend] = None,
+        num_workers: int = NUM_WORKERS,
+        max_batch_size: int = MAX_BATCH_SIZE,
+        max_users_per_batch: int = MAX_USERS_PER_BATCH,
+        coalesce_window_seconds: float = COALESCE_WINDOW_SECONDS
+    ):
+        self.engine = engine
+        self.backend = backend if backend is not None else InMemoryQueueBackend()
+        self.num_workers = num_workers
+        self.max_batch_size = max_batch_size
+        self.max_users_per_batch = max_users_per_batch
+        self.coalesce_window_seconds = coalesce_window_seconds
+
+        # user_id -> queued items, and the users waiting for / held by a worker
+        self._pending: Dict[str, List[QueueItem]] = defaultdict(list)
+        self._scheduled: Set[str] = set()
+        self._ready: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._idle: Optional[asyncio.Event] = None
+        # Set by the API layer to push the notifications a batch created
+        self.push_sender: Optional[Callable[[List[Notification]], Awaitable[Any]]] = None
+
+        self.enqueued = 0
+        self.processed = 0
+        self.batches = 0
+        self.failed = 0
+        self.created = 0
+
+        logger.info("📬 Notification Trigger Queue initialized")
+
+    @property
+    def is_running(self) -> bool:
+        return bool(self._workers)
+
+    def start(self):
+        """Start the worker pool on the running loop and recover persisted triggers"""
+
+        if self.is_running:
+            return
+
+        self._ready = asyncio.Queue()
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+        recovered = self.backend.load_pending(self.QUEUE_NAME)
+        for item in recovered:
+            self._schedule(item)
+        if recovered:
+            logger.info(f"📬 Recovered {len(recovered)} queued notification triggers")
+
+        self._workers = [
+            asyncio.create_task(self._worker(i)) for i in range(self.num_workers)
+        ]
+        logger.info(f"📬 Started {self.num_workers} notification workers")
+
+    async def stop(self):
+        """Stop the workers; unprocessed triggers stay in the backend"""
+
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._pending.clear()
+        self._scheduled.clear()
+        await asyncio.to_thread(self.backend.flush)
+
+    async def enqueue(self, trigger: NotificationTrigger) -> str:
+        """
+        Persist a trigger and schedule it for processing.
+
+        Returns:
+            Queue item ID
+        """
+
+        self.start()
+        item = self.backend.put(self.QUEUE_NAME, trigger.to_dict())
+        self.enqueued += 1
+        self._schedule(item)
+        return item.id
+
+    async def wait_idle(self):
+        """Wait until every queued trigger has been processed"""
+        if self._idle is not None:
+            await self._idle.wait()
+
+    def _schedule(self, item: QueueItem):
+        user_id = item.payload.get('user_id', '')
+        self._pending[user_id].append(item)
+        self._idle.clear()
+        if user_id not in self._scheduled:
+            self._scheduled.add(user_id)
+            if self.coalesce_window_seconds > 0:
+                asyncio.get_running_loop().call_later(
+                    self.coalesce_window_seconds, self._ready.put_nowait, user_id
+                )
+            else:
+                self._ready.put_nowait(user_id)
+
+    async def _worker(self, worker_id: int):
+        while True:
+            user_ids = [await self._ready.get()]
+            while len(user_ids) < self.max_users_per_batch and not self._ready.empty():
+                user_ids.append(self._ready.get_nowait())
+            try:
+                await self._process_users(user_ids)
+            except Exception as e:
+                logger.error(f"❌ Notification worker {worker_id} failed for users {user_ids}: {e}", exc_info=True)
+            finally:
+                for user_id in user_ids:
+                    self._ready.task_done()
+                    if self._pending.get(user_id):
+                        # More triggers arrived while this batch was running
+                        self._ready.put_nowait(user_id)
+                    else:
+                        self._pending.pop(user_id, None)
+                        self._scheduled.discard(user_id)
+                if not self._scheduled:
+                    self._idle.set()
+
+    async def _process_users(self, user_ids: List[str]):
+        items: List[QueueItem] = []
+        batches: Dict[str, List[NotificationTrigger]] = {}
+        for user_id in user_ids:
+            user_items = self._pending[user_id][:self.max_batch_size]
+            del self._pending[user_id][:len(user_items)]
+            items.extend(user_items)
+
+            triggers = []
+            for item in user_items:
+                try:
+                    triggers.append(NotificationTrigger.from_dict(item.payload))
+                except Exception as e:
+                    logger.error(f"❌ Dropping malformed queued trigger {item.id}: {e}")
+                    self.failed += 1
+            if triggers:
+                batches[user_id] = triggers
+
+        count = sum(len(triggers) for triggers in batches.values())
+        notifications: List[Notification] = []
+        if batches:
+            try:
+                notifications = await self.engine.process_user_batches(batches)
+            except Exception as e:
+                self.failed += count
+                logger.error(f"❌ Error processing {count} triggers for {len(batches)} users: {e}")
+
+        if notifications:
+            self.created += len(notifications)
+            logger.info(f"📬 Created {len(notifications)} notifications from {count} triggers for {len(batches)} users")
+            # Deferred notifications are pushed when the scheduler delivers them
+            immediate = [n for n in notifications if n.optimal_delivery_time is None]
+            if immediate and self.push_sender is not None:
+                try:
+                    await self.push_sender(immediate)
+                except Exception as e:
+                    logger.error(f"❌ Error queueing pushes for {len(immediate)} notifications: {e}")
+
+        # A failed batch is not retried: acking it keeps a trigger the engine
+        # cannot process from blocking the user's later triggers
+        for item in items:
+            self.backend.ack(self.QUEUE_NAME, item.id)
+        self.processed += count
+        self.batches += 1
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "workers": len(self._workers),
+            "queued": sum(len(items) for items in self._pending.values()),
+            "users_waiting": len(self._scheduled),
+            "enqueued": self.enqueued,
+            "processed": self.processed,
+            "batches": self.batches,
+            "failed": self.failed,
+            "created": self.created,
+        }
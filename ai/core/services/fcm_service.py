@@ -5,27 +5,47 @@ Firebase Cloud Messaging (FCM) Service
 Handles push notification delivery via Firebase Cloud Messaging.
 
 Features:
-- Send push notifications to devices
-- Manage FCM tokens
+- Send push notifications to devices (multicast, up to 500 tokens per call)
+- Batched sends across users for digests and scheduled deliveries
+- Manage FCM tokens, with a bounded TTL cache kept in sync on
+  register/unregister and bulk prefetch for many users
 - Handle notification data payloads
 - Support for both Android and iOS
 """
 
+import asyncio
 import logging
 from typing import Dict, List, Optional, Any
 from datetime import datetime
 import firebase_admin
+from firebase_admin import exceptions as firebase_exceptions
 from firebase_admin import messaging
 
+from core.services.ttl_cache import TTLCache
+
 logger = logging.getLogger(__name__)
 
 
 class FCMService:
     """Service for sending push notifications via Firebase Cloud Messaging"""
     
+    # FCM limit on tokens per multicast and messages per send_each call
+    MAX_TOKENS_PER_CALL = 500
+    
+    # user_id -> tuple of tokens; other instances' registrations show up
+    # within the TTL
+    TOKEN_CACHE_SIZE = 50000
+    TOKEN_TTL_SECONDS = 3600
+    # Users without tokens are cached too, but briefly
+    NO_TOKENS_TTL_SECONDS = 300
+    # Firestore limit on values in an 'in' filter
+    PREFETCH_CHUNK_SIZE = 30
+    
     def __init__(self, db_client=None):
         self.db = db_client
-        self._token_cache: Dict[str, List[str]] = {}  # user_id -> [fcm_tokens]
+        self._token_cache = TTLCache(
+            max_size=self.TOKEN_CACHE_SIZE, ttl_seconds=self.TOKEN_TTL_SECONDS
+        )
         logger.info("📱 FCM Service initialized")
     
     async def send_notification(
@@ -64,88 +84,30 @@ class FCMService:
                     "failed": 0,
                 }
             
-            # Prepare data payload
-            data_payload = data or {}
-            data_payload['notification_id'] = notification_id or ""
-            data_payload['timestamp'] = datetime.now().isoformat()
-            data_payload['click_action'] = 'FLUTTER_NOTIFICATION_CLICK'
-            
-            # Build notification
-            notification = messaging.Notification(
-                title=title,
-                body=body,
-            )
-            
-            # Android config
-            android_config = messaging.AndroidConfig(
-                priority=priority,
-                notification=messaging.AndroidNotification(
-                    title=title,
-                    body=body,
-                    sound='default',
-                    channel_id='financial_alerts',
-                    click_action='FLUTTER_NOTIFICATION_CLICK',
-                ),
-            )
-            
-            # iOS config
-            apns_config = messaging.APNSConfig(
-                payload=messaging.APNSPayload(
-                    aps=messaging.Aps(
-                        alert=messaging.ApsAlert(
-                            title=title,
-                            body=body,
-                        ),
-                        sound='default',
-                        badge=1,
-                    ),
-                ),
-            )
+            # Message parts are built once and shared by every token
+            parts = self._build_message_parts(title, body, data, priority, notification_id)
             
-            # Send to all tokens
+            # One multicast call per 500 tokens, off the event loop
             results = []
-            success_count = 0
-            failure_count = 0
             invalid_tokens = []
-            
-            for token in tokens:
-                try:
-                    message = messaging.Message(
-                        notification=notification,
-                        data=data_payload,
-                        token=token,
-                        android=android_config,
-                        apns=apns_config,
-                    )
-                    
-                    response = messaging.send(message)
-                    results.append({
-                        'token': token[:10] + '...',  # Masked for security
-                        'success': True,
-                        'message_id': response,
-                    })
-                    success_count += 1
-                    
-                    logger.debug(f"✅ Sent notification to token {token[:10]}...")
-                    
-                except messaging.UnregisteredError:
-                    # Token is invalid, mark for removal
-                    invalid_tokens.append(token)
-                    failure_count += 1
-                    logger.warning(f"❌ Invalid token: {token[:10]}...")
-                    
-                except Exception as e:
-                    results.append({
-                        'token': token[:10] + '...',
-                        'success': False,
-                        'error': str(e),
-                    })
-                    failure_count += 1
-                    logger.error(f"❌ Failed to send to token {token[:10]}...: {e}")
+            for start in range(0, len(tokens), self.MAX_TOKENS_PER_CALL):
+                chunk = tokens[start:start + self.MAX_TOKENS_PER_CALL]
+                message = messaging.MulticastMessage(tokens=chunk, **parts)
+                response = await asyncio.to_thread(messaging.send_each_for_multicast, message)
+                
+                for token, send_response in zip(chunk, response.responses):
+                    result = self._token_result(token, send_response)
+                    if result is None:
+                        invalid_tokens.append(token)
+                    else:
+                        results.append(result)
+            
+            success_count = sum(1 for r in results if r['success'])
+            failure_count = len(tokens) - success_count
             
             # Remove invalid tokens
             if invalid_tokens:
-                await self._remove_invalid_tokens(user_id, invalid_tokens)
+                await self._remove_invalid_tokens({user_id: invalid_tokens})
             
             logger.info(f"📱 Push notification sent: {success_count} success, {failure_count} failed")
             
@@ -167,6 +129,205 @@ class FCMService:
                 "failed": 0,
             }
     
+    async def send_batch(self, notifications: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Send different notifications to many users with as few FCM calls as possible.
+        
+        Used for digests and the push outbox: every (notification, token)
+        pair becomes one message and messages go out through send_each in
+        calls of up to 500.
+        
+        Args:
+            notifications: Dicts with user_id, title, body and optionally
+                data, priority and notification_id (same meaning as in
+                send_notification), and tokens to send to only those
+                tokens instead of all of the user's
+            
+        Returns:
+            Dict with overall counts, per-user sent/failed counts and, in
+            the same order as notifications, per-notification results with
+            the tokens worth retrying (transient errors); retry_tokens is
+            None when the user's tokens could not be looked up, meaning
+            retry the whole notification
+        """
+        try:
+            user_ids = list({n['user_id'] for n in notifications})
+            user_tokens = await self.prefetch_tokens(
+                [n['user_id'] for n in notifications if n.get('tokens') is None]
+            )
+            
+            # (notification index, token) for each message, in the same order
+            targets = []
+            messages = []
+            results = []
+            for index, notification in enumerate(notifications):
+                tokens = notification.get('tokens')
+                if tokens is None:
+                    if notification['user_id'] not in user_tokens:
+                        # Token lookup failed; not the same as having no devices
+                        results.append({
+                            "sent": 0, "failed": 0, "invalid": 0, "retry_tokens": None,
+                            "tokens": None, "error": "FCM token lookup failed",
+                        })
+                        continue
+                    tokens = user_tokens[notification['user_id']]
+                results.append({"sent": 0, "failed": 0, "invalid": 0, "retry_tokens": [], "tokens": len(tokens)})
+                if not tokens:
+                    continue
+                parts = self._build_message_parts(
+                    notification['title'],
+                    notification['body'],
+                    notification.get('data'),
+                    notification.get('priority', 'high'),
+                    notification.get('notification_id'),
+                )
+                for token in tokens:
+                    messages.append(messaging.Message(token=token, **parts))
+                    targets.append((index, token))
+            
+            chunks = [
+                (start, messages[start:start + self.MAX_TOKENS_PER_CALL])
+                for start in range(0, len(messages), self.MAX_TOKENS_PER_CALL)
+            ]
+            responses = await asyncio.gather(*(
+                asyncio.to_thread(messaging.send_each, chunk) for _, chunk in chunks
+            ), return_exceptions=True)
+            
+            invalid_tokens: Dict[str, List[str]] = {}
+            for (start, chunk), response in zip(chunks, responses):
+                if isinstance(response, Exception):
+                    # The whole call failed; every token in it can be retried
+                    logger.error(f"❌ FCM send_each call for {len(chunk)} messages failed: {response}")
+                    for index, token in targets[start:start + len(chunk)]:
+                        results[index]["failed"] += 1
+                        results[index]["retry_tokens"].append(token)
+                    continue
+                
+                for (index, token), send_response in zip(targets[start:start + len(chunk)], response.responses):
+                    result = results[index]
+                    if send_response.success:
+                        result["sent"] += 1
+                        continue
+                    result["failed"] += 1
+                    if self._token_result(token, send_response) is None:
+                        result["invalid"] += 1
+                        invalid_tokens.setdefault(notifications[index]['user_id'], []).append(token)
+                    elif self._is_retryable(send_response.exception):
+                        result["retry_tokens"].append(token)
+            
+            if invalid_tokens:
+                await self._remove_invalid_tokens(invalid_tokens)
+            
+            by_user: Dict[str, Dict[str, int]] = {
+                user_id: {"sent": 0, "failed": 0} for user_id in user_ids
+            }
+            for notification, result in zip(notifications, results):
+                by_user[notification['user_id']]["sent"] += result["sent"]
+                by_user[notification['user_id']]["failed"] += result["failed"]
+            
+            sent = sum(result["sent"] for result in results)
+            logger.info(f"📱 Batch push sent: {sent}/{len(messages)} messages to {len(user_ids)} users in {len(chunks)} calls")
+            
+            return {
+                "success": sent > 0,
+                "sent": sent,
+                "failed": len(messages) - sent,
+                "users_without_tokens": sum(1 for result in results if result["tokens"] == 0),
+                "token_lookups_failed": sum(1 for result in results if result["tokens"] is None),
+                "invalid_tokens_removed": sum(len(tokens) for tokens in invalid_tokens.values()),
+                "by_user": by_user,
+                "results": results,
+            }
+            
+        except Exception as e:
+            logger.error(f"❌ Error sending FCM batch: {e}", exc_info=True)
+            return {
+                "success": False,
+                "error": str(e),
+                "sent": 0,
+                "failed": 0,
+            }
+    
+    def _build_message_parts(
+        self,
+        title: str,
+        body: str,
+        data: Optional[Dict[str, str]],
+        priority: str,
+        notification_id: Optional[str],
+    ) -> Dict[str, Any]:
+        """Payload and platform configs shared by all of a notification's messages"""
+        
+        # Prepare data payload
+        data_payload = dict(data or {})
+        data_payload['notification_id'] = notification_id or ""
+        data_payload['timestamp'] = datetime.now().isoformat()
+        data_payload['click_action'] = 'FLUTTER_NOTIFICATION_CLICK'
+        
+        return {
+            'notification': messaging.Notification(
+                title=title,
+                body=body,
+            ),
+            'data': data_payload,
+            # Android config
+            'android': messaging.AndroidConfig(
+                priority=priority,
+                notification=messaging.AndroidNotification(
+                    title=title,
+                    body=body,
+                    sound='default',
+                    channel_id='financial_alerts',
+                    click_action='FLUTTER_NOTIFICATION_CLICK',
+                ),
+            ),
+            # iOS config
+            'apns': messaging.APNSConfig(
+                payload=messaging.APNSPayload(
+                    aps=messaging.Aps(
+                        alert=messaging.ApsAlert(
+                            title=title,
+                            body=body,
+                        ),
+                        sound='default',
+                        badge=1,
+                    ),
+                ),
+            ),
+        }
+    
+    @staticmethod
+    def _is_retryable(error: Optional[Exception]) -> bool:
+        """Whether a failed send may succeed later (quota, outage, timeout)"""
+        return not isinstance(error, (
+            firebase_exceptions.InvalidArgumentError,
+            messaging.ThirdPartyAuthError,
+        ))
+    
+    @staticmethod
+    def _token_result(token: str, send_response) -> Optional[Dict[str, Any]]:
+        """Result entry for one token, or None if the token is no longer valid"""
+        
+        if send_response.success:
+            logger.debug(f"✅ Sent notification to token {token[:10]}...")
+            return {
+                'token': token[:10] + '...',  # Masked for security
+                'success': True,
+                'message_id': send_response.message_id,
+            }
+        
+        error = send_response.exception
+        if isinstance(error, (messaging.UnregisteredError, messaging.SenderIdMismatchError)):
+            logger.warning(f"❌ Invalid token: {token[:10]}...")
+            return None
+        
+        logger.error(f"❌ Failed to send to token {token[:10]}...: {error}")
+        return {
+            'token': token[:10] + '...',
+            'success': False,
+            'error': str(error),
+        }
+    
     async def send_notification_to_topic(
         self,
         topic: str,
@@ -235,7 +396,7 @@ class FCMService:
             # Store token in Firestore
             token_ref = self.db.collection('fcm_tokens').document(f"{user_id}_{fcm_token[:20]}")
             
-            await token_ref.set({
+            await asyncio.to_thread(token_ref.set, {
                 'user_id': user_id,
                 'token': fcm_token,
                 'registered_at': datetime.now().isoformat(),
@@ -243,12 +404,10 @@ class FCMService:
                 'platform': 'unknown',  # Can be determined from the client
             })
             
-            # Update cache
-            if user_id in self._token_cache:
-                if fcm_token not in self._token_cache[user_id]:
-                    self._token_cache[user_id].append(fcm_token)
-            else:
-                self._token_cache[user_id] = [fcm_token]
+            # Write through to the cache (including a cached "no tokens")
+            cached = self._token_cache.get(user_id)
+            if cached is not None and fcm_token not in cached:
+                self._cache_tokens(user_id, cached + (fcm_token,))
             
             logger.info(f"✅ Registered FCM token for user {user_id}")
             
@@ -275,11 +434,10 @@ class FCMService:
             
             # Remove from Firestore
             token_ref = self.db.collection('fcm_tokens').document(f"{user_id}_{fcm_token[:20]}")
-            await token_ref.delete()
+            await asyncio.to_thread(token_ref.delete)
             
             # Update cache
-            if user_id in self._token_cache and fcm_token in self._token_cache[user_id]:
-                self._token_cache[user_id].remove(fcm_token)
+            self._drop_cached_tokens(user_id, [fcm_token])
             
             logger.info(f"✅ Unregistered FCM token for user {user_id}")
             
@@ -290,54 +448,121 @@ class FCMService:
             return False
     
     async def _get_user_tokens(self, user_id: str) -> List[str]:
-        """Get all FCM tokens for a user"""
+        """
+        Get all FCM tokens for a user.
+        
+        Raises if the tokens can't be read, so a failed lookup is never
+        mistaken for a user without devices.
+        """
         
         # Check cache first
-        if user_id in self._token_cache:
-            return self._token_cache[user_id]
+        cached = self._token_cache.get(user_id)
+        if cached is not None:
+            return list(cached)
         
         # Load from database
         if not self.db:
             return []
         
-        try:
-            tokens_ref = self.db.collection('fcm_tokens').where('user_id', '==', user_id)
-            docs = tokens_ref.stream()
-            
-            tokens = []
-            for doc in docs:
-                data = doc.to_dict()
-                token = data.get('token')
-                if token:
-                    tokens.append(token)
-            
-            # Cache the tokens
-            self._token_cache[user_id] = tokens
-            
-            return tokens
-            
-        except Exception as e:
-            logger.error(f"❌ Error loading user tokens: {e}")
-            return []
+        tokens_ref = self.db.collection('fcm_tokens').where('user_id', '==', user_id)
+        docs = await asyncio.to_thread(lambda: [doc.to_dict() for doc in tokens_ref.stream()])
+        
+        tokens = []
+        for data in docs:
+            token = data.get('token')
+            if token and token not in tokens:
+                tokens.append(token)
+        
+        # Cache the tokens
+        self._cache_tokens(user_id, tuple(tokens))
+        
+        return tokens
+    
+    async def prefetch_tokens(self, user_ids: List[str]) -> Dict[str, List[str]]:
+        """
+        Get FCM tokens for many users at once (e.g. before a digest run).
+        
+        Cached users cost nothing; the rest are loaded with 'in' queries of
+        up to 30 users each and cached, including users without tokens.
+        
+        Returns:
+            Dict of user_id -> tokens; users whose lookup failed are left
+            out, so callers can tell them apart from users without tokens
+        """
+        
+        user_ids = list(dict.fromkeys(user_ids))
+        result = {user_id: list(tokens) for user_id, tokens in self._token_cache.get_many(user_ids).items()}
+        missing = [user_id for user_id in user_ids if user_id not in result]
+        if not missing or not self.db:
+            result.update({user_id: [] for user_id in missing})
+            return result
+        
+        def load(chunk: List[str]) -> List[Dict[str, Any]]:
+            query = self.db.collection('fcm_tokens').where('user_id', 'in', chunk)
+            return [doc.to_dict() for doc in query.stream()]
+        
+        loaded: Dict[str, List[str]] = {user_id: [] for user_id in missing}
+        chunks = [
+            missing[start:start + self.PREFETCH_CHUNK_SIZE]
+            for start in range(0, len(missing), self.PREFETCH_CHUNK_SIZE)
+        ]
+        for chunk, docs in zip(chunks, await asyncio.gather(
+            *(asyncio.to_thread(load, chunk) for chunk in chunks), return_exceptions=True
+        )):
+            if isinstance(docs, Exception):
+                # Leave this chunk out of the result and the cache so it is retried
+                logger.error(f"❌ Error prefetching FCM tokens for {len(chunk)} users: {docs}")
+                for user_id in chunk:
+                    del loaded[user_id]
+                continue
+            for data in docs:
+                tokens = loaded.get(data.get('user_id'))
+                if tokens is not None and data.get('token') and data['token'] not in tokens:
+                    tokens.append(data['token'])
+        
+        for user_id, tokens in loaded.items():
+            self._cache_tokens(user_id, tuple(tokens))
+            result[user_id] = tokens
+        
+        logger.debug(f"📱 Prefetched FCM tokens: {len(user_ids) - len(missing)} cached, {len(missing)} loaded")
+        return result
+    
+    def stats(self) -> Dict[str, Any]:
+        return {"token_cache": self._token_cache.stats()}
+    
+    def _cache_tokens(self, user_id: str, tokens: tuple):
+        self._token_cache.set(
+            user_id, tokens, ttl_seconds=None if tokens else self.NO_TOKENS_TTL_SECONDS
+        )
+    
+    def _drop_cached_tokens(self, user_id: str, tokens: List[str]):
+        cached = self._token_cache.get(user_id)
+        if cached is not None:
+            self._cache_tokens(user_id, tuple(t for t in cached if t not in tokens))
     
-    async def _remove_invalid_tokens(self, user_id: str, tokens: List[str]):
-        """Remove invalid tokens from database"""
+    async def _remove_invalid_tokens(self, invalid_tokens: Dict[str, List[str]]):
+        """Remove invalid tokens (user_id -> tokens) from database in WriteBatches"""
+        
+        # Update cache
+        for user_id, tokens in invalid_tokens.items():
+            self._drop_cached_tokens(user_id, tokens)
         
         if not self.db:
             return
         
         try:
-            for token in tokens:
-                token_ref = self.db.collection('fcm_tokens').document(f"{user_id}_{token[:20]}")
-                await token_ref.delete()
-            
-            # Update cache
-            if user_id in self._token_cache:
-                self._token_cache[user_id] = [
-                    t for t in self._token_cache[user_id] if t not in tokens
-                ]
-            
-            logger.info(f"🗑️  Removed {len(tokens)} invalid tokens for user {user_id}")
+            refs = [
+                self.db.collection('fcm_tokens').document(f"{user_id}_{token[:20]}")
+                for user_id, tokens in invalid_tokens.items()
+                for token in tokens
+            ]
+            for start in range(0, len(refs), self.MAX_TOKENS_PER_CALL):
+                batch = self.db.batch()
+                for ref in refs[start:start + self.MAX_TOKENS_PER_CALL]:
+                    batch.delete(ref)
+                await asyncio.to_thread(batch.commit)
+            
+            logger.info(f"🗑️  Removed {len(refs)} invalid tokens for {len(invalid_tokens)} users")
             
         except Exception as e:
             logger.error(f"❌ Error removing invalid tokens: {e}")
@@ -0,0 +1,227 @@
+"""
+Queue Backends
+==============
+
+Durable storage behind the in-process work queues (notification triggers,
+push outbox). Items are JSON payloads that stay in the backend until they
+are acknowledged, so work accepted before a restart is picked up again.
+
+Backends:
+- InMemoryQueueBackend: process-local, for tests and single-instance dev
+- SQLiteQueueBackend: local durable stand-in for a managed queue; put() and
+  ack() hand their writes to a dedicated writer thread, which commits
+  whatever has accumulated in one transaction, so callers on the event
+  loop never wait on a disk commit
+
+Pick one with create_queue_backend(); QUEUE_BACKEND_PATH selects SQLite.
+"""
+
+import abc
+import json
+import logging
+import os
+import queue as queue_module
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class QueueItem:
+    """One queued payload"""
+
+    __slots__ = ('id', 'queue', 'payload', 'attempts', 'available_at', 'created_at')
+
+    def __init__(
+        self,
+        id: str,
+        queue: str,
+        payload: Dict[str, Any],
+        attempts: int = 0,
+        available_at: float = 0.0,
+        created_at: Optional[float] = None
+    ):
+        self.id = id
+        self.queue = queue
+        self.payload = payload
+        self.attempts = attempts
+        self.available_at = available_at
+        self.created_at = created_at if created_at is not None else time.time()
+
+
+class QueueBackend(abc.ABC):
+    """Interface for durable queue storage"""
+
+    @abc.abstractmethod
+    def put(self, queue: str, payload: Dict[str, Any], available_at: float = 0.0) -> QueueItem:
+        """Store a payload; must not block on I/O, as it is called from the event loop"""
+
+    @abc.abstractmethod
+    def ack(self, queue: str, item_id: str):
+        """Remove an item; must not block on I/O, as it is called from the event loop"""
+
+    @abc.abstractmethod
+    def load_pending(self, queue: str) -> List[QueueItem]:
+        """Return every unacknowledged item, oldest first"""
+
+    @abc.abstractmethod
+    def count(self, queue: str) -> int:
+        pass
+
+    def flush(self):
+        """Block until every accepted put/ack is durable"""
+
+    def close(self):
+        pass
+
+
+class InMemoryQueueBackend(QueueBackend):
+    """Process-local backend (not durable across restarts)"""
+
+    def __init__(self):
+        self._items: Dict[str, "OrderedDict[str, QueueItem]"] = {}
+        self._lock = threading.Lock()
+
+    def put(self, queue: str, payload: Dict[str, Any], available_at: float = 0.0) -> QueueItem:
+        item = QueueItem(uuid.uuid4().hex, queue, payload, available_at=available_at)
+        with self._lock:
+            self._items.setdefault(queue, OrderedDict())[item.id] = item
+        return item
+
+    def ack(self, queue: str, item_id: str):
+        with self._lock:
+            self._items.get(queue, {}).pop(item_id, None)
+
+    def load_pending(self, queue: str) -> List[QueueItem]:
+        with self._lock:
+            return list(self._items.get(queue, {}).values())
+
+    def count(self, queue: str) -> int:
+        with self._lock:
+            return len(self._items.get(queue, {}))
+
+
+class SQLiteQueueBackend(QueueBackend):
+    """Durable local backend using a single SQLite file (WAL mode) and a writer thread"""
+
+    _INSERT = "INSERT INTO queue_items (id, queue, payload, attempts, available_at, created_at) VALUES (?, ?, ?, ?, ?, ?)"
+    _DELETE = "DELETE FROM queue_items WHERE queue = ? AND id = ?"
+
+    def __init__(self, path: str):
+        self.path = path
+        # (statement, parameters) waiting for the writer thread; None stops it
+        self._writes: "queue_module.Queue[Optional[Tuple[str, tuple]]]" = queue_module.Queue()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS queue_items (
+                    id TEXT PRIMARY KEY,
+                    queue TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    available_at REAL NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL
+                )
+                """
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_queue_items_queue ON queue_items (queue, created_at)"
+            )
+        self._writer = threading.Thread(target=self._write_loop, name="sqlite-queue-writer", daemon=True)
+        self._writer.start()
+        logger.info(f"🗄️ SQLite queue backend ready at {path}")
+
+    def put(self, queue: str, payload: Dict[str, Any], available_at: float = 0.0) -> QueueItem:
+        item = QueueItem(uuid.uuid4().hex, queue, payload, available_at=available_at)
+        self._writes.put((
+            self._INSERT,
+            (item.id, queue, json.dumps(payload, default=str), 0, available_at, item.created_at),
+        ))
+        return item
+
+    def ack(self, queue: str, item_id: str):
+        self._writes.put((self._DELETE, (queue, item_id)))
+
+    def flush(self):
+        self._writes.join()
+
+    def load_pending(self, queue: str) -> List[QueueItem]:
+        self.flush()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, payload, attempts, available_at, created_at FROM queue_items WHERE queue = ? ORDER BY created_at",
+                (queue,),
+            ).fetchall()
+        return [
+            QueueItem(row[0], queue, json.loads(row[1]), attempts=row[2], available_at=row[3], created_at=row[4])
+            for row in rows
+        ]
+
+    def count(self, queue: str) -> int:
+        self.flush()
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM queue_items WHERE queue = ?", (queue,)).fetchone()[0]
+
+    def close(self):
+        self._writes.put(None)
+        self._writer.join()
+        with self._lock:
+            self._conn.close()
+
+    def _write_loop(self):
+        while True:
+            writes = [self._writes.get()]
+            while True:
+                try:
+                    writes.append(self._writes.get_nowait())
+                except queue_module.Empty:
+                    break
+
+            statements = [write for write in writes if write is not None]
+            try:
+                self._commit(statements)
+            finally:
+                for _ in writes:
+                    self._writes.task_done()
+            if len(statements) < len(writes):
+                return
+
+    def _commit(self, statements: List[Tuple[str, tuple]]):
+        if not statements:
+            return
+        with self._lock:
+            try:
+                self._conn.execute("BEGIN")
+                for sql, params in statements:
+                    self._conn.execute(sql, params)
+                self._conn.execute("COMMIT")
+                return
+            except sqlite3.Error as e:
+                if self._conn.in_transaction:
+                    self._conn.execute("ROLLBACK")
+                logger.warning(f"⚠️ Queue write batch of {len(statements)} failed, retrying individually: {e}")
+            # Don't let one bad write take the rest of the batch with it
+            for sql, params in statements:
+                try:
+                    self._conn.execute(sql, params)
+                except sqlite3.Error as e:
+                    logger.error(f"❌ Queue write failed: {e}")
+
+
+def create_queue_backend(path: Optional[str] = None) -> QueueBackend:
+    """SQLite backend when a path is given (or QUEUE_BACKEND_PATH is set), else in-memory"""
+    path = path or os.getenv("QUEUE_BACKEND_PATH")
+    if path:
+        try:
+            return SQLiteQueueBackend(path)
+        except Exception as e:
+            logger.error(f"❌ Could not open SQLite queue backend at {path}, using in-memory queue: {e}")
+    return InMemoryQueueBackend()
@@ -11,10 +11,12 @@ FastAPI endpoints for notification management:
 - Record interactions (for learning)
 """
 
+import base64
+import json
 import logging
-from typing import List, Optional, Dict, Any
-from datetime import datetime, timedelta
-from fastapi import APIRouter, HTTPException, Query, Body
+from typing import List, Optional, Dict, Any, Tuple
+from datetime import datetime
+from fastapi import APIRouter, HTTPException, Query, Body, Response
 from pydantic import BaseModel, Field
 
 from core.notifications.ai_notification_engine import AINotificationEngine
@@ -26,8 +28,12 @@ from core.notifications.notification_types import (
     NotificationTrigger,
     UserNotificationPreferences,
 )
+from core.notifications.notification_counters import is_counted_unread, is_read
 from core.notifications.personalization_engine import PersonalizationEngine
+from core.notifications.push_outbox import PushOutbox
+from core.notifications.trigger_queue import TriggerQueue
 from core.services.fcm_service import FCMService, get_fcm_service
+from core.services.queue_backends import QueueBackend, create_queue_backend
 from firebase_admin import firestore
 
 logger = logging.getLogger(__name__)
@@ -39,17 +45,70 @@ router = APIRouter(prefix="/api/v1/notifications", tags=["notifications"])
 notification_engine: Optional[AINotificationEngine] = None
 personalization_engine: Optional[PersonalizationEngine] = None
 fcm_service: Optional[FCMService] = None
+trigger_queue: Optional[TriggerQueue] = None
+push_outbox: Optional[PushOutbox] = None
+queue_backend: Optional[QueueBackend] = None
 
 
 def init_notification_system(db_client):
     """Initialize notification system with database client"""
-    global notification_engine, personalization_engine, fcm_service
-    notification_engine = AINotificationEngine(db_client)
-    personalization_engine = PersonalizationEngine(db_client)
+    global notification_engine, personalization_engine, fcm_service, trigger_queue, push_outbox, queue_backend
+    # One backend (one SQLite connection and writer thread) for every queue
+    queue_backend = create_queue_backend()
+    notification_engine = AINotificationEngine(db_client, queue_backend=queue_backend)
+    trigger_queue = TriggerQueue(notification_engine, backend=queue_backend)
+    # Shared with the engine, so saved preferences update the cache it reads
+    personalization_engine = notification_engine.personalization
     fcm_service = get_fcm_service(db_client)
+    push_outbox = PushOutbox(fcm_service, backend=queue_backend)
+    notification_engine.push_sender = _send_push_batch
+    trigger_queue.push_sender = _send_push_batch
     logger.info("🔔 Notification system initialized")
 
 
+def _push_message(notification: Notification) -> Optional[Dict[str, Any]]:
+    """FCM message for critical and high priority notifications, None for the rest"""
+    if notification.priority not in [NotificationPriority.CRITICAL, NotificationPriority.HIGH]:
+        return None
+    
+    push_data = {
+        'notification_id': notification.id,
+        'category': notification.category.value,
+        'priority': notification.priority.value,
+    }
+    
+    if notification.related_transaction_id:
+        push_data['transaction_id'] = notification.related_transaction_id
+    
+    return {
+        'user_id': notification.user_id,
+        'title': notification.title,
+        'body': notification.body,
+        'data': push_data,
+        'notification_id': notification.id,
+        'priority': 'high',
+    }
+
+
+async def _send_push(notification: Notification):
+    """Queue a push notification for critical and high priority notifications"""
+    await _send_push_batch([notification])
+
+
+async def _send_push_batch(notifications: List[Notification]):
+    """Queue push notifications; the outbox sends them in batched FCM requests"""
+    if not push_outbox:
+        return
+    
+    for message in map(_push_message, notifications):
+        if message is None:
+            continue
+        try:
+            push_outbox.enqueue(message)
+        except Exception as e:
+            logger.error(f"❌ Failed to queue push notification: {e}")
+
+
 # ============================================================================
 # REQUEST/RESPONSE MODELS
 # ============================================================================
@@ -140,31 +199,9 @@ async def create_notification(request: CreateNotificationRequest):
             # Notification was filtered out (not important enough)
             return {"message": "Notification filtered", "created": False}
         
-        # Send push notification if enabled
-        if fcm_service and notification.priority in [NotificationPriority.CRITICAL, NotificationPriority.HIGH]:
-            try:
-                push_data = {
-                    'notification_id': notification.id,
-                    'category': notification.category.value,
-                    'priority': notification.priority.value,
-                }
-                
-                if notification.related_transaction_id:
-                    push_data['transaction_id'] = notification.related_transaction_id
-                
-                fcm_result = await fcm_service.send_notification(
-                    user_id=request.user_id,
-                    title=notification.title,
-                    body=notification.body,
-                    data=push_data,
-                    notification_id=notification.id,
-                    priority='high' if notification.priority == NotificationPriority.CRITICAL else 'high',
-                )
-                
-                logger.info(f"📱 Push notification sent: {fcm_result.get('sent', 0)} devices")
-                
-            except Exception as e:
-                logger.error(f"❌ Failed to send push notification: {e}")
+        # Queue the push now, unless it was scheduled for later
+        if notification.optimal_delivery_time is None:
+            await _send_push(notification)
         
         logger.info(f"✅ Created notification {notification.id} for user {request.user_id}")
         
@@ -190,11 +227,30 @@ async def create_notification(request: CreateNotificationRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def _encode_page_token(timestamp: Optional[str], doc_id: str) -> str:
+    """Opaque cursor for the (timestamp, document id) of the last notification on a page"""
+    raw = json.dumps([timestamp, doc_id], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def _decode_page_token(token: str) -> Tuple[Optional[str], str]:
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        timestamp, doc_id = json.loads(raw)
+        if not isinstance(doc_id, str) or not doc_id or not isinstance(timestamp, (str, type(None))):
+            raise ValueError("malformed cursor")
+        return timestamp, doc_id
+    except (ValueError, TypeError) as e:
+        raise HTTPException(status_code=400, detail="Invalid page_token") from e
+
+
 @router.get("/user/{user_id}", response_model=List[NotificationResponse])
 async def get_user_notifications(
     user_id: str,
+    response: Response,
     limit: int = Query(50, ge=1, le=200, description="Maximum notifications to return"),
-    offset: int = Query(0, ge=0, description="Pagination offset"),
+    offset: int = Query(0, ge=0, description="Pagination offset (deprecated, use page_token)"),
+    page_token: Optional[str] = Query(None, description="Cursor from the X-Next-Page-Token header of the previous page"),
     unread_only: bool = Query(False, description="Return only unread notifications"),
     category: Optional[str] = Query(None, description="Filter by category"),
     priority: Optional[str] = Query(None, description="Filter by priority"),
@@ -204,7 +260,9 @@ async def get_user_notifications(
     Get notifications for a user with filtering and pagination.
     
     Supports:
-    - Pagination (limit/offset)
+    - Cursor pagination (limit/page_token); the next page's token is
+      returned in the X-Next-Page-Token header, absent on the last page
+    - Offset pagination (limit/offset), kept for older clients
     - Filter by read status
     - Filter by category
     - Filter by priority
@@ -214,12 +272,17 @@ async def get_user_notifications(
         if not notification_engine or not notification_engine.db:
             raise HTTPException(status_code=500, detail="Notification system not initialized")
         
+        # Everything up to the user's read watermark counts as read
+        last_read_at = await notification_engine.counters.get_last_read_at(user_id)
+        
         # Build query
         query = notification_engine.db.collection('notifications').where('user_id', '==', user_id)
         
         # Apply filters
         if unread_only:
             query = query.where('is_read', '==', False)
+            if last_read_at:
+                query = query.where('timestamp', '>', last_read_at)
         
         if category:
             query = query.where('category', '==', category)
@@ -230,14 +293,28 @@ async def get_user_notifications(
         if since:
             query = query.where('timestamp', '>=', since)
         
-        # Order by timestamp (newest first)
-        query = query.order_by('timestamp', direction=firestore.Query.DESCENDING)
-        
-        # Apply pagination
-        query = query.limit(limit).offset(offset)
-        
-        # Execute query
-        docs = query.stream()
+        # Order by timestamp (newest first), ties broken by document id so
+        # the cursor is unique. Served by the (user_id, [filter], timestamp DESC)
+        # indexes in backend/firestore.indexes.json
+        query = query.order_by('timestamp', direction=firestore.Query.DESCENDING) \
+            .order_by('__name__', direction=firestore.Query.DESCENDING)
+        
+        # Apply pagination. A cursor costs the same on every page; an offset
+        # is still read (and billed) document by document
+        if page_token:
+            timestamp, doc_id = _decode_page_token(page_token)
+            query = query.start_after([timestamp, notification_engine.db.collection('notifications').document(doc_id)])
+        elif offset:
+            query = query.offset(offset)
+        
+        # One extra document tells us whether there is a next page
+        docs = list(query.limit(limit + 1).stream())
+        has_more = len(docs) > limit
+        docs = docs[:limit]
+        
+        if has_more:
+            last = docs[-1]
+            response.headers["X-Next-Page-Token"] = _encode_page_token(last.to_dict().get('timestamp'), last.id)
         
         notifications = []
         for doc in docs:
@@ -253,7 +330,7 @@ async def get_user_notifications(
                 timestamp=data.get('timestamp'),
                 importance_score=data.get('importance_score', 0),
                 relevance_score=data.get('relevance_score', 0),
-                is_read=data.get('is_read', False),
+                is_read=is_read(data, last_read_at),
                 is_archived=data.get('is_archived', False),
                 available_actions=data.get('available_actions', []),
                 related_transaction_id=data.get('related_transaction_id'),
@@ -263,6 +340,8 @@ async def get_user_notifications(
         
         return notifications
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"❌ Error retrieving notifications: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
@@ -281,6 +360,7 @@ async def get_notification(notification_id: str):
             raise HTTPException(status_code=404, detail="Notification not found")
         
         data = doc.to_dict()
+        read = is_read(data) or is_read(data, await notification_engine.counters.get_last_read_at(data.get('user_id')))
         
         return NotificationResponse(
             id=data.get('id'),
@@ -293,7 +373,7 @@ async def get_notification(notification_id: str):
             timestamp=data.get('timestamp'),
             importance_score=data.get('importance_score', 0),
             relevance_score=data.get('relevance_score', 0),
-            is_read=data.get('is_read', False),
+            is_read=read,
             is_archived=data.get('is_archived', False),
             available_actions=data.get('available_actions', []),
             related_transaction_id=data.get('related_transaction_id'),
@@ -306,6 +386,33 @@ async def get_notification(notification_id: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.get("/{notification_id}/context")
+async def get_notification_context(notification_id: str):
+    """Get the context snapshot a notification was generated with"""
+    try:
+        if not notification_engine or not notification_engine.db:
+            raise HTTPException(status_code=500, detail="Notification system not initialized")
+        
+        doc = notification_engine.db.collection(
+            notification_engine.CONTEXT_COLLECTION
+        ).document(notification_id).get()
+        
+        if not doc.exists:
+            raise HTTPException(status_code=404, detail="Notification context not found")
+        
+        data = doc.to_dict()
+        return {
+            "notification_id": notification_id,
+            "context": Notification.decode_context_snapshot(data.get('data')),
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"❌ Error retrieving notification context: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @router.patch("/{notification_id}")
 async def update_notification(
     notification_id: str,
@@ -332,6 +439,10 @@ async def update_notification(
         if data.get('user_id') != user_id:
             raise HTTPException(status_code=403, detail="Not authorized to update this notification")
         
+        # Whether the notification counts as unread before this update
+        last_read_at = await notification_engine.counters.get_last_read_at(user_id)
+        was_unread = is_counted_unread(data, last_read_at)
+        
         # Build update dict
         update_dict = {}
         
@@ -351,13 +462,20 @@ async def update_notification(
             try:
                 action_enum = NotificationAction(update.action_taken)
                 await notification_engine.record_notification_interaction(
-                    notification_id, action_enum, user_id
+                    notification_id, action_enum, user_id, notification_data=data
                 )
+                # Taking an action marks it read
+                data = {**data, 'is_read': True}
+                was_unread = False
             except ValueError:
                 logger.warning(f"Unknown action: {update.action_taken}")
         
-        # Update in database
-        doc_ref.update(update_dict)
+        # Update in database, together with the unread counter if it changes
+        ops = [('update', 'notifications', notification_id, update_dict)]
+        now_unread = is_counted_unread({**data, **update_dict}, last_read_at)
+        if now_unread != was_unread:
+            ops.append(notification_engine.counters.unread_op(user_id, 1 if now_unread else -1))
+        await notification_engine.writer.write(ops)
         
         logger.debug(f"✅ Updated notification {notification_id}")
         
@@ -393,11 +511,15 @@ async def delete_notification(
         if data.get('user_id') != user_id:
             raise HTTPException(status_code=403, detail="Not authorized to delete this notification")
         
-        # Soft delete
-        doc_ref.update({
+        # Soft delete; counters only change the first time
+        ops = [('update', 'notifications', notification_id, {
             'is_deleted': True,
             'deleted_at': datetime.now().isoformat()
-        })
+        })]
+        if not data.get('is_deleted', False):
+            unread = await notification_engine.counters.is_unread(user_id, data)
+            ops.append(notification_engine.counters.deleted_op(user_id, data, unread))
+        await notification_engine.writer.write(ops)
         
         logger.debug(f"🗑️  Deleted notification {notification_id}")
         
@@ -412,30 +534,24 @@ async def delete_notification(
 
 @router.post("/mark-all-read")
 async def mark_all_read(user_id: str = Body(..., embed=True)):
-    """Mark all notifications as read for a user"""
+    """
+    Mark all notifications as read for a user.
+    
+    Moves the user's read watermark to now with a single write; the
+    per-notification is_read flags are updated in the background.
+    """
     try:
         if not notification_engine or not notification_engine.db:
             raise HTTPException(status_code=500, detail="Notification system not initialized")
         
-        # Get all unread notifications
-        query = notification_engine.db.collection('notifications') \
-            .where('user_id', '==', user_id) \
-            .where('is_read', '==', False)
-        
-        docs = query.stream()
-        
-        count = 0
-        for doc in docs:
-            doc.reference.update({
-                'is_read': True,
-                'opened_at': datetime.now().isoformat()
-            })
-            count += 1
+        last_read_at = await notification_engine.counters.mark_all_read(user_id)
         
-        logger.info(f"✅ Marked {count} notifications as read for user {user_id}")
+        logger.info(f"✅ Marked all notifications as read for user {user_id}")
         
-        return {"message": f"Marked {count} notifications as read"}
+        return {"message": "Marked all notifications as read", "last_read_at": last_read_at}
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"❌ Error marking all as read: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
@@ -447,45 +563,21 @@ async def mark_all_read(user_id: str = Body(..., embed=True)):
 
 @router.get("/stats/{user_id}", response_model=NotificationStatsResponse)
 async def get_notification_stats(user_id: str):
-    """Get notification statistics for a user"""
+    """
+    Get notification statistics for a user.
+    
+    Served from the user's notification_counters document (one read); users
+    without one yet are counted with aggregation queries.
+    """
     try:
         if not notification_engine or not notification_engine.db:
             raise HTTPException(status_code=500, detail="Notification system not initialized")
         
-        # Get all notifications for user
-        query = notification_engine.db.collection('notifications').where('user_id', '==', user_id)
-        docs = list(query.stream())
-        
-        total = len(docs)
-        unread = sum(1 for doc in docs if not doc.to_dict().get('is_read', False))
-        
-        # Count by category
-        by_category = {}
-        for doc in docs:
-            cat = doc.to_dict().get('category', 'unknown')
-            by_category[cat] = by_category.get(cat, 0) + 1
-        
-        # Count by priority
-        by_priority = {}
-        for doc in docs:
-            pri = doc.to_dict().get('priority', 'medium')
-            by_priority[pri] = by_priority.get(pri, 0) + 1
-        
-        # Count recent (last 24 hours)
-        yesterday = (datetime.now() - timedelta(hours=24)).isoformat()
-        recent = sum(
-            1 for doc in docs 
-            if doc.to_dict().get('timestamp', '') >= yesterday
-        )
-        
-        return NotificationStatsResponse(
-            total_notifications=total,
-            unread_count=unread,
-            by_category=by_category,
-            by_priority=by_priority,
-            recent_count=recent,
-        )
+        stats = await notification_engine.counters.get_stats(user_id)
+        return NotificationStatsResponse(**stats)
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"❌ Error getting stats: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
@@ -621,6 +713,55 @@ async def unregister_fcm_token(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# ============================================================================
+# QUEUE & PIPELINE STATUS
+# ============================================================================
+
+@router.get("/queue/stats")
+async def get_queue_stats():
+    """Get notification trigger queue statistics"""
+    if not trigger_queue:
+        raise HTTPException(status_code=500, detail="Notification system not initialized")
+    
+    return trigger_queue.stats()
+
+
+@router.get("/push/stats")
+async def get_push_stats():
+    """Get push delivery statistics (latency percentiles, success rates, retries)"""
+    if not push_outbox:
+        raise HTTPException(status_code=500, detail="Notification system not initialized")
+    
+    return push_outbox.stats()
+
+
+@router.get("/push/dead-letters")
+async def get_push_dead_letters(limit: int = Query(100, ge=1, le=1000)):
+    """Get pushes that failed after every retry"""
+    if not push_outbox:
+        raise HTTPException(status_code=500, detail="Notification system not initialized")
+    
+    return push_outbox.dead_letters(limit)
+
+
+@router.post("/push/dead-letters/requeue")
+async def requeue_push_dead_letters():
+    """Retry every dead-lettered push"""
+    if not push_outbox:
+        raise HTTPException(status_code=500, detail="Notification system not initialized")
+    
+    return {"requeued": push_outbox.requeue_dead_letters()}
+
+
+@router.get("/pipeline/stats")
+async def get_pipeline_stats():
+    """Get how many triggers each notification pipeline stage dropped"""
+    if not notification_engine:
+        raise HTTPException(status_code=500, detail="Notification system not initialized")
+    
+    return notification_engine.get_pipeline_stats()
+
+
 # ============================================================================
 # TESTING & DEBUGGING
 # ============================================================================
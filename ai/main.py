@@ -254,6 +254,9 @@ class SetModelRequest(BaseModel):
 class GetUserModelSettingsResponse(BaseModel):
     models: Dict[str, str]
 
+class BatchPredictionRequest(BaseModel):
+    user_ids: List[str]
+
 
 app = FastAPI(
     title="Centhios AI API",
@@ -993,21 +996,15 @@ async def parse_sms_messages(request: SmsParseRequest, req: Request):
             # TRIGGER NOTIFICATIONS FOR TRANSACTIONS
             # ============================================================================
             try:
-                from core.notifications.notification_triggers_integration import notify_transaction_created
+                from core.notifications.notification_triggers_integration import notify_transactions_created
                 
                 logger.info(f"🔔 Triggering notifications for {len(parsed_transactions)} transactions")
                 
-                for trans in parsed_transactions:
-                    try:
-                        # Trigger notification for each transaction
-                        await notify_transaction_created(
-                            user_id=user_id,
-                            transaction=trans
-                        )
-                    except Exception as e:
-                        logger.error(f"❌ Failed to trigger notification for transaction: {e}")
-                        # Don't fail the whole request if notification fails
-                        continue
+                # Anomalies for the whole batch are scored in one pass
+                await notify_transactions_created(
+                    user_id=user_id,
+                    transactions=parsed_transactions
+                )
                 
                 logger.info(f"✅ Notification triggers completed")
                 
@@ -1100,21 +1097,15 @@ async def parse_sms_messages(request: SmsParseRequest, req: Request):
             # TRIGGER NOTIFICATIONS FOR TRANSACTIONS
             # ============================================================================
             try:
-                from core.notifications.notification_triggers_integration import notify_transaction_created
+                from core.notifications.notification_triggers_integration import notify_transactions_created
                 
                 logger.info(f"🔔 Triggering notifications for {len(parsed_transactions)} transactions")
                 
-                for trans in parsed_transactions:
-                    try:
-                        # Trigger notification for each transaction
-                        await notify_transaction_created(
-                            user_id=user_id,
-                            transaction=trans
-                        )
-                    except Exception as e:
-                        logger.error(f"❌ Failed to trigger notification for transaction: {e}")
-                        # Don't fail the whole request if notification fails
-                        continue
+                # Anomalies for the whole batch are scored in one pass
+                await notify_transactions_created(
+                    user_id=user_id,
+                    transactions=parsed_transactions
+                )
                 
                 logger.info(f"✅ Notification triggers completed")
                 
@@ -1213,12 +1204,34 @@ async def predict_spending(user_id: str):
         logger.error("Prediction agent not initialized.")
         raise HTTPException(status_code=500, detail="Prediction agent is not available.")
     try:
-        prediction = await prediction_agent.generate_spending_prediction(user_id)
+        # Served from the precomputed forecast cache; computed only on a miss
+        prediction = await prediction_agent.get_spending_prediction(user_id)
         return prediction
     except Exception as e:
         logger.exception(f"Error during spending prediction: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+MAX_BATCH_PREDICTION_USERS = 500
+
+@app.post("/predict-spending/batch")
+async def predict_spending_batch(request: BatchPredictionRequest):
+    """Return spending predictions for many users, reading all cache misses in one batch."""
+    logger.info(f"Received /predict-spending/batch request for {len(request.user_ids)} users.")
+    if not prediction_agent:
+        logger.error("Prediction agent not initialized.")
+        raise HTTPException(status_code=500, detail="Prediction agent is not available.")
+    if len(request.user_ids) > MAX_BATCH_PREDICTION_USERS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {MAX_BATCH_PREDICTION_USERS} user_ids are allowed per request."
+        )
+    try:
+        predictions = await prediction_agent.get_spending_predictions(request.user_ids)
+        return {"predictions": predictions}
+    except Exception as e:
+        logger.exception(f"Error during batch spending prediction: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.post("/get-logo", response_model=LogoResponse)
 async def get_logo(request: LogoRequest):
     """
@@ -2195,6 +2208,39 @@ async def test_nav_fetch(fund_name: str):
             "timestamp": datetime.now().isoformat()
         } 
 
+# Background scheduler shared by all scheduled jobs
+def run_scheduler():
+    while True:
+        schedule.run_pending()
+        time.sleep(60) # check every minute
+
+# Event loop of the running app; scheduled jobs submit coroutines to it
+app_event_loop: Optional[asyncio.AbstractEventLoop] = None
+
+# Background job that precomputes spending forecasts into the cache
+def schedule_nightly_forecast_precompute():
+    """Schedule nightly precomputation of spending forecasts (2 AM)."""
+
+    def run_forecast_precompute():
+        """Run the precompute coroutine on the app event loop."""
+        try:
+            if not prediction_agent or app_event_loop is None:
+                logger.info("Skipping forecast precompute: prediction agent not ready")
+                return
+
+            logger.info("🕒 Running scheduled forecast precompute...")
+            future = asyncio.run_coroutine_threadsafe(
+                prediction_agent.precompute_forecasts(), app_event_loop
+            )
+            written = future.result(timeout=1800)
+            logger.info(f"✅ Scheduled forecast precompute completed: {written} forecasts")
+
+        except Exception as e:
+            logger.error(f"❌ Scheduled forecast precompute failed: {e}", exc_info=True)
+
+    schedule.every().day.at("02:00").do(run_forecast_precompute)
+    logger.info("📅 Nightly forecast precompute scheduled (runs daily at 2 AM)")
+
 # Background scheduler for daily NAV updates
 def schedule_daily_nav_updates():
     """Schedule daily NAV updates to run after market hours (7 PM IST)."""
@@ -2220,20 +2266,7 @@ def schedule_daily_nav_updates():
     # Schedule daily at 7 PM (after market hours)
     schedule.every().day.at("19:00").do(run_daily_nav_update)
     
-    def run_scheduler():
-        while True:
-            schedule.run_pending()
-            time.sleep(60) # check every minute
-
-    # The following lines will be moved into the startup_event
-    # scheduler_thread = threading.Thread(target=run_scheduler, daemon=True)
-    # scheduler_thread.start()
-    # logger.info("⏰ Scheduler thread started for background tasks")
-
-    # Start scheduler in background thread
-    scheduler_thread = threading.Thread(target=run_scheduler, daemon=True)
-    scheduler_thread.start()
-    
+    # The scheduler thread itself is started once in startup_event
     logger.info("📅 Daily NAV update scheduler started (runs daily at 7 PM IST)")
 
 # Initialize prediction agent for pre-warming ML models on startup
@@ -2252,6 +2285,26 @@ async def startup_event():
     except Exception as e:
         logger.error(f"Failed to initialize Firebase Admin SDK: {e}")
 
+    # Capture the app event loop for scheduled jobs that run async work
+    global app_event_loop
+    app_event_loop = asyncio.get_running_loop()
+    schedule_nightly_forecast_precompute()
+
+    # Start notification workers, the delivery scheduler and the push outbox
+    # (all resume work persisted before a restart), plus notification
+    # counter reconciliation
+    try:
+        from endpoints_notifications import trigger_queue, notification_engine, push_outbox
+        if trigger_queue:
+            trigger_queue.start()
+        if push_outbox:
+            push_outbox.start()
+        if notification_engine:
+            notification_engine.delivery_scheduler.start()
+            notification_engine.counters.start()
+    except Exception as e:
+        logger.warning(f"⚠️ Notification workers not started: {e}")
+
     # Start the scheduler in a background thread (guarded)
     if 'run_scheduler' in globals():
         scheduler_thread = threading.Thread(target=run_scheduler, daemon=True)
@@ -2312,6 +2365,29 @@ async def startup_event():
 
     logger.info("✅ AI Service startup completed") 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Application shutdown event: stop notification workers and persist buffered state."""
+    try:
+        from endpoints_notifications import trigger_queue, notification_engine, push_outbox, queue_backend
+        # Stop producing work first; queued triggers and scheduled
+        # notifications stay in their backends for the next start
+        if trigger_queue:
+            await trigger_queue.stop()
+        if notification_engine:
+            await notification_engine.delivery_scheduler.stop()
+            await notification_engine.counters.stop()
+            # Learned profile changes are only written every few seconds
+            await notification_engine.personalization.flush_profiles()
+            await notification_engine.writer.flush()
+        if push_outbox:
+            await push_outbox.stop()
+        if queue_backend:
+            await asyncio.to_thread(queue_backend.close)
+        logger.info("👋 Notification workers stopped")
+    except Exception as e:
+        logger.error(f"❌ Error stopping notification workers: {e}", exc_info=True)
+
 @app.get("/health")
 async def health_check():
     """
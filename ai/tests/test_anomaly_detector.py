@@ -0,0 +1,82 @@
+import asyncio
+import unittest
+from datetime import datetime, timedelta
+from ai.core.notifications.anomaly_detector import AnomalyDetector
+from ai.core.notifications.feature_store import UserFeatureStore
+from ai.core.notifications.notification_types import NotificationContext
+
+def _history(now, count=30):
+    return [
+        {'id': f't{i}', 'date': (now - timedelta(days=count - i)).replace(hour=13).isoformat(),
+         'amount': 200 + (i % 5) * 10, 'category': 'Food', 'vendor': 'Cafe', 'type': 'expense'}
+        for i in range(count)
+    ]
+
+class TestAnomalyDetector(unittest.TestCase):
+
+    def setUp(self):
+        self.now = datetime.now().replace(hour=13, minute=0, second=0, microsecond=0)
+        self.store = UserFeatureStore()
+        self.store.seed('user-1', _history(self.now))
+        self.detector = AnomalyDetector(feature_store=self.store)
+
+    def detect(self, transaction):
+        return asyncio.run(self.detector.detect_anomalies(transaction, 'user-1', NotificationContext()))
+
+    def test_usual_transaction_is_not_flagged(self):
+        transaction = {'date': self.now.isoformat(), 'amount': 220, 'category': 'Food', 'vendor': 'Cafe'}
+        self.assertIsNone(self.detect(transaction))
+
+    def test_amount_far_above_category_baseline_is_flagged(self):
+        transaction = {'date': self.now.isoformat(), 'amount': 2000, 'category': 'Food', 'vendor': 'Cafe'}
+        result = self.detect(transaction)
+        self.assertTrue(any(reason.endswith('your usual Food spending') for reason in result['reasons']))
+        self.assertGreater(result['signals']['amount_zscore'], AnomalyDetector.AMOUNT_ZSCORE_THRESHOLD)
+
+    def test_rapid_transactions_are_flagged(self):
+        for i in range(4):
+            self.store.record_transaction('user-1', {
+                'id': f'burst-{i}', 'date': (self.now + timedelta(minutes=i)).isoformat(),
+                'amount': 210, 'category': 'Food', 'vendor': 'Cafe',
+            })
+        transaction = {'date': (self.now + timedelta(minutes=5)).isoformat(), 'amount': 210, 'category': 'Food', 'vendor': 'Cafe'}
+        self.assertIn('Multiple transactions in very short time', self.detect(transaction)['reasons'])
+
+    def test_batch_scores_velocity_within_the_batch(self):
+        batch = [
+            {'id': f'sms-{i}', 'date': (self.now + timedelta(minutes=i)).isoformat(),
+             'amount': 210, 'category': 'Food', 'vendor': 'Cafe'}
+            for i in range(6)
+        ]
+        batch.reverse()
+
+        results = self.detector.detect_anomalies_batch(batch, 'user-1')
+
+        self.assertEqual(len(results), 6)
+        self.assertIsNone(results[-1])
+        self.assertIn('Multiple transactions in very short time', results[0]['reasons'])
+        self.assertEqual(self.store.get('user-1').transaction_count, 30)
+
+    def test_batch_velocity_matches_one_at_a_time_scoring(self):
+        # A date-only import: every row shares a timestamp
+        day = self.now.date().isoformat()
+        batch = [
+            {'id': f'imp-{i}', 'date': day, 'amount': 6000 if i % 2 else 210, 'category': 'Food', 'vendor': 'Cafe'}
+            for i in range(6)
+        ]
+        batch += [
+            {'id': 'later', 'date': (self.now + timedelta(minutes=3)).isoformat(),
+             'amount': 7000, 'category': 'Food', 'vendor': 'Cafe'},
+        ]
+        engine = self.detector.engine
+        features = self.store.get('user-1')
+
+        batched = engine._score_batch_vectorized(features, batch)
+        sequential = engine._score_batch_sequential(features, batch)
+
+        self.assertEqual([s.burst_count for s in batched], [s.burst_count for s in sequential])
+        self.assertEqual([s.high_value_count for s in batched], [s.high_value_count for s in sequential])
+        self.assertEqual([s.burst_count for s in batched[:6]], [1, 2, 3, 4, 5, 6])
+
+if __name__ == '__main__':
+    unittest.main()
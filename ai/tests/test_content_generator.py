@@ -0,0 +1,86 @@
+import asyncio
+import unittest
+from ai.core.notifications.content_generator import ContentGenerator
+from ai.core.notifications.notification_types import (
+    NotificationCategory,
+    NotificationContext,
+    NotificationTrigger,
+)
+
+def make_trigger(user_id, vendor):
+    return NotificationTrigger(
+        trigger_type='transaction_created',
+        user_id=user_id,
+        data={'transaction': {'amount': 250.0, 'vendor': vendor, 'category': 'Food'}},
+    )
+
+class ScriptedGenerator(ContentGenerator):
+    """Answers every prompt with the next scripted response instead of calling Gemini"""
+
+    def __init__(self, responses):
+        super().__init__()
+        self.responses = list(responses)
+        self.prompts = []
+
+    async def call(self, user_id, prompt, max_tokens=ContentGenerator.MAX_TOKENS):
+        self.prompts.append((user_id, prompt))
+        return self.responses.pop(0)
+
+class TestContentGenerator(unittest.TestCase):
+
+    def test_template_naming_a_vendor_is_not_shared(self):
+        generator = ScriptedGenerator([
+            "☕ Coffee at Blue Tokai\n{amount} spent at blue tokai on {category}.",
+            "☕ Coffee run\n₹{amount} spent at {vendor}.",
+        ])
+        category = NotificationCategory.SMART_TRANSACTION
+
+        async def scenario():
+            first = await generator.generate(make_trigger('user-1', 'Blue Tokai'), category, NotificationContext(), 'prompt')
+            second = await generator.generate(make_trigger('user-2', 'Third Wave'), category, NotificationContext(), 'prompt')
+            third = await generator.generate(make_trigger('user-3', 'Starbucks'), category, NotificationContext(), 'prompt')
+            return first, second, third
+
+        first, second, third = asyncio.run(scenario())
+
+        key_one = generator.template_for(make_trigger('user-1', 'Blue Tokai'), category, NotificationContext())[0]
+        key_two = generator.template_for(make_trigger('user-2', 'Third Wave'), category, NotificationContext())[0]
+        self.assertEqual(key_one, key_two)
+
+        self.assertIn('Blue Tokai', first[0])
+        self.assertNotIn('Blue Tokai', ' '.join(second))
+        self.assertEqual(second, ('☕ Coffee run', '₹250.00 spent at Third Wave.'))
+        self.assertNotIn('Third Wave', ' '.join(third))
+        self.assertEqual(third, ('☕ Coffee run', '₹250.00 spent at Starbucks.'))
+        self.assertEqual(len(generator.prompts), 2)
+
+    def test_recommendations_are_part_of_the_key(self):
+        generator = ContentGenerator()
+        category = NotificationCategory.SMART_TRANSACTION
+        plain = generator.template_for(make_trigger('user-1', 'Cafe'), category, NotificationContext())[0]
+        advised = generator.template_for(
+            make_trigger('user-1', 'Cafe'), category, NotificationContext(recommendations=['Cook at home'])
+        )[0]
+        self.assertNotEqual(plain, advised)
+
+    def test_batches_are_charged_per_user_and_need_every_id(self):
+        category = NotificationCategory.SMART_TRANSACTION
+        items = [
+            (NotificationTrigger(trigger_type='transaction_digest', user_id=user_id, data={}), category, NotificationContext(), f'prompt {i}')
+            for i, user_id in enumerate(['user-1', 'user-2', 'user-1'])
+        ]
+        generator = ScriptedGenerator([
+            # user-1's batch numbers both answers 1
+            '[{"id": 1, "title": "A", "body": "a"}, {"id": 1, "title": "C", "body": "c"}]',
+            "B\nb",
+            "A\na",
+            "C\nc",
+        ])
+
+        results = asyncio.run(generator.generate_batch(items))
+
+        self.assertEqual(results, [('A', 'a'), ('B', 'b'), ('C', 'c')])
+        self.assertEqual([user_id for user_id, _ in generator.prompts], ['user-1', 'user-2', 'user-1', 'user-1'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import asyncio
+import unittest
+from ai.core.notifications.context_generator import ContextGenerator
+from ai.core.notifications.feature_store import UserFeatureStore
+from ai.core.notifications.notification_types import NotificationTrigger, UserNotificationPreferences
+
+def make_trigger(user_id, transaction):
+    return NotificationTrigger(trigger_type='transaction_created', user_id=user_id, data={'transaction': transaction})
+
+class TestContextGenerator(unittest.TestCase):
+
+    def generate(self, generator, trigger):
+        return asyncio.run(generator.generate_context(trigger, UserNotificationPreferences(user_id=trigger.user_id)))
+
+    def test_average_transaction_amount_ignores_income(self):
+        store = UserFeatureStore()
+        store.seed('user-1', [
+            {'id': 't1', 'date': '2024-05-01T10:00:00', 'amount': 100, 'category': 'Food', 'type': 'expense'},
+            {'id': 't2', 'date': '2024-05-02T10:00:00', 'amount': 300, 'category': 'Food', 'type': 'expense'},
+            {'id': 't3', 'date': '2024-05-03T10:00:00', 'amount': 50000, 'category': 'Salary', 'type': 'income'},
+        ])
+        generator = ContextGenerator(feature_store=store)
+
+        context = self.generate(generator, make_trigger('user-1', {'amount': 150, 'category': 'Food'}))
+
+        self.assertEqual(context.user_spending_pattern['average_transaction_amount'], 200.0)
+    def test_warm_users_get_recent_and_similar_transactions(self):
+        store = UserFeatureStore()
+        store.seed('user-1', [
+            {'id': 't1', 'date': '2024-05-01T10:00:00', 'amount': 100, 'category': 'Food', 'vendor': 'Cafe'},
+            {'id': 't2', 'date': '2024-05-02T10:00:00', 'amount': 900, 'category': 'Travel', 'vendor': 'Airline'},
+        ])
+        store.record_transaction('user-1', {'id': 't3', 'date': '2024-05-03T10:00:00', 'amount': 120, 'category': 'Food', 'vendor': 'Cafe'})
+        # No db: a window read would come back empty
+        generator = ContextGenerator(feature_store=store)
+
+        context = self.generate(generator, make_trigger('user-1', {'amount': 150, 'category': 'Food', 'vendor': 'Cafe'}))
+
+        self.assertEqual([t['id'] for t in context.transaction_history], ['t3', 't2', 't1'])
+        self.assertEqual([t['id'] for t in context.similar_transactions], ['t3', 't1'])
+
+if __name__ == '__main__':
+    unittest.main()
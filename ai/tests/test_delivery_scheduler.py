@@ -0,0 +1,97 @@
+import asyncio
+import unittest
+from datetime import datetime
+from ai.core.notifications.delivery_scheduler import DeliveryScheduler
+from ai.core.notifications.notification_types import (
+    Notification,
+    NotificationCategory,
+    NotificationContext,
+    NotificationPriority,
+)
+from ai.core.services.queue_backends import InMemoryQueueBackend
+
+def make_notification(i):
+    return Notification(
+        id=f'notif-{i}',
+        user_id='user-1',
+        category=NotificationCategory.SMART_TRANSACTION,
+        priority=NotificationPriority.LOW,
+        title='Payment Made',
+        body='₹100.00 spent at Cafe',
+        importance_score=50.0,
+        relevance_score=40.0,
+        context=NotificationContext(),
+    )
+
+class FlakyDeliver:
+    """Deliver callback failing its first fail_times calls"""
+
+    def __init__(self, fail_times):
+        self.fail_times = fail_times
+        self.calls = 0
+        self.delivered = []
+
+    async def __call__(self, notifications):
+        self.calls += 1
+        if self.fail_times:
+            self.fail_times -= 1
+            raise RuntimeError('firestore unavailable')
+        self.delivered.extend(n.id for n in notifications)
+
+class TestDeliveryScheduler(unittest.TestCase):
+
+    def run_scheduler(self, deliver, count, **kwargs):
+        async def run():
+            scheduler = DeliveryScheduler(deliver, backend=InMemoryQueueBackend(), base_delay_seconds=0.01, **kwargs)
+            for i in range(count):
+                scheduler.schedule(make_notification(i), datetime.now())
+            for _ in range(200):
+                await asyncio.sleep(0.01)
+                if not scheduler.backend.count(scheduler.QUEUE_NAME):
+                    break
+            await scheduler.stop()
+            return scheduler
+        return asyncio.run(run())
+
+    def test_failed_batch_is_retried(self):
+        deliver = FlakyDeliver(fail_times=2)
+        scheduler = self.run_scheduler(deliver, 3)
+
+        self.assertEqual(sorted(deliver.delivered), ['notif-0', 'notif-1', 'notif-2'])
+        stats = scheduler.stats()
+        self.assertEqual(stats['delivered'], 3)
+        self.assertEqual(stats['retried'], stats['failed'])
+        self.assertGreaterEqual(stats['retried'], 2)
+        self.assertEqual(stats['dead_letter'], 0)
+
+    def test_batch_is_dead_lettered_after_max_attempts(self):
+        deliver = FlakyDeliver(fail_times=10)
+        scheduler = self.run_scheduler(deliver, 2, max_attempts=3)
+
+        self.assertEqual(deliver.delivered, [])
+        stats = scheduler.stats()
+        self.assertEqual(stats['dead_lettered'], 2)
+        self.assertEqual(stats['pending'], 0)
+        dead = scheduler.backend.load_pending(scheduler.DEAD_LETTER_QUEUE)
+        self.assertEqual([item.payload['attempt'] for item in dead], [3, 3])
+        self.assertEqual(dead[0].payload['last_error'], 'firestore unavailable')
+    def test_only_notifications_reported_failed_are_retried(self):
+        seen = []
+        failures = {'notif-1': 1}
+
+        async def deliver(notifications):
+            seen.extend(n.id for n in notifications)
+            failed = [n.id for n in notifications if failures.get(n.id)]
+            for notification_id in failed:
+                failures[notification_id] -= 1
+            return failed
+
+        scheduler = self.run_scheduler(deliver, 2)
+
+        self.assertEqual(seen.count('notif-0'), 1)
+        self.assertEqual(seen.count('notif-1'), 2)
+        self.assertEqual(scheduler.stats()['delivered'], 2)
+        self.assertEqual(scheduler.stats()['retried'], 1)
+
+if __name__ == '__main__':
+    unittest.main()
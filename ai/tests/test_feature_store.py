@@ -0,0 +1,55 @@
+import unittest
+from ai.core.notifications.feature_store import UserFeatureStore
+
+class TestUserFeatureStore(unittest.TestCase):
+
+    def test_seed_and_record_update_rolling_features(self):
+        store = UserFeatureStore()
+        store.seed('user-1', [
+            {'id': 't1', 'date': '2024-05-01T10:00:00', 'amount': 100, 'category': 'Food', 'vendor': 'Cafe'},
+            {'id': 't2', 'date': '2024-05-02T11:00:00', 'amount': 300, 'category': 'Food', 'vendor': 'Cafe'},
+        ])
+
+        self.assertTrue(store.record_transaction('user-1', {'id': 't3', 'date': '2024-05-03T10:00:00', 'amount': 200, 'category': 'Food'}))
+        self.assertFalse(store.record_transaction('user-1', {'id': 't3', 'date': '2024-05-03T10:00:00', 'amount': 200, 'category': 'Food'}))
+
+        features = store.get('user-1')
+        food = features.category('Food')
+        self.assertEqual(food.count, 3)
+        self.assertAlmostEqual(food.mean, 200.0)
+        self.assertAlmostEqual(food.std, 100.0)
+        self.assertEqual(food.total_for_month('2024-05'), 600.0)
+        self.assertEqual(features.merchant('Cafe').count, 2)
+        self.assertEqual(features.peak_hours(1), [10])
+
+    def test_recent_transactions_are_bounded_and_newest_first(self):
+        store = UserFeatureStore()
+        features = store.seed('user-1', [
+            {'id': f't{day}', 'date': f'2024-05-{day:02d}T10:00:00', 'amount': day, 'category': 'Food', 'note': 'x'}
+            for day in range(1, 29)
+        ])
+        features.recent = type(features.recent)(features.recent, maxlen=5)
+
+        store.record_transaction('user-1', {'id': 'late', 'date': '2024-05-20T12:00:00', 'amount': 1})
+        store.record_transaction('user-1', {'id': 'old', 'date': '2024-04-01T12:00:00', 'amount': 1})
+
+        recent = features.recent_transactions()
+        self.assertEqual([t['id'] for t in recent], ['t28', 't27', 't26', 't25', 't24'])
+        self.assertNotIn('note', recent[0])
+
+        store.record_transaction('user-1', {'id': 'mid', 'date': '2024-05-26T12:00:00', 'amount': 1})
+        self.assertEqual([t['id'] for t in features.recent_transactions()], ['t28', 't27', 'mid', 't26', 't25'])
+
+    def test_least_recently_used_user_is_evicted(self):
+        store = UserFeatureStore(max_users=2)
+        store.seed('a', [])
+        store.seed('b', [])
+        store.get('a')
+        store.seed('c', [])
+
+        self.assertIsNotNone(store.get('a'))
+        self.assertIsNone(store.get('b'))
+        self.assertFalse(store.record_transaction('b', {'amount': 10}))
+
+if __name__ == '__main__':
+    unittest.main()
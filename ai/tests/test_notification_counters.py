@@ -0,0 +1,85 @@
+import asyncio
+import unittest
+from datetime import datetime
+from ai.core.notifications.notification_counters import NotificationCounters
+
+class FakeDocument:
+    def __init__(self, data):
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self):
+        return dict(self._data)
+
+class FakeDB:
+    """Firestore stand-in serving one counters document per user"""
+
+    def __init__(self, counters):
+        self.counters = counters
+
+    def collection(self, name):
+        counters = self.counters
+
+        class Reference:
+            def __init__(self, user_id):
+                self.user_id = user_id
+
+            def get(self, *args, **kwargs):
+                return FakeDocument(counters.get(self.user_id))
+
+        class Collection:
+            def document(self, user_id):
+                return Reference(user_id)
+
+        return Collection()
+
+class RecordingCounters(NotificationCounters):
+    """Answers the aggregation fallback and records reconciles instead of querying"""
+
+    AGGREGATED = {'total_notifications': 40, 'unread_count': 7, 'by_category': {}, 'by_priority': {}, 'recent_count': 2}
+
+    def __init__(self, counters):
+        super().__init__(FakeDB(counters), writer=object())
+        self.reconciles = []
+
+    async def aggregate_stats(self, user_id):
+        return dict(self.AGGREGATED)
+
+    async def reconcile(self, user_id):
+        self.reconciles.append(user_id)
+
+class TestNotificationCounters(unittest.TestCase):
+
+    def get_stats(self, counters, user_id):
+        async def run():
+            result = await counters.get_stats(user_id)
+            await asyncio.sleep(0)
+            return result
+        return asyncio.run(run())
+
+    def test_unreconciled_counters_fall_back_to_aggregation(self):
+        # Created by the first increment after counters shipped
+        counters = RecordingCounters({'user-1': {'total': 1, 'unread': 1, 'by_category': {'bill_reminder': 1}}})
+
+        stats = self.get_stats(counters, 'user-1')
+
+        self.assertEqual(stats, RecordingCounters.AGGREGATED)
+        self.assertEqual(counters.reconciles, ['user-1'])
+        self.assertEqual(counters.stats()['aggregation_fallbacks'], 1)
+
+    def test_reconciled_counters_are_served_from_the_document(self):
+        now = datetime.now().isoformat()
+        counters = RecordingCounters({'user-1': {
+            'total': 3, 'unread': 2, 'by_category': {'bill_reminder': 3}, 'by_priority': {'high': 3},
+            'recent_hours': {}, 'reconciled_at': now,
+        }})
+
+        stats = self.get_stats(counters, 'user-1')
+
+        self.assertEqual(stats['total_notifications'], 3)
+        self.assertEqual(stats['unread_count'], 2)
+        self.assertEqual(stats['by_category'], {'bill_reminder': 3})
+        self.assertEqual(counters.reconciles, [])
+
+if __name__ == '__main__':
+    unittest.main()
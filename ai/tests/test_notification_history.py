@@ -0,0 +1,69 @@
+import tracemalloc
+import unittest
+from ai.core.notifications.notification_history import NotificationHistory
+from ai.core.notifications.notification_types import (
+    Notification,
+    NotificationCategory,
+    NotificationContext,
+    NotificationPriority,
+)
+
+def make_notification(i, user_id, context=None):
+    return Notification(
+        id=f'notif-{i}',
+        user_id=user_id,
+        category=NotificationCategory.SMART_TRANSACTION,
+        priority=NotificationPriority.LOW,
+        title='Payment Made',
+        body='₹100.00 spent at Cafe',
+        importance_score=50.0,
+        relevance_score=40.0,
+        context=context or NotificationContext(),
+    )
+
+class TestNotificationHistory(unittest.TestCase):
+
+    def test_ring_buffer_keeps_latest_summaries(self):
+        history = NotificationHistory(per_user=3)
+        for i in range(5):
+            history.add(make_notification(i, 'user-1'))
+
+        recent = history.recent('user-1')
+        self.assertEqual([s.id for s in recent], ['notif-4', 'notif-3', 'notif-2'])
+        self.assertEqual(recent[0].category, 'smart_transaction')
+        self.assertEqual(recent[0].importance_score, 50.0)
+        self.assertEqual(history.recent('someone-else'), [])
+
+    def test_least_recently_used_user_is_evicted(self):
+        history = NotificationHistory(max_users=2)
+        history.add(make_notification(1, 'a'))
+        history.add(make_notification(2, 'b'))
+        history.add(make_notification(3, 'a'))
+        history.add(make_notification(4, 'c'))
+
+        self.assertEqual(len(history), 2)
+        self.assertEqual(history.recent('b'), [])
+        self.assertEqual(len(history.recent('a')), 2)
+
+    def test_memory_stays_flat_under_sustained_load(self):
+        history = NotificationHistory(per_user=20, max_users=500)
+        context = NotificationContext(transaction_history=[{'amount': i, 'vendor': 'Cafe'} for i in range(50)])
+
+        def load(start, count):
+            for i in range(start, start + count):
+                history.add(make_notification(i, f'user-{i % 1000}', context))
+
+        tracemalloc.start()
+        try:
+            load(0, 10000)
+            warm, _ = tracemalloc.get_traced_memory()
+            load(10000, 20000)
+            after, _ = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        self.assertEqual(len(history), 500)
+        self.assertLess(after, warm * 1.1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+import asyncio
+import unittest
+from ai.core.notifications.personalization_engine import PersonalizationEngine
+from ai.core.notifications.notification_types import (
+    Notification,
+    NotificationAction,
+    NotificationCategory,
+    NotificationContext,
+    NotificationPriority,
+)
+
+class FakeDocument:
+    def __init__(self, data):
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self):
+        return dict(self._data)
+
+class FakeRef:
+    def __init__(self, store, key):
+        self.store = store
+        self.key = key
+
+    def get(self):
+        self.store.reads += 1
+        return FakeDocument(self.store.docs.get(self.key))
+
+    def set(self, data):
+        self.store.docs[self.key] = dict(data)
+
+class FakeDB:
+    """Firestore stand-in counting document reads"""
+
+    def __init__(self):
+        self.docs = {}
+        self.reads = 0
+
+    def collection(self, name):
+        db = self
+
+        class Collection:
+            def document(self, doc_id):
+                return FakeRef(db, (name, doc_id))
+
+        return Collection()
+
+class FakeWriter:
+    """Stands in for NotificationWriter, recording each submitted group"""
+
+    def __init__(self):
+        self.groups = []
+
+    def submit(self, ops):
+        self.groups.append(ops)
+        future = asyncio.get_running_loop().create_future()
+        future.set_result(True)
+        return future
+
+def make_notification(i, user_id):
+    return Notification(
+        id=f'notif-{i}',
+        user_id=user_id,
+        category=NotificationCategory.SMART_TRANSACTION,
+        priority=NotificationPriority.LOW,
+        title='Payment Made',
+        body='₹100.00 spent at Cafe',
+        importance_score=50.0,
+        relevance_score=40.0,
+        context=NotificationContext(),
+    )
+
+class TestPersonalizationEngine(unittest.TestCase):
+
+    def test_preferences_are_cached_and_written_through(self):
+        db = FakeDB()
+        engine = PersonalizationEngine(db)
+
+        async def scenario():
+            first = await engine.get_user_preferences('user-1')
+            again = await engine.get_user_preferences('user-1')
+            self.assertIs(first, again)
+            self.assertEqual(db.reads, 1)
+
+            first.quiet_hours_enabled = not first.quiet_hours_enabled
+            await engine.save_user_preferences(first)
+            saved = await engine.get_user_preferences('user-1')
+            self.assertEqual(saved.quiet_hours_enabled, first.quiet_hours_enabled)
+            self.assertEqual(db.reads, 1)
+            self.assertIn(('notification_preferences', 'user-1'), db.docs)
+
+        asyncio.run(scenario())
+
+    def test_interaction_history_is_bounded(self):
+        engine = PersonalizationEngine()
+        engine._interaction_history.max_size = 2
+
+        async def scenario():
+            for i in range(150):
+                await engine.record_notification_created(make_notification(i, 'a'))
+            await engine.record_notification_created(make_notification(0, 'b'))
+            await engine.record_notification_created(make_notification(0, 'c'))
+
+        asyncio.run(scenario())
+        self.assertEqual(engine.stats()['history_users'], 2)
+        self.assertIsNone(engine._interaction_history.get('a'))
+        self.assertEqual(len(engine._interaction_history.get('b')), 1)
+
+    def test_profile_writes_are_debounced(self):
+        writer = FakeWriter()
+        engine = PersonalizationEngine(FakeDB(), writer, profile_flush_seconds=0.05)
+
+        async def scenario():
+            for i in range(20):
+                await engine.record_notification_created(make_notification(i, 'user-1'))
+            for i in range(20):
+                await engine.record_interaction(f'notif-{i}', NotificationAction.VIEW, 'user-1')
+            await engine.record_interaction('notif-0', NotificationAction.DISMISS, 'user-2')
+            self.assertEqual(writer.groups, [])
+            await asyncio.sleep(0.1)
+
+        asyncio.run(scenario())
+        # user-2's interaction has no known notification, so nothing changed
+        self.assertEqual([ops[0][2] for ops in writer.groups], ['user-1'])
+        profile = writer.groups[0][0][3]
+        self.assertEqual(profile['engagement_scores']['smart_transaction'], 1.0)
+        self.assertEqual(engine.stats()['dirty_profiles'], 0)
+
+    def test_flush_profiles_writes_a_snapshot_immediately(self):
+        writer = FakeWriter()
+        engine = PersonalizationEngine(FakeDB(), writer)
+
+        async def scenario():
+            await engine.record_notification_created(make_notification(1, 'user-1'))
+            await engine.record_interaction('notif-1', NotificationAction.VIEW, 'user-1')
+            await engine.flush_profiles()
+            self.assertEqual(len(writer.groups), 1)
+            await engine.record_interaction('notif-1', NotificationAction.VIEW, 'user-1')
+
+        asyncio.run(scenario())
+        self.assertEqual(writer.groups[0][0][3]['engagement_scores']['smart_transaction'], 0.6)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+import asyncio
+import unittest
+from ai.core.notifications.push_outbox import PushOutbox
+from ai.core.services.queue_backends import InMemoryQueueBackend
+
+class FakeSender:
+    """Stands in for FCMService.send_batch; tokens listed in flaky fail transiently"""
+
+    def __init__(self, tokens, flaky=None, fail_times=0):
+        self.tokens = tokens
+        self.flaky = flaky or {}
+        self.fail_times = fail_times
+        self.calls = []
+        self.delivered = []
+
+    async def send_batch(self, messages):
+        self.calls.append(len(messages))
+        if self.fail_times:
+            self.fail_times -= 1
+            return {"success": False, "error": "unavailable"}
+
+        results = []
+        for message in messages:
+            tokens = message.get('tokens')
+            if tokens is None:
+                tokens = self.tokens.get(message['user_id'], [])
+            result = {"sent": 0, "failed": 0, "retry_tokens": []}
+            for token in tokens:
+                if self.flaky.get(token, 0) > 0:
+                    self.flaky[token] -= 1
+                    result["failed"] += 1
+                    result["retry_tokens"].append(token)
+                else:
+                    result["sent"] += 1
+                    self.delivered.append(token)
+            results.append(result)
+        return {"success": True, "results": results}
+
+class TestPushOutbox(unittest.TestCase):
+
+    def run_outbox(self, sender, messages, **kwargs):
+        async def run():
+            outbox = PushOutbox(sender, backend=InMemoryQueueBackend(), base_delay_seconds=0.01, **kwargs)
+            for message in messages:
+                outbox.enqueue(message)
+            for _ in range(200):
+                await asyncio.sleep(0.01)
+                if not outbox.backend.count(outbox.QUEUE_NAME):
+                    break
+            await outbox.stop()
+            return outbox
+        return asyncio.run(run())
+
+    def test_ready_pushes_share_one_batch(self):
+        sender = FakeSender({f'user-{i}': [f'token-{i}'] for i in range(30)})
+        outbox = self.run_outbox(sender, [{'user_id': f'user-{i}', 'title': 't', 'body': 'b'} for i in range(30)])
+
+        stats = outbox.stats()
+        self.assertEqual(stats['delivered'], 30)
+        self.assertEqual(stats['success_rate'], 1.0)
+        self.assertEqual(sender.calls, [30])
+
+    def test_only_failed_tokens_are_retried(self):
+        sender = FakeSender({'u': ['good', 'flaky']}, flaky={'flaky': 2})
+        outbox = self.run_outbox(sender, [{'user_id': 'u', 'title': 't', 'body': 'b'}])
+
+        stats = outbox.stats()
+        self.assertEqual(stats['delivered'], 1)
+        self.assertEqual(stats['retried'], 2)
+        self.assertEqual(outbox.tokens_sent, 2)  # 'good' once, 'flaky' on the third attempt
+
+    def test_exhausted_pushes_are_dead_lettered(self):
+        sender = FakeSender({'u': ['token']}, fail_times=10)
+        outbox = self.run_outbox(sender, [{'user_id': 'u', 'title': 't', 'body': 'b'}], max_attempts=3)
+
+        self.assertEqual(outbox.stats()['dead_lettered'], 1)
+        dead = outbox.dead_letters()
+        self.assertEqual(len(dead), 1)
+        self.assertEqual(dead[0]['attempt'], 3)
+        self.assertEqual(dead[0]['last_error'], 'unavailable')
+
+    def test_requeued_dead_letters_retry_only_failed_tokens(self):
+        sender = FakeSender({'u': ['good', 'flaky']}, flaky={'flaky': 3})
+
+        async def run():
+            outbox = PushOutbox(sender, backend=InMemoryQueueBackend(), base_delay_seconds=0.01, max_attempts=3)
+            outbox.enqueue({'user_id': 'u', 'title': 't', 'body': 'b'})
+            while not outbox.backend.count(outbox.DEAD_LETTER_QUEUE):
+                await asyncio.sleep(0.01)
+            dead = outbox.dead_letters()
+            self.assertEqual(outbox.requeue_dead_letters(), 1)
+            while outbox.backend.count(outbox.QUEUE_NAME):
+                await asyncio.sleep(0.01)
+            await outbox.stop()
+            return outbox, dead
+
+        outbox, dead = asyncio.run(run())
+
+        self.assertEqual(dead[0]['tokens'], ['flaky'])
+        self.assertEqual(dead[0]['sent'], 1)
+        self.assertEqual(sender.delivered, ['good', 'flaky'])
+        self.assertEqual(outbox.stats()['dead_letter'], 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import os
+import tempfile
+import threading
+import unittest
+from ai.core.services.queue_backends import QueueBackend, SQLiteQueueBackend
+
+class TestSQLiteQueueBackend(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'queue.db')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_writes_happen_on_the_writer_thread(self):
+        backend = SQLiteQueueBackend(self.path)
+        threads = set()
+        original = backend._commit
+
+        def record(statements):
+            threads.add(threading.get_ident())
+            original(statements)
+
+        backend._commit = record
+        kept = backend.put('q', {'n': 1})
+        dropped = backend.put('q', {'n': 2})
+        backend.ack('q', dropped.id)
+
+        self.assertEqual([item.id for item in backend.load_pending('q')], [kept.id])
+        self.assertEqual(threads, {backend._writer.ident})
+        backend.close()
+
+    def test_accepted_writes_survive_close(self):
+        backend = SQLiteQueueBackend(self.path)
+        for i in range(100):
+            backend.put('q', {'n': i}, available_at=float(i))
+        backend.close()
+
+        reopened = SQLiteQueueBackend(self.path)
+        items = reopened.load_pending('q')
+        self.assertEqual([item.payload['n'] for item in items], list(range(100)))
+        self.assertEqual(reopened.count('q'), 100)
+        reopened.close()
+
+    def test_queues_sharing_a_backend_stay_separate(self):
+        backend = SQLiteQueueBackend(self.path)
+        trigger = backend.put('triggers', {'n': 1})
+        backend.put('pushes', {'n': 2})
+        backend.ack('pushes', trigger.id)
+
+        self.assertEqual([item.payload for item in backend.load_pending('triggers')], [{'n': 1}])
+        self.assertEqual([item.payload for item in backend.load_pending('pushes')], [{'n': 2}])
+        backend.close()
+
+    def test_backends_must_implement_the_interface(self):
+        class Partial(QueueBackend):
+            def put(self, queue, payload, available_at=0.0):
+                pass
+
+        with self.assertRaises(TypeError):
+            Partial()
+
+if __name__ == '__main__':
+    unittest.main()
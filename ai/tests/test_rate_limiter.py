@@ -0,0 +1,61 @@
+import asyncio
+import unittest
+from ai.core.notifications.rate_limiter import InMemoryRateLimiter
+
+class FakeClock:
+    def __init__(self, now=1_700_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+class TestInMemoryRateLimiter(unittest.TestCase):
+
+    def run_async(self, coro):
+        return asyncio.run(coro)
+
+    def test_daily_limit_does_not_reset_hourly(self):
+        clock = FakeClock(1_700_006_400.0)  # start of a day bucket
+        limiter = InMemoryRateLimiter(clock=clock)
+
+        for _ in range(3):
+            self.assertTrue(self.run_async(limiter.check('u', per_hour=10, per_day=3)))
+            self.run_async(limiter.record('u'))
+        self.assertFalse(self.run_async(limiter.check('u', per_hour=10, per_day=3)))
+
+        clock.now += 2 * 3600
+        self.assertFalse(self.run_async(limiter.check('u', per_hour=10, per_day=3)))
+        self.assertTrue(self.run_async(limiter.check('u', per_hour=10, per_day=50)))
+
+    def test_hourly_window_slides(self):
+        clock = FakeClock(1_700_002_800.0)  # start of an hour bucket
+        limiter = InMemoryRateLimiter(clock=clock)
+
+        for _ in range(4):
+            self.run_async(limiter.record('u'))
+        self.assertFalse(self.run_async(limiter.check('u', per_hour=4, per_day=50)))
+
+        # Half way through the next hour, half of the previous hour still counts
+        clock.now += 3600 + 1800
+        hourly, daily = limiter.counts('u')
+        self.assertAlmostEqual(hourly, 2.0)
+        self.assertTrue(self.run_async(limiter.check('u', per_hour=4, per_day=50)))
+
+    def test_memory_stays_bounded(self):
+        clock = FakeClock()
+        limiter = InMemoryRateLimiter(max_users=100, clock=clock)
+
+        for i in range(1000):
+            self.run_async(limiter.record(f'user-{i}'))
+        self.assertEqual(len(limiter), 100)
+        self.assertEqual(limiter.stats()['slots'], 100)
+
+        # Users idle past both windows are dropped and their slots reused
+        clock.now += limiter.idle_seconds
+        self.run_async(limiter.check('someone', per_hour=10, per_day=50))
+        self.assertEqual(len(limiter), 0)
+        self.run_async(limiter.record('new-user'))
+        self.assertEqual(limiter.stats()['slots'], 100)
+
+if __name__ == '__main__':
+    unittest.main()
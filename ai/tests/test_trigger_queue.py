@@ -0,0 +1,61 @@
+import asyncio
+import unittest
+from datetime import datetime
+from ai.core.notifications.trigger_queue import TriggerQueue
+from ai.core.notifications.notification_types import (
+    Notification,
+    NotificationCategory,
+    NotificationContext,
+    NotificationPriority,
+    NotificationTrigger,
+)
+from ai.core.services.queue_backends import InMemoryQueueBackend
+
+class FakeEngine:
+    """Creates one notification per trigger; triggers with data['defer'] are scheduled"""
+
+    async def process_user_batches(self, batches):
+        notifications = []
+        for user_id, triggers in batches.items():
+            for i, trigger in enumerate(triggers):
+                notifications.append(Notification(
+                    id=f'{user_id}-{i}',
+                    user_id=user_id,
+                    category=NotificationCategory.SMART_TRANSACTION,
+                    priority=NotificationPriority.HIGH,
+                    title='Payment Made',
+                    body='₹100.00 spent at Cafe',
+                    importance_score=80.0,
+                    relevance_score=80.0,
+                    context=NotificationContext(),
+                    optimal_delivery_time=datetime.now() if trigger.data.get('defer') else None,
+                ))
+        return notifications
+
+class TestTriggerQueue(unittest.TestCase):
+
+    def test_created_notifications_are_counted_and_pushed(self):
+        pushed = []
+
+        async def push_sender(notifications):
+            pushed.extend(n.id for n in notifications)
+
+        async def run():
+            queue = TriggerQueue(FakeEngine(), backend=InMemoryQueueBackend(), coalesce_window_seconds=0)
+            queue.push_sender = push_sender
+            await queue.enqueue(NotificationTrigger(trigger_type='transaction_created', user_id='user-1', data={}))
+            await queue.enqueue(NotificationTrigger(trigger_type='transaction_created', user_id='user-1', data={'defer': True}))
+            await queue.enqueue(NotificationTrigger(trigger_type='transaction_created', user_id='user-2', data={}))
+            await asyncio.sleep(0)
+            await queue.wait_idle()
+            await queue.stop()
+            return queue
+
+        queue = asyncio.run(run())
+
+        self.assertEqual(queue.stats()['created'], 3)
+        self.assertEqual(queue.stats()['processed'], 3)
+        self.assertEqual(sorted(pushed), ['user-1-0', 'user-2-0'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,27 @@
+import unittest
+from unittest.mock import patch
+from ai.core.services.ttl_cache import TTLCache
+
+class TestTTLCache(unittest.TestCase):
+
+    def test_entries_expire_after_ttl(self):
+        cache = TTLCache(max_size=10, ttl_seconds=60)
+        with patch('ai.core.services.ttl_cache.time.monotonic', return_value=1000.0):
+            cache.set('user-1', {'predicted_spending': 100})
+        with patch('ai.core.services.ttl_cache.time.monotonic', return_value=1059.0):
+            self.assertEqual(cache.get('user-1'), {'predicted_spending': 100})
+        with patch('ai.core.services.ttl_cache.time.monotonic', return_value=1061.0):
+            self.assertIsNone(cache.get('user-1'))
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = TTLCache(max_size=2, ttl_seconds=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+
+        self.assertEqual(cache.get_many(['a', 'b', 'c']), {'a': 1, 'c': 3})
+        self.assertEqual(cache.evictions, 1)
+
+if __name__ == '__main__':
+    unittest.main()